@@ -1,4 +1,4 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.models import Permission
 from django.db import models
 from django import forms
@@ -8,7 +8,8 @@ from django.utils.safestring import mark_safe
 from sic.models import *
 from sic.mail import Digest
 from sic.moderation import ModerationLogEntry
-from sic.jobs import Job, JobKind
+from sic.jobs import Job, JobKind, worker_name
+from sic.outbox import OutgoingEmail
 from sic.webmention import Webmention
 from sic.flatpages import DocumentationFlatPage, CommunityFlatPage, ExternalLinkFlatPage
 from sic.forms import URLField
@@ -276,8 +277,17 @@ class WebmentionAdmin(ModelAdmin):
 
 @admin.action(description="Run jobs")
 def run_jobs(modeladmin, request, queryset):
-    for job in queryset.all():
-        job.run()
+    worker = worker_name(":admin")
+    pks = Job.claim(worker, jobs=Job.unleased().filter(pk__in=queryset.values("pk")))
+    for pk in pks:
+        Job.run_claimed(pk, worker)
+    skipped = queryset.count() - len(pks)
+    if skipped:
+        modeladmin.message_user(
+            request,
+            f"Skipped {skipped} jobs that are inactive or being run by a worker.",
+            messages.WARNING,
+        )
 
 
 class ArticleAdmin(admin.ModelAdmin):
@@ -328,7 +338,16 @@ class JobAdmin(ModelAdmin):
     success.boolean = True
     ordering = ["-created", "-last_run"]
     actions = [run_jobs]
-    list_display = ["__str__", "created", "active", "periodic", "success", "last_run"]
+    list_display = [
+        "__str__",
+        "created",
+        "active",
+        "periodic",
+        "success",
+        "last_run",
+        "attempts",
+        "run_after",
+    ]
     list_filter = [
         "kind",
         "active",
@@ -336,6 +355,11 @@ class JobAdmin(ModelAdmin):
     ]
 
 
+class OutgoingEmailAdmin(ModelAdmin):
+    ordering = ["-created"]
+    list_display = ["__str__", "created", "attempts", "send_after", "last_error"]
+
+
 class JobKindAdmin(ModelAdmin):
     @admin.display(description="Does the job's dotted path resolve as a python module?")
     def resolves(self, obj):
@@ -360,6 +384,7 @@ admin.site.register(Invitation, InvitationAdmin)
 admin.site.register(Message, MessageAdmin)
 admin.site.register(Moderation)
 admin.site.register(Notification, NotificationAdmin)
+admin.site.register(OutgoingEmail, OutgoingEmailAdmin)
 admin.site.register(Story, StoryAdmin)
 admin.site.register(StoryKind, StoryKindAdmin)
 admin.site.register(StoryRemoteContent, StoryRemoteContentAdmin)
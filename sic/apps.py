@@ -85,11 +85,70 @@ class SicAppConfig(AppConfig):
     )
 
     STORIES_PER_PAGE = 20
+    # Pages up to this number are reachable by /page/<n>/ urls, further pages
+    # only through the next/previous page links.
+    MAX_OFFSET_PAGES = 10
+    # Seconds to cache the story ids of those pages of each user's front page.
+    # Invalidation only reaches other processes through a shared cache such as
+    # memcached; with a process local cache the shorter timeout applies.
+    FRONTPAGE_CACHE_TIMEOUT = 15 * 60
+    FRONTPAGE_LOCAL_CACHE_TIMEOUT = 60
+    # Votes and story edits change the front page ranking at most this often
+    FRONTPAGE_RANKING_INTERVAL = 30
+    # Seconds browsers may cache avatar images, whose URLs never change content
+    AVATAR_MAX_AGE = 365 * 24 * 60 * 60
+
+    # Run all pending jobs from a thread in every web server process, every
+    # JOB_INTERVAL, claiming JOB_WEB_BATCH_SIZE at a time.
+    # Turn this off if `manage.py run_jobs --forever` runs as its own service.
+    RUN_JOBS_IN_WEB_PROCESS = True
+    JOB_WEB_BATCH_SIZE = 5
+    # Periodic jobs, and jobs that stay active after running, run again after
+    JOB_INTERVAL = datetime.timedelta(minutes=15)
+    # Other workers may take over a claimed job after this long. The lease of
+    # a running job is renewed every third of it.
+    JOB_LEASE = datetime.timedelta(minutes=10)
+    # A job that failed n times in a row is retried after
+    # JOB_RETRY_DELAY * 2 ** (n - 1), up to JOB_MAX_RETRY_DELAY, and is given
+    # up on after JOB_MAX_ATTEMPTS failures, unless it's periodic.
+    JOB_RETRY_DELAY = datetime.timedelta(minutes=1)
+    JOB_MAX_RETRY_DELAY = datetime.timedelta(hours=6)
+    JOB_MAX_ATTEMPTS = 10
+
+    # Notification emails are queued in sic.outbox and sent from a background
+    # thread over one SMTP connection, in batches of EMAIL_BATCH_SIZE and at
+    # most one every EMAIL_SEND_INTERVAL seconds. Failed emails are retried
+    # after EMAIL_RETRY_DELAY * 2 ** (n - 1), up to EMAIL_MAX_RETRY_DELAY,
+    # and given up on after EMAIL_MAX_ATTEMPTS failures.
+    EMAIL_BATCH_SIZE = 50
+    EMAIL_SEND_INTERVAL = 0.2
+    EMAIL_LEASE = datetime.timedelta(minutes=10)
+    EMAIL_RETRY_DELAY = datetime.timedelta(minutes=1)
+    EMAIL_MAX_RETRY_DELAY = datetime.timedelta(hours=6)
+    EMAIL_MAX_ATTEMPTS = 8
+
+    # Limits on fetching the remote content of story URLs: documents are cut
+    # off after REMOTE_CONTENT_MAX_BYTES and PDFs bigger than PDF_MAX_BYTES
+    # are skipped. Text is extracted from at most PDF_MAX_PAGES pages and
+    # PDF_MAX_CHARS characters of a PDF, in a process that is killed after
+    # PDF_EXTRACTION_TIMEOUT seconds.
+    REMOTE_CONTENT_MAX_BYTES = 4 * 1024 * 1024
+    PDF_MAX_BYTES = 32 * 1024 * 1024
+    PDF_MAX_PAGES = 100
+    PDF_MAX_CHARS = 500_000
+    PDF_EXTRACTION_TIMEOUT = 60
 
     FTS_DATABASE_NAME = "fts"
     FTS_DATABASE_FILENAME = "fts.db"
     FTS_COMMENTS_TABLE_NAME = "fts5_comments"
     FTS_STORIES_TABLE_NAME = "fts5_stories"
+    # Seconds to wait for a lock on the FTS database before giving up
+    FTS_BUSY_TIMEOUT = 10.0
+    SEARCH_RESULTS_PER_PAGE = 20
+    # Relevance is the bm25() score of a match divided by
+    # 1 + (its age in days / SEARCH_RECENCY_DAYS), so that newer posts rank
+    # higher among equally good matches. None ranks by text only.
+    SEARCH_RECENCY_DAYS = 365
 
     MENTION_TOKENIZER_NAME = "mention_tokenizer"
 
@@ -190,20 +249,36 @@ class SicAppConfig(AppConfig):
         import sic.webmention
         import sic.mail
         import sic.jobs
+        import sic.outbox
         import sic.flatpages
+        import sic.voting
+        import sic.frontpage
+
+        if self.SHOW_GIT_COMMIT_IN_FOOTER:
+            from sic.build_info import build_info
+
+            build_info()
+
+        if not self.RUN_JOBS_IN_WEB_PROCESS:
+            return
 
         def sched_jobs():
-            from sic.jobs import Job
+            from sic.jobs import Job, worker_name, run_claimed_job
             import sched
             import time
 
             def exec_fn():
-                for job in Job.objects.filter(active=True, failed=False):
-                    job.run()
+                worker = worker_name(":web")
+                while True:
+                    pks = Job.claim(worker, self.JOB_WEB_BATCH_SIZE)
+                    if not pks:
+                        return
+                    for pk in pks:
+                        run_claimed_job(pk, worker)
 
             s = sched.scheduler(time.time, time.sleep)
             while True:
-                s.enter(15 * 60, 1, exec_fn)
+                s.enter(self.JOB_INTERVAL.total_seconds(), 1, exec_fn)
                 s.run(blocking=True)
 
         self.scheduling_thread = threading.Thread(target=sched_jobs, daemon=True)
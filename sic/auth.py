@@ -10,11 +10,12 @@ from django.contrib.auth.tokens import PasswordResetTokenGenerator
 from django.utils.crypto import constant_time_compare
 from django.utils.http import base36_to_int
 from django.utils.safestring import mark_safe
+from django.utils.functional import cached_property
 from django.contrib.auth.forms import AuthenticationForm as DjangoAuthenticationForm
-from django.contrib.auth import authenticate, user_logged_in, user_logged_out
+from django.contrib.auth import authenticate
+from django.db.models import Q
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from django.core.cache import cache
 from django.apps import apps
 
 config = apps.get_app_config("sic")
@@ -31,9 +32,7 @@ from sic.models import (
     StoryBookmark,
     CommentBookmark,
 )
-from sic.flatpages import DocumentationFlatPage, CommunityFlatPage, ExternalLinkFlatPage
-
-CACHE_TIMEOUT = 60 * 30
+from sic.flatpages import flatpage_links
 
 
 class SicBackend(ModelBackend):
@@ -126,12 +125,23 @@ class SicBackend(ModelBackend):
         return res
 
     def has_perm(self, user_obj, perm, obj):
-        if user_obj.is_staff or user_obj.is_superuser or user_obj.is_moderator:
+        cache = PermissionCache.of(user_obj)
+        if cache.is_privileged:
             return True
-        karma = user_obj.karma
-        is_banned = user_obj.is_banned
-        is_active = user_obj.is_active
-        can_participate = user_obj.can_participate
+        obj_pk = getattr(obj, "pk", None)
+        if obj is not None and obj_pk is None:
+            return self._has_perm(user_obj, cache, perm, obj)
+        key = (perm, type(obj), obj_pk)
+        if key not in cache.results:
+            cache.results[key] = self._has_perm(user_obj, cache, perm, obj)
+        return cache.results[key]
+
+    @staticmethod
+    def _has_perm(user_obj, cache, perm, obj):
+        karma = cache.karma
+        is_banned = cache.is_banned
+        is_active = cache.is_active
+        can_participate = cache.can_participate
         if perm in ["sic.add_tag", "sic.change_tag"]:
             return (
                 karma >= config.MIN_KARMA_TO_EDIT_TAGS
@@ -154,22 +164,20 @@ class SicBackend(ModelBackend):
             )
         elif perm in ["sic.change_story", "sic.delete_story"]:
             return (
-                obj.user == user_obj
+                obj.user_id == user_obj.pk
                 if isinstance(obj, Story)
                 else True and is_active and can_participate
             )
         elif perm in ["sic.change_comment", "sic.delete_comment"]:
             return (
-                obj.user == user_obj
+                obj.user_id == user_obj.pk
                 if isinstance(obj, Comment)
                 else True and is_active and can_participate
             )
         elif perm == "sic.add_hat":
-            return (
-                not user_obj.is_new_user and karma >= config.MIN_KARMA_TO_SUBMIT_STORIES
-            )
+            return not cache.is_new_user and karma >= config.MIN_KARMA_TO_SUBMIT_STORIES
         elif perm in ["sic.change_hat", "sic.delete_hat"]:
-            return obj.user == user_obj if isinstance(obj, Hat) else True
+            return obj.user_id == user_obj.pk if isinstance(obj, Hat) else True
         elif perm in ["sic.add_comment", "sic.add_story"]:
             return not is_banned and is_active and can_participate
         elif perm == "sic.add_message":
@@ -177,7 +185,7 @@ class SicBackend(ModelBackend):
         elif perm == "sic.add_invitation":
             return not is_banned and is_active and can_participate
         elif perm == "sic.view_message" and isinstance(obj, Message):
-            return user_obj in [obj.recipient, obj.author]
+            return user_obj.pk in [obj.recipient_id, obj.author_id]
         elif perm == "sic.change_storybookmark" and isinstance(obj, StoryBookmark):
             return user_obj.id == obj.user_id
         elif perm == "sic.change_commentbookmark" and isinstance(obj, CommentBookmark):
@@ -186,15 +194,50 @@ class SicBackend(ModelBackend):
             if is_banned or not is_active or not can_participate:
                 return False
             if isinstance(obj, TaggregationHasTag):
-                return (
-                    user_obj == obj.taggregation.creator
-                    or user_obj in obj.taggregation.moderators.all()
-                )
+                return obj.taggregation_id in cache.moderated_taggregations
             return False
         else:
             return False
 
 
+class PermissionCache:
+    """What SicBackend.has_perm() needs to know about a user, computed once
+    per user object along with the answers given so far. Since request.user
+    is loaded for every request, this lasts for one request. Stored on the
+    user object and dropped by User.invalidate_permissions()."""
+
+    ATTR = "_sic_perm_cache"
+
+    def __init__(self, user_obj):
+        self.user_pk = user_obj.pk
+        self.is_privileged = (
+            user_obj.is_staff or user_obj.is_superuser or user_obj.is_moderator
+        )
+        self.karma = user_obj.karma
+        self.is_banned = user_obj.is_banned
+        self.is_active = user_obj.is_active
+        self.can_participate = user_obj.can_participate
+        self.is_new_user = user_obj.is_new_user
+        self.results = {}
+
+    @staticmethod
+    def of(user_obj) -> "PermissionCache":
+        cache = getattr(user_obj, PermissionCache.ATTR, None)
+        if cache is None:
+            cache = PermissionCache(user_obj)
+            setattr(user_obj, PermissionCache.ATTR, cache)
+        return cache
+
+    @cached_property
+    def moderated_taggregations(self) -> set:
+        """Primary keys of the taggregations the user created or moderates."""
+        return set(
+            Taggregation.objects.filter(
+                Q(creator_id=self.user_pk) | Q(moderators__pk=self.user_pk)
+            ).values_list("pk", flat=True)
+        )
+
+
 @receiver(post_save, sender=User)
 def user_save_receiver(sender, instance, created, raw, using, update_fields, **kwargs):
     if not created:
@@ -204,78 +247,13 @@ def user_save_receiver(sender, instance, created, raw, using, update_fields, **k
     instance.save()
 
 
-@receiver(user_logged_in, sender=User)
-@receiver(user_logged_out, sender=User)
-def logout_login_hook(sender, request, user, **kwargs):
-    request.session["header_links"] = None
-    request.session["footer_links"] = None
-    cache.delete_many(["header_links", "footer_links"])
-
-
 def auth_context(request):
     is_authenticated = request.user.is_authenticated
+    header_links, footer_links = flatpage_links(is_authenticated)
     if is_authenticated:
-        header_links = request.session.get("header_links", default=None)
-        footer_links = request.session.get("footer_links", default=None)
-    else:
-        header_links = cache.get("header_links", default=None)
-        footer_links = cache.get("footer_links", default=None)
-
-    if header_links is None or footer_links is None:
-        footer_links = ""
-        header_links = ""
-        for l in (
-            DocumentationFlatPage.objects.filter(show_in_footer=True)
-            | DocumentationFlatPage.objects.filter(show_in_header=True)
-        ).order_by("order", "title"):
-            if l.flatpage_ptr.registration_required and not is_authenticated:
-                continue
-            if l.show_in_header:
-                header_links += f"""<li><a href="{l.flatpage_ptr.url}">{l.link_name if l.link_name else l.flatpage_ptr.title}</a></li>"""
-            if l.show_in_footer:
-                footer_links += f"""<li><a href="{l.flatpage_ptr.url}">{l.link_name if l.link_name else l.flatpage_ptr.title}</a></li>"""
-
-        for l in (
-            CommunityFlatPage.objects.filter(show_in_footer=True)
-            | CommunityFlatPage.objects.filter(show_in_header=True)
-        ).order_by("order", "title"):
-            if l.flatpage_ptr.registration_required and not is_authenticated:
-                continue
-            if l.show_in_header:
-                if l.show_inline:
-                    header_links += l.flatpage_ptr.content
-                else:
-                    header_links += f"""<li><a href="{l.flatpage_ptr.url}">{l.link_name if l.link_name else l.flatpage_ptr.title}</a></li>"""
-
-            if l.show_in_footer:
-                if l.show_inline:
-                    footer_links += l.flatpage_ptr.content
-                else:
-                    footer_links += f"""<li><a href="{l.flatpage_ptr.url}">{l.link_name if l.link_name else l.flatpage_ptr.title}</a></li>"""
-
-        for l in (
-            ExternalLinkFlatPage.objects.filter(show_in_footer=True)
-            | ExternalLinkFlatPage.objects.filter(show_in_header=True)
-        ).order_by("order", "title"):
-            if l.flatpage_ptr.registration_required and not is_authenticated:
-                continue
-            if l.show_in_header:
-                if l.show_inline:
-                    header_links += l.flatpage_ptr.content
-                else:
-                    header_links += f"""<li><a href="{l.flatpage_ptr.url}" rel="external nofollow">{l.link_name if l.link_name else l.flatpage_ptr.title}</a></li>"""
-            if l.show_in_footer:
-                if l.show_inline:
-                    footer_links += l.flatpage_ptr.content
-                else:
-                    footer_links += f"""<li><a href="{l.flatpage_ptr.url}" rel="external nofollow">{l.link_name if l.link_name else l.flatpage_ptr.title}</a></li>"""
-
-        if is_authenticated:
-            request.session["header_links"] = header_links
-            request.session["footer_links"] = footer_links
-        else:
-            cache.set("header_links", header_links, timeout=CACHE_TIMEOUT)
-            cache.set("footer_links", footer_links, timeout=CACHE_TIMEOUT)
+        # Sessions used to carry a copy of the links, drop it from the cookie
+        request.session.pop("header_links", None)
+        request.session.pop("footer_links", None)
 
     if is_authenticated:
         return {
@@ -0,0 +1,92 @@
+import json
+import logging
+import subprocess
+import threading
+import typing
+from pathlib import Path
+
+logger = logging.getLogger("sic")
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+# Written at deploy time by `manage.py build_info`
+BUILD_INFO_FILE = BASE_DIR / "build_info.json"
+
+
+class BuildInfo(typing.NamedTuple):
+    commit: str
+    subject: str
+    date: str
+
+
+def from_git() -> typing.Optional[BuildInfo]:
+    try:
+        output = subprocess.run(
+            [
+                "git",
+                "-C",
+                str(BASE_DIR),
+                "log",
+                "-1",
+                "--pretty=format:%h%n%s%n%cd",
+                "--date=short",
+            ],
+            capture_output=True,
+            check=True,
+            timeout=5,
+        ).stdout.decode("utf-8")
+        commit, subject, date = output.strip().split("\n")
+    except (OSError, ValueError, subprocess.SubprocessError) as exc:
+        logger.warning(f"Could not get build info from git: {exc}")
+        return None
+    return BuildInfo(commit=commit, subject=subject, date=date)
+
+
+def from_file(path: Path = BUILD_INFO_FILE) -> typing.Optional[BuildInfo]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return BuildInfo(**json.load(f))
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, TypeError) as exc:
+        logger.warning(f"Could not read build info from {path}: {exc}")
+        return None
+
+
+def write_file(info: BuildInfo, path: Path = BUILD_INFO_FILE):
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(info._asdict(), f)
+    tmp.replace(path)
+
+
+def _file_mtime() -> typing.Optional[float]:
+    try:
+        return BUILD_INFO_FILE.stat().st_mtime
+    except OSError:
+        return None
+
+
+_lock = threading.Lock()
+_info = None
+_info_mtime = None
+_resolved = False
+
+
+def build_info() -> typing.Optional[BuildInfo]:
+    """The commit this process serves, from BUILD_INFO_FILE or else from git.
+
+    It's resolved once per process and kept in memory. A deploy that rewrites
+    BUILD_INFO_FILE is picked up on the next call, by comparing the file's
+    modification time, without restarting.
+    """
+    global _info, _info_mtime, _resolved
+    mtime = _file_mtime()
+    if _resolved and mtime == _info_mtime:
+        return _info
+    with _lock:
+        if not _resolved or mtime != _info_mtime:
+            info = from_file() if mtime is not None else None
+            _info = info or from_git()
+            _info_mtime = mtime
+            _resolved = True
+        return _info
@@ -1,5 +1,12 @@
+import uuid
 from django.contrib.flatpages.models import FlatPage
+from django.core.cache import cache
 from django.db import models
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+CACHE_TIMEOUT = 60 * 30
+VERSION_KEY = "flatpage_links_version"
 
 
 class DocumentationFlatPage(FlatPage):
@@ -33,3 +40,87 @@ class ExternalLinkFlatPage(FlatPage):
     show_in_about = models.BooleanField(
         "Show in about page", null=False, blank=True, default=True
     )
+
+
+def flatpage_links(is_authenticated: bool):
+    """Return the (header, footer) HTML of the flat page links, which differ
+    only by whether the viewer is logged in.
+
+    They are cached under a versioned key shared by everyone, and saving or
+    deleting a flat page changes the version.
+    """
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set(VERSION_KEY, version, timeout=None)
+    key = f"flatpage_links_{'user' if is_authenticated else 'anonymous'}_{version}"
+    ret = cache.get(key)
+    if ret is None:
+        ret = _build_flatpage_links(is_authenticated)
+        cache.set(key, ret, timeout=CACHE_TIMEOUT)
+    return ret
+
+
+def _build_flatpage_links(is_authenticated: bool):
+    footer_links = ""
+    header_links = ""
+    for l in (
+        DocumentationFlatPage.objects.filter(show_in_footer=True)
+        | DocumentationFlatPage.objects.filter(show_in_header=True)
+    ).order_by("order", "title"):
+        if l.flatpage_ptr.registration_required and not is_authenticated:
+            continue
+        if l.show_in_header:
+            header_links += f"""<li><a href="{l.flatpage_ptr.url}">{l.link_name if l.link_name else l.flatpage_ptr.title}</a></li>"""
+        if l.show_in_footer:
+            footer_links += f"""<li><a href="{l.flatpage_ptr.url}">{l.link_name if l.link_name else l.flatpage_ptr.title}</a></li>"""
+
+    for l in (
+        CommunityFlatPage.objects.filter(show_in_footer=True)
+        | CommunityFlatPage.objects.filter(show_in_header=True)
+    ).order_by("order", "title"):
+        if l.flatpage_ptr.registration_required and not is_authenticated:
+            continue
+        if l.show_in_header:
+            if l.show_inline:
+                header_links += l.flatpage_ptr.content
+            else:
+                header_links += f"""<li><a href="{l.flatpage_ptr.url}">{l.link_name if l.link_name else l.flatpage_ptr.title}</a></li>"""
+
+        if l.show_in_footer:
+            if l.show_inline:
+                footer_links += l.flatpage_ptr.content
+            else:
+                footer_links += f"""<li><a href="{l.flatpage_ptr.url}">{l.link_name if l.link_name else l.flatpage_ptr.title}</a></li>"""
+
+    for l in (
+        ExternalLinkFlatPage.objects.filter(show_in_footer=True)
+        | ExternalLinkFlatPage.objects.filter(show_in_header=True)
+    ).order_by("order", "title"):
+        if l.flatpage_ptr.registration_required and not is_authenticated:
+            continue
+        if l.show_in_header:
+            if l.show_inline:
+                header_links += l.flatpage_ptr.content
+            else:
+                header_links += f"""<li><a href="{l.flatpage_ptr.url}" rel="external nofollow">{l.link_name if l.link_name else l.flatpage_ptr.title}</a></li>"""
+        if l.show_in_footer:
+            if l.show_inline:
+                footer_links += l.flatpage_ptr.content
+            else:
+                footer_links += f"""<li><a href="{l.flatpage_ptr.url}" rel="external nofollow">{l.link_name if l.link_name else l.flatpage_ptr.title}</a></li>"""
+    return header_links, footer_links
+
+
+@receiver(post_save, sender=FlatPage)
+@receiver(post_delete, sender=FlatPage)
+@receiver(post_save, sender=DocumentationFlatPage)
+@receiver(post_delete, sender=DocumentationFlatPage)
+@receiver(post_save, sender=CommunityFlatPage)
+@receiver(post_delete, sender=CommunityFlatPage)
+@receiver(post_save, sender=ExternalLinkFlatPage)
+@receiver(post_delete, sender=ExternalLinkFlatPage)
+def flatpage_save_receiver(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    cache.delete(VERSION_KEY)
@@ -0,0 +1,182 @@
+import time
+import uuid
+from django.core import checks
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.apps import apps
+
+config = apps.get_app_config("sic")
+from sic.models import (
+    Story,
+    Vote,
+    Tag,
+    Taggregation,
+    TaggregationHasTag,
+    ExactTagFilter,
+    TagNameFilter,
+    DomainFilter,
+    UserFilter,
+    User,
+)
+
+VERSION_KEY = "frontpage_version"
+RANKING_CHANGED_KEY = "frontpage_ranking_changed"
+
+
+def local_cache() -> bool:
+    """Whether the cache is private to this process, so that invalidations
+    from other processes (other web server workers, `manage.py run_jobs`)
+    don't reach it."""
+    return isinstance(caches["default"], LocMemCache)
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    if not local_cache():
+        return []
+    return [
+        checks.Warning(
+            "The default cache is process local, so front page changes made by other processes show up only after FRONTPAGE_LOCAL_CACHE_TIMEOUT.",
+            hint="Configure a shared cache such as memcached, see DEPLOY.md.",
+            id="sic.W001",
+        )
+    ]
+
+
+def version_key(user_pk=None) -> str:
+    return VERSION_KEY if user_pk is None else f"{VERSION_KEY}_{user_pk}"
+
+
+def invalidate_frontpages(user=None):
+    """Invalidate the cached front page of `user`, or of everyone if `user` is
+    None."""
+    cache.delete(version_key(user.pk if user else None))
+
+
+def invalidate_frontpage_ranking():
+    """Note that the ranking of stories changed without stories entering or
+    leaving any front page. Front pages are invalidated by the next
+    frontpage_story_pks() call at least FRONTPAGE_RANKING_INTERVAL seconds
+    after the first such change, instead of on every vote."""
+    cache.add(RANKING_CHANGED_KEY, time.time(), timeout=None)
+
+
+def frontpage_story_pks(user, limit: int):
+    """Return the primary keys of the first `limit` stories of `user`'s front
+    page (or the default front page for anonymous users) in hotness order,
+    and whether the user has any subscriptions.
+
+    Results are cached under versioned keys: invalidate_frontpages() changes
+    the version instead of deleting entries, which then expire on their own.
+    """
+    keys = [version_key()]
+    if user.is_authenticated:
+        keys.append(version_key(user.pk))
+    versions = cache.get_many(keys + [RANKING_CHANGED_KEY])
+    ranking_changed = versions.pop(RANKING_CHANGED_KEY, None)
+    if (
+        ranking_changed is not None
+        and time.time() - ranking_changed >= config.FRONTPAGE_RANKING_INTERVAL
+    ):
+        # Clear the mark before changing the version, so that a change made
+        # in between marks again instead of being lost.
+        cache.delete(RANKING_CHANGED_KEY)
+        versions.pop(version_key(), None)
+    for key in keys:
+        if key not in versions:
+            versions[key] = uuid.uuid4().hex
+            cache.set(key, versions[key], timeout=None)
+    key = "frontpage_{}_{}_{}".format(
+        user.pk if user.is_authenticated else "default",
+        limit,
+        "_".join(versions[key] for key in keys),
+    )
+    ret = cache.get(key)
+    if ret is None:
+        if user.is_authenticated:
+            frontpage = user.frontpage()
+            has_subscriptions = frontpage["taggregations"] is not None
+        else:
+            frontpage = Taggregation.default_frontpage()
+            has_subscriptions = False
+        ret = {
+            "pks": list(
+                Story.order_by_hotness(frontpage["stories"]).values_list(
+                    "pk", flat=True
+                )[:limit]
+            ),
+            "has_subscriptions": has_subscriptions,
+        }
+        cache.set(
+            key,
+            ret,
+            timeout=config.FRONTPAGE_LOCAL_CACHE_TIMEOUT
+            if local_cache()
+            else config.FRONTPAGE_CACHE_TIMEOUT,
+        )
+    return ret
+
+
+@receiver(post_save, sender=Story)
+def frontpage_story_save_receiver(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        invalidate_frontpages()
+    else:
+        invalidate_frontpage_ranking()
+
+
+@receiver(post_save, sender=Vote)
+@receiver(post_delete, sender=Vote)
+def frontpage_vote_receiver(sender, instance, raw=False, **kwargs):
+    # Comment votes change the hotness of their story too, see the
+    # sic_vote_*_hotness triggers.
+    if raw:
+        return
+    invalidate_frontpage_ranking()
+
+
+@receiver(post_delete, sender=Story)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Taggregation)
+@receiver(post_delete, sender=Taggregation)
+@receiver(post_save, sender=TaggregationHasTag)
+@receiver(post_delete, sender=TaggregationHasTag)
+@receiver(post_save, sender=ExactTagFilter)
+@receiver(post_delete, sender=ExactTagFilter)
+@receiver(post_save, sender=TagNameFilter)
+@receiver(post_delete, sender=TagNameFilter)
+@receiver(post_save, sender=DomainFilter)
+@receiver(post_delete, sender=DomainFilter)
+@receiver(post_save, sender=UserFilter)
+@receiver(post_delete, sender=UserFilter)
+def frontpage_save_receiver(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    invalidate_frontpages()
+
+
+@receiver(m2m_changed, sender=Story.tags.through)
+@receiver(m2m_changed, sender=Tag.parents.through)
+@receiver(m2m_changed, sender=TaggregationHasTag.exclude_filters.through)
+def frontpage_m2m_receiver(sender, instance, action, **kwargs):
+    if action not in ["post_add", "post_remove", "post_clear"]:
+        return
+    invalidate_frontpages()
+
+
+@receiver(m2m_changed, sender=User.taggregation_subscriptions.through)
+@receiver(m2m_changed, sender=User.exclude_filters.through)
+def frontpage_user_m2m_receiver(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ["post_add", "post_remove", "post_clear"]:
+        return
+    if not reverse:
+        invalidate_frontpages(instance)
+    elif pk_set:
+        cache.delete_many([version_key(pk) for pk in pk_set])
+    else:
+        invalidate_frontpages()
@@ -1,19 +1,22 @@
-import subprocess
+import os
+import socket
+import threading
+import time
 import types
 from datetime import datetime, timedelta
-from pathlib import Path
-import urllib.request
 import enum
 import logging
-import shlex
-from django.db import models
+from django.db import models, connection, connections
+from django.db.models import Q, Min
 from django.utils.timezone import make_aware
 from django.utils.module_loading import import_string
-from sic.models import Story, StoryRemoteContent
-from sic.mail import Digest
-from sic.search import index_story
+from django.apps import apps
 
-BASE_DIR = Path(__file__).resolve().parent.parent
+config = apps.get_app_config("sic")
+from sic.models import StoryRemoteContent
+from sic.mail import Digest
+from sic.frontpage import invalidate_frontpages
+from sic import remote_content, workers
 
 
 def send_digests(job):
@@ -30,16 +33,26 @@ def send_digests(job):
     Digest.send_digests()
 
 
-def fetch_remote_content(url):
-    with subprocess.Popen(
-        [
-            BASE_DIR / "tools/fetch_remote_content/target/debug/fetch_remote_content",
-            url,
-        ],
-        stdout=subprocess.PIPE,
-    ) as proc:
-        content = proc.stdout.read().decode("utf-8")
-    return content
+def decay_hotness(job):
+    config.post_ranking.decay_hotness()
+    invalidate_frontpages()
+
+
+def save_remote_content(pk, result):
+    """Store a sic.remote_content.RemoteContent for story `pk`. Returns
+    whether it was stored, which it isn't if no content could be extracted,
+    and the log message of the fetch if any, which can also be a warning
+    about content that was stored."""
+    if result.content is None:
+        return False, result.log
+    StoryRemoteContent(
+        story_id=pk,
+        url=result.url,
+        content=result.content,
+        w3m_content=result.w3m_content,
+        retrieved_at=make_aware(datetime.now()),
+    ).save()
+    return True, result.log
 
 
 def fetch_url(job):
@@ -48,77 +61,11 @@ def fetch_url(job):
         url = job.data["url"]
         if pk is None or url is None or len(url) == 0:
             return None
-        if url.startswith("gemini://"):
-            content = fetch_remote_content(url)
-            StoryRemoteContent(
-                story_id=pk,
-                url=url,
-                content=content,
-                retrieved_at=make_aware(datetime.now()),
-            ).save()
-            index_story(Story.objects.get(pk=pk))
-            return True
-        with urllib.request.urlopen(
-            urllib.request.Request(
-                url,
-                method="GET",
-                headers={
-                    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_4) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/80.0.3987.163 Safari/537.36",
-                },
-            ),
-            timeout=3,
-        ) as response:
-            if "application/pdf" in response.getheader("Content-Type"):
-                try:
-                    from pdfminer.high_level import extract_pages
-                    from pdfminer.layout import LTTextContainer
-                except ImportError:
-                    return f"""Content-Type is {response.getheader("Content-Type")} and could not import pdfminer.six"""
-                from io import BytesIO, StringIO
-
-                input_bytes = BytesIO(response.read())
-                output_string = StringIO()
-                # extract_text_to_fp(input_bytes, output_string)
-
-                for page_layout in extract_pages(input_bytes):
-                    for element in page_layout:
-                        if isinstance(element, LTTextContainer):
-                            output_string.write(element.get_text().strip())
-
-                content = output_string.getvalue().strip()
-                StoryRemoteContent(
-                    story_id=pk,
-                    url=url,
-                    content=content,
-                    retrieved_at=make_aware(datetime.now()),
-                ).save()
-                index_story(Story.objects.get(pk=pk))
-                return True
-            elif not "html" in response.getheader("Content-Type"):
-                return f"""Content-Type is {response.getheader("Content-Type")}"""
-            log = None
-            content = fetch_remote_content(url)
-            w3m_output = None
-            try:
-                w3m_output = subprocess.check_output(
-                    f"curl -s {shlex.quote(url)} | w3m -T text/html -dump",
-                    shell=True,
-                ).decode("utf-8")
-            except (subprocess.SubprocessError, UnicodeDecodeError) as exc:
-                log = str(exc)
-            StoryRemoteContent(
-                story_id=pk,
-                url=url,
-                content=content,
-                w3m_content=w3m_output,
-                retrieved_at=make_aware(datetime.now()),
-            ).save()
-            index_story(Story.objects.get(pk=pk))
-            return log if log else True
+        _saved, log = save_remote_content(pk, remote_content.fetch(url))
+        return log if log else True
     except Exception as exc:
         logging.exception(f"Could not fetch url: {exc}")
         raise exc
-    return None
 
 
 class JobKind(models.Model):
@@ -159,6 +106,13 @@ class Job(models.Model):
     last_run = models.DateTimeField(default=None, null=True, blank=True)
     logs = models.TextField(null=True, blank=True)
     data = models.JSONField(null=True, blank=True)
+    # Consecutive failed runs
+    attempts = models.IntegerField(default=0, null=False, blank=True)
+    # Don't run before this time: the next periodic run or a failure's backoff
+    run_after = models.DateTimeField(default=None, null=True, blank=True)
+    # Worker that claimed the job with Job.claim() and until when
+    locked_by = models.TextField(null=True, blank=True)
+    locked_until = models.DateTimeField(default=None, null=True, blank=True)
 
     def __str__(self):
         return f"{self.kind} {self.data}"
@@ -166,7 +120,8 @@ class Job(models.Model):
     def run(self):
         if not self.kind_id:
             return
-        self.last_run = make_aware(datetime.now())
+        now = make_aware(datetime.now())
+        self.last_run = now
         try:
             res = self.kind.run(self)
             if res and not self.periodic:
@@ -176,11 +131,139 @@ class Job(models.Model):
                     self.logs = ""
                 self.logs += res
             self.failed = False
-            self.save(update_fields=["last_run", "failed", "active", "logs"])
+            self.attempts = 0
+            self.run_after = now + config.JOB_INTERVAL if self.active else None
         except Exception as exc:
             if self.logs is None:
                 self.logs = ""
             self.logs += str(exc)
             self.failed = True
-            self.save(update_fields=["last_run", "failed", "logs"])
+            self.attempts += 1
+            self.run_after = workers.retry_after(
+                self.attempts, config.JOB_RETRY_DELAY, config.JOB_MAX_RETRY_DELAY
+            )
+        self.locked_by = None
+        self.locked_until = None
+        self.save(
+            update_fields=[
+                "last_run",
+                "failed",
+                "active",
+                "logs",
+                "attempts",
+                "run_after",
+                "locked_by",
+                "locked_until",
+            ]
+        )
         return
+
+    @staticmethod
+    def unleased():
+        """Jobs that can run and that no worker holds a lease on."""
+        return Job.objects.filter(
+            workers.unleased(),
+            active=True,
+            kind__isnull=False,
+        )
+
+    @staticmethod
+    def pending():
+        return Job.unleased().filter(
+            workers.due("run_after"),
+            Q(periodic=True) | Q(attempts__lt=config.JOB_MAX_ATTEMPTS),
+        )
+
+    @staticmethod
+    def claim(worker: str, limit=None, jobs=None):
+        """Lease up to `limit` pending jobs, or of `jobs` if given, to `worker`
+        and return their primary keys. Periodic jobs come first, so that a
+        backlog of one-off jobs doesn't hold them up."""
+        return workers.claim(
+            Job.pending() if jobs is None else jobs,
+            limit,
+            ["-periodic", "run_after", "pk"],
+            config.JOB_LEASE,
+            locked_by=worker,
+        )
+
+    @staticmethod
+    def renew_lease(pk, worker: str) -> bool:
+        return bool(
+            Job.objects.filter(pk=pk, locked_by=worker).update(
+                locked_until=make_aware(datetime.now()) + config.JOB_LEASE
+            )
+        )
+
+    @staticmethod
+    def run_claimed(pk, worker: str):
+        """Run a job claimed by `worker`, renewing its lease from another
+        thread until it's done, so that no other worker claims it meanwhile
+        however long it runs."""
+        job = Job.objects.select_related("kind").filter(pk=pk, locked_by=worker).first()
+        if job is None:
+            return
+        done = threading.Event()
+
+        def renew():
+            try:
+                while not done.wait(config.JOB_LEASE.total_seconds() / 3):
+                    Job.renew_lease(pk, worker)
+            finally:
+                connections.close_all()
+
+        renewer = threading.Thread(target=renew, daemon=True)
+        renewer.name = f"job_{pk}_lease"
+        renewer.start()
+        try:
+            job.run()
+        finally:
+            done.set()
+            renewer.join()
+
+    @staticmethod
+    def next_due():
+        """When the earliest job that isn't pending right now becomes
+        pending, or None."""
+        now = make_aware(datetime.now())
+        due = Job.objects.filter(
+            Q(periodic=True) | Q(attempts__lt=config.JOB_MAX_ATTEMPTS),
+            active=True,
+            kind__isnull=False,
+        ).aggregate(
+            run_after=Min("run_after", filter=Q(run_after__gt=now)),
+            locked_until=Min("locked_until", filter=Q(locked_until__gt=now)),
+        )
+        due = [d for d in due.values() if d is not None]
+        return min(due) if due else None
+
+
+def worker_name(suffix=""):
+    return f"{socket.gethostname()}:{os.getpid()}{suffix}"
+
+
+def run_claimed_job(pk, worker):
+    """Run a job claimed by `worker`. Meant to be called in a pool thread or
+    process, so it closes its database connection when done."""
+    try:
+        Job.run_claimed(pk, worker)
+    finally:
+        connections.close_all()
+
+
+def wait_for_jobs(timeout, poll_interval=1.0):
+    """Sleep until the database has been written to by another connection,
+    e.g. a web process inserted a new job, or until `timeout` seconds have
+    passed. SQLite's data_version pragma is cheap enough to poll often."""
+    deadline = time.monotonic() + timeout
+    if connection.vendor != "sqlite":
+        time.sleep(min(poll_interval, timeout))
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA data_version;")
+        version = cursor.fetchone()[0]
+        while time.monotonic() < deadline:
+            time.sleep(min(poll_interval, max(deadline - time.monotonic(), 0)))
+            cursor.execute("PRAGMA data_version;")
+            if cursor.fetchone()[0] != version:
+                return
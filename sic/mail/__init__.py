@@ -1,11 +1,14 @@
 from datetime import datetime, timedelta
+import collections
+from contextlib import contextmanager
 import logging
 import email
 from email.headerregistry import Address as AddressHeader
 import re
+import time
 import typing
 from email.policy import default as email_policy
-from django.db import models
+from django.db import models, transaction
 from django.db.models import F, Q
 from django.template import Context, Template
 from django.core import mail
@@ -19,6 +22,7 @@ from django.apps import apps
 config = apps.get_app_config("sic")
 from sic.models import Story, User, Comment, Tag, ExactTagFilter, DomainFilter
 from sic.markdown import Textractor
+from sic.outbox import OutgoingEmail
 
 logger = logging.getLogger("sic")
 
@@ -62,69 +66,17 @@ class Digest(models.Model):
     last_run = models.DateTimeField(default=None, null=True, blank=True)
 
     @staticmethod
-    def send_digests():
+    def send_digests() -> str:
         today = datetime.now()
         day = today.isoweekday() - 1
         digests = Digest.objects.annotate(
             is_today=F("on_days").bitand(1 << day)
         ).filter(active=True, is_today__gt=0)
         if not digests.exists():
-            return
-        template = Template(DIGEST_TEMPLATE)
-        domain = f"{config.WEB_PROTOCOL}://{config.get_domain()}"
-        unsubscribe = f"{domain}{reverse('edit_settings')}"
-        with mail.get_connection(fail_silently=False) as connection:
-            for d in digests:
-                aggregations = None
-                if d.all_stories:
-                    stories = Story.objects.filter(active=True)
-                else:
-                    frontpage = d.user.frontpage()
-                    stories = frontpage["stories"]
-                    aggregations = frontpage["taggregations"]
-                if d.last_run:
-                    stories = stories.filter(created__gt=d.last_run)
-                else:
-                    stories = stories.filter(
-                        created__gt=make_aware(today - timedelta(days=32))
-                    )
-                stories = stories.exclude(user_id=d.user.id).order_by(
-                    "-created", "title"
-                )
-                if not stories.exists():
-                    d.last_run = make_aware(today)
-                    d.save(update_fields=["last_run"])
-                    continue
-                context = Context(
-                    {
-                        "stories": stories,
-                        "aggregations": aggregations,
-                        "domain": domain,
-                        "unsubscribe": unsubscribe,
-                    }
-                )
-                try:
-                    if d.user.username:
-                        username = d.user.username.replace('"', "")
-                        to = f""""{username}" <{d.user.email}>"""
-                    else:
-                        to = d.user.email
-                    EmailMessage(
-                        f"{config.DIGEST_SUBJECT} {today.date()}",
-                        template.render(context),
-                        config.NOTIFICATION_FROM,
-                        [to],
-                        headers={
-                            "Message-ID": config.make_msgid(),
-                            "List-ID": f"{config.verbose_name} digests <{config.NOTIFICATION_FROM}>",
-                            "List-Unsubscribe": f"<{unsubscribe}>",
-                        },
-                        connection=connection,
-                    ).send()
-                    d.last_run = make_aware(today)
-                    d.save(update_fields=["last_run"])
-                except Exception as exc:
-                    logger.exception(exc)
+            return "no digests to send"
+        report = DigestBuilder(today).run(digests.select_related("user"))
+        logger.info(report)
+        return report
 
     def set_day(self, day: int, value: bool):
         if value:
@@ -160,6 +112,179 @@ class Digest(models.Model):
         return [test_bit(self.on_days, d) for d in range(0, 7)]
 
 
+class DigestBuilder:
+    """Builds and queues the digests of one run.
+
+    Digests whose story lists can only differ by the stories of their own
+    user are grouped under a fingerprint of the settings the list depends
+    on: all stories or the subscribed taggregations and global exclude
+    filters, and the last run. Each group's stories are fetched once with
+    their tags prefetched, and each distinct body is rendered once.
+    """
+
+    def __init__(self, today: datetime):
+        self.today = today
+        self.template = Template(DIGEST_TEMPLATE)
+        self.domain = f"{config.WEB_PROTOCOL}://{config.get_domain()}"
+        self.unsubscribe = f"{self.domain}{reverse('edit_settings')}"
+        self.stories = {}
+        self.bodies = {}
+        self.timings = {}
+
+    @contextmanager
+    def timed(self, phase: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.timings[phase] = (
+                self.timings.get(phase, 0.0) + time.monotonic() - start
+            )
+
+    @staticmethod
+    def fingerprints(digests) -> typing.Dict[int, tuple]:
+        """Map each digest's pk to the fingerprint of its story list, with a
+        fixed number of queries."""
+        user_pks = [d.user_id for d in digests if not d.all_stories]
+        subscriptions = collections.defaultdict(list)
+        through = User.taggregation_subscriptions.through
+        for user_pk, taggregation_pk in through.objects.filter(
+            user_id__in=user_pks
+        ).values_list("user_id", "taggregation_id"):
+            subscriptions[user_pk].append(taggregation_pk)
+        filters = collections.defaultdict(list)
+        for user_pk, tag_pk in ExactTagFilter.objects.filter(
+            excluded_in_user__in=user_pks
+        ).values_list("excluded_in_user", "tag_id"):
+            filters[user_pk].append(("tag", tag_pk))
+        for user_pk, match_string, is_regexp in DomainFilter.objects.filter(
+            excluded_in_user__in=user_pks
+        ).values_list("excluded_in_user", "match_string", "is_regexp"):
+            filters[user_pk].append(("domain", match_string, is_regexp))
+        ret = {}
+        for d in digests:
+            if d.all_stories:
+                ret[d.pk] = (None, None, d.last_run)
+            else:
+                ret[d.pk] = (
+                    tuple(sorted(subscriptions[d.user_id])),
+                    tuple(sorted(set(filters[d.user_id]))),
+                    d.last_run,
+                )
+        return ret
+
+    def group_stories(self, digest: Digest):
+        """The stories of `digest`'s group including its user's own, and the
+        taggregations they are from."""
+        aggregations = None
+        if digest.all_stories:
+            stories = Story.objects.filter(active=True)
+        else:
+            frontpage = digest.user.frontpage()
+            stories = frontpage["stories"]
+            if frontpage["taggregations"] is not None:
+                aggregations = list(frontpage["taggregations"])
+        if digest.last_run:
+            stories = stories.filter(created__gt=digest.last_run)
+        else:
+            stories = stories.filter(
+                created__gt=make_aware(self.today - timedelta(days=32))
+            )
+        stories = (
+            stories.prefetch_related(None)
+            .prefetch_related("tags")
+            .order_by("-created", "title")
+        )
+        return list(stories), aggregations
+
+    def body(self, digest: Digest, fingerprint) -> typing.Optional[str]:
+        if fingerprint not in self.stories:
+            with self.timed("stories"):
+                self.stories[fingerprint] = self.group_stories(digest)
+        stories, aggregations = self.stories[fingerprint]
+        own = tuple(s.pk for s in stories if s.user_id == digest.user_id)
+        if len(own) == len(stories):
+            return None
+        key = (fingerprint, own)
+        if key not in self.bodies:
+            with self.timed("rendering"):
+                self.bodies[key] = self.template.render(
+                    Context(
+                        {
+                            "stories": [
+                                s for s in stories if s.user_id != digest.user_id
+                            ],
+                            "aggregations": aggregations,
+                            "domain": self.domain,
+                            "unsubscribe": self.unsubscribe,
+                        }
+                    )
+                )
+        return self.bodies[key]
+
+    def message(self, digest: Digest, body: str) -> EmailMessage:
+        user = digest.user
+        if user.username:
+            username = user.username.replace('"', "")
+            to = f""""{username}" <{user.email}>"""
+        else:
+            to = user.email
+        return EmailMessage(
+            f"{config.DIGEST_SUBJECT} {self.today.date()}",
+            body,
+            config.NOTIFICATION_FROM,
+            [to],
+            headers={
+                "Message-ID": config.make_msgid(),
+                "List-ID": f"{config.verbose_name} digests <{config.NOTIFICATION_FROM}>",
+                "List-Unsubscribe": f"<{self.unsubscribe}>",
+            },
+        )
+
+    def run(self, digests) -> str:
+        """Queue the digests in the outbox in batches of EMAIL_BATCH_SIZE,
+        which sends them over a single connection, and return a report of
+        the run."""
+        start = time.monotonic()
+        last_run = make_aware(self.today)
+        digests = list(digests)
+        with self.timed("grouping"):
+            fingerprints = self.fingerprints(digests)
+        sent = empty = failed = 0
+        for i in range(0, len(digests), config.EMAIL_BATCH_SIZE):
+            batch = digests[i : i + config.EMAIL_BATCH_SIZE]
+            messages = []
+            done = []
+            for d in batch:
+                try:
+                    body = self.body(d, fingerprints[d.pk])
+                    if body is not None:
+                        messages.append(self.message(d, body))
+                    else:
+                        empty += 1
+                    done.append(d.pk)
+                except Exception as exc:
+                    failed += 1
+                    logger.exception(exc)
+            with self.timed("queueing"):
+                try:
+                    with transaction.atomic():
+                        OutgoingEmail.queue_many(messages)
+                        Digest.objects.filter(pk__in=done).update(last_run=last_run)
+                    sent += len(messages)
+                except Exception as exc:
+                    failed += len(messages)
+                    logger.exception(exc)
+        timings = ", ".join(
+            f"{phase} {seconds:.3f}s" for phase, seconds in self.timings.items()
+        )
+        return (
+            f"sent {sent} digests ({empty} with no new stories, {failed} failed) "
+            f"from {len(self.stories)} story lists and {len(self.bodies)} "
+            f"rendered bodies in {time.monotonic() - start:.3f}s: {timings}"
+        )
+
+
 MSG_ID_RE = re.compile(r"^\s*<(?P<msg_id>[^>]+)>\s*")
 PK_MSG_ID_RE = re.compile(
     r"(?:story-(?P<story_pk>\d+))|(?:comment-(?P<comment_pk>\d+))"
@@ -342,16 +467,12 @@ def create_story_post_on_mailing_list(job):
         pk = int(pk)
     story_obj = Story.objects.get(pk=pk)
 
-    users = User.objects.filter(enable_mailing_list=True)
-
-    if not users.exists():
-        return "no users to send to"
-
-    users = list(users)
-    users_list: typing.List[User] = list(
-        filter(lambda user: story_obj.is_user_subscribed(user), users)
+    addresses = list(
+        story_obj.subscribed_users(
+            User.objects.filter(enable_mailing_list=True)
+        ).values_list("email", flat=True)
     )
-    if not users_list:
+    if not addresses:
         return "no users to send to"
 
     headers: typing.Dict[str, str] = {
@@ -380,17 +501,16 @@ def create_story_post_on_mailing_list(job):
     else:
         from_addr = story_obj.user.email
 
-    with mail.get_connection(fail_silently=False) as connection:
-        for user in users_list:
-            EmailMessage(
-                f"[{config.verbose_name}] {story_obj.title}",
-                description,
-                from_addr,
-                [user.email],
-                headers=headers,
-                connection=connection,
-            ).send()
-    return f"sent story to {len(users_list)} users"
+    OutgoingEmail.queue(
+        EmailMessage(
+            f"[{config.verbose_name}] {story_obj.title}",
+            description,
+            from_addr,
+            headers=headers,
+        ),
+        addresses,
+    )
+    return f"sent story to {len(addresses)} users"
 
 
 @receiver(post_save, sender=Comment)
@@ -402,23 +522,16 @@ def comment_create_mailing_list(
     comment_obj: Comment = instance
     story_obj: Story = comment_obj.story
     in_reply_to: str = story_obj.get_message_id
-    users = User.objects.filter(
-        enable_mailing_list=True, enable_mailing_list_comments=True
-    )
+    users = Q(enable_mailing_list=True, enable_mailing_list_comments=True)
     if comment_obj.parent:
-        users = users.union(
-            User.objects.filter(pk=comment_obj.parent.user_id).filter(
-                enable_mailing_list_replies=True
-            )
-        )
+        users |= Q(pk=comment_obj.parent.user_id, enable_mailing_list_replies=True)
         in_reply_to = comment_obj.parent.get_message_id
-    if not users.exists():
-        return
-
-    users_list: typing.List[User] = list(
-        filter(lambda user: story_obj.is_user_subscribed(user), users)
+    addresses = list(
+        story_obj.subscribed_users(User.objects.filter(users)).values_list(
+            "email", flat=True
+        )
     )
-    if not users_list:
+    if not addresses:
         return
 
     references = []
@@ -454,16 +567,15 @@ def comment_create_mailing_list(
         )
     else:
         from_addr = comment_obj.user.email
-    with mail.get_connection(fail_silently=False) as connection:
-        for user in users_list:
-            EmailMessage(
-                f"Re: [{config.verbose_name}] {story_obj.title}",
-                comment_obj.text_to_plain_text,
-                from_addr,
-                [user.email],
-                headers=headers,
-                connection=connection,
-            ).send()
+    OutgoingEmail.queue(
+        EmailMessage(
+            f"Re: [{config.verbose_name}] {story_obj.title}",
+            comment_obj.text_to_plain_text,
+            from_addr,
+            headers=headers,
+        ),
+        addresses,
+    )
 
 
 def story_as_email(pk):
@@ -0,0 +1,106 @@
+import random
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.template import Context
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from sic.models import Story, Comment, User
+from sic.forms import SubmitCommentForm
+from sic.templatetags.comment import render_comments
+
+
+class Command(BaseCommand):
+    help = "Measure the time and queries needed to render comment threads of various sizes. Nothing is saved to the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "sizes",
+            nargs="*",
+            type=int,
+            default=[10, 100, 500, 1000],
+            help="number of comments per thread",
+        )
+        parser.add_argument(
+            "--username",
+            default=None,
+            help="render as this user instead of an anonymous visitor",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0, help="seed for the thread shape"
+        )
+
+    def handle(self, *args, **kwargs):
+        author = User.objects.order_by("pk").first()
+        if author is None:
+            raise CommandError("At least one user must exist.")
+        viewer = AnonymousUser()
+        if kwargs["username"] is not None:
+            try:
+                viewer = User.objects.get(username=kwargs["username"])
+            except User.DoesNotExist:
+                raise CommandError(f"No user named {kwargs['username']}.")
+        rng = random.Random(kwargs["seed"])
+        self.stdout.write(
+            f"{'comments':>10} {'queries':>8} {'seconds':>9} {'ms/comment':>11}"
+        )
+        for size in kwargs["sizes"]:
+            with transaction.atomic():
+                queries, seconds = self.run(author, viewer, size, rng)
+                transaction.set_rollback(True)
+            per_comment = 1000 * seconds / size if size else 0
+            self.stdout.write(
+                f"{size:>10} {queries:>8} {seconds:>9.3f} {per_comment:>11.2f}"
+            )
+
+    def run(self, author, viewer, size, rng):
+        # Insert with explicit primary keys through bulk_create, so that no
+        # signal receivers (notifications, jobs, ...) run for the fake thread.
+        story_id = (Story.objects.aggregate(m=Max("id"))["m"] or 0) + 1
+        Story.objects.bulk_create(
+            [
+                Story(
+                    id=story_id,
+                    user=author,
+                    title="Comment rendering benchmark",
+                    message_id=f"<story-{story_id}@benchmark>",
+                )
+            ]
+        )
+        first_id = (Comment.objects.aggregate(m=Max("id"))["m"] or 0) + 1
+        comments = []
+        for i in range(size):
+            parent_id = None
+            if comments and rng.random() < 0.8:
+                parent_id = rng.choice(comments).id
+            comments.append(
+                Comment(
+                    id=first_id + i,
+                    user=author,
+                    story_id=story_id,
+                    parent_id=parent_id,
+                    text=f"Comment number {i}.",
+                    message_id=f"<comment-{first_id + i}@benchmark>",
+                )
+            )
+        Comment.objects.bulk_create(comments)
+
+        request = RequestFactory().get(f"/story/{story_id}/")
+        request.user = viewer
+        request.session = import_module(settings.SESSION_ENGINE).SessionStore()
+        story = Story.objects.get(pk=story_id)
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            render_comments(
+                Context(),
+                request,
+                story.active_comments.prefetch_related("user", "votes"),
+                SubmitCommentForm(),
+            )
+            seconds = time.perf_counter() - start
+        return len(ctx.captured_queries), seconds
@@ -1,24 +1,119 @@
+import os
+from multiprocessing import get_context
+import django
 from django.core.management.base import BaseCommand
-from django.db import connections, transaction
 from django.apps import apps
 
 config = apps.get_app_config("sic")
 from sic.models import Comment, Story
-from sic.search import fts5_setup, index_comment, index_story
+from sic.markdown import RENDERER_REVISION
+from sic.search import (
+    SearchIndexQueueEntry,
+    fts5_setup,
+    comment_index_row,
+    story_index_row,
+    start_rebuild,
+    cancel_rebuild,
+    add_rebuild_rows,
+    finish_rebuild,
+)
+
+Kind = SearchIndexQueueEntry.Kind
+
+
+def index_rows(kind, pks):
+    """Return the FTS rows of the objects of `kind` in `pks`, rendering the
+    plain text of those whose stored rendering is missing or stale. Runs in
+    the worker processes."""
+    if kind == Kind.COMMENT:
+        objs = list(Comment.objects.filter(pk__in=pks, deleted=False))
+        Comment.render_texts(
+            [obj for obj in objs if obj.rendered_revision != RENDERER_REVISION]
+        )
+        rows = [comment_index_row(obj) for obj in objs]
+    else:
+        objs = list(
+            Story.objects.filter(
+                pk__in=pks, active=True, merged_into=None
+            ).select_related("remote_content")
+        )
+        Story.render_descriptions(
+            [obj for obj in objs if obj.rendered_revision != RENDERER_REVISION]
+        )
+        rows = [story_index_row(obj) for obj in objs]
+    return rows
+
+
+def _index_rows(args):
+    return args, index_rows(*args)
 
 
 class Command(BaseCommand):
-    help = "(Re)Build fts5 index"
+    help = "(Re)Build fts5 index into new tables and swap them in when done. An interrupted rebuild is resumed by running this again."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=500,
+            help="number of objects rendered and inserted at once",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="number of processes rendering plain text",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            default=False,
+            help="discard the progress of an interrupted rebuild",
+        )
 
-    @transaction.atomic
     def handle(self, *args, **kwargs):
-        # with connections["default"].cursor() as cursor:
-        #    cursor.execute(
-        #        f"DELETE FROM {config.FTS_DATABASE_NAME}.{config.FTS_COMMENTS_TABLE_NAME}"
-        #    )
-        comments = Comment.objects.filter(deleted=False)
-        for c in comments:
-            index_comment(c)
-        stories = Story.objects.filter(active=True, merged_into=None)
-        for s in stories:
-            index_story(s)
+        connection = fts5_setup()
+        if kwargs["restart"]:
+            cancel_rebuild(connection)
+        progress = start_rebuild(connection)
+        chunk_size = max(kwargs["chunk_size"], 1)
+        # Collect the ids first instead of iterating over a queryset, so that
+        # no read transaction stays open on the main database for the whole
+        # rebuild.
+        chunks = []
+        for kind, queryset in [
+            (Kind.COMMENT, Comment.objects.filter(deleted=False)),
+            (Kind.STORY, Story.objects.filter(active=True, merged_into=None)),
+        ]:
+            pks = list(
+                queryset.filter(pk__gt=progress.get(kind, 0))
+                .order_by("pk")
+                .values_list("pk", flat=True)
+            )
+            chunks += [
+                (kind, pks[i : i + chunk_size]) for i in range(0, len(pks), chunk_size)
+            ]
+        if kwargs["processes"] > 1:
+            # Spawn instead of fork, so that the children set up django and
+            # their database connections from scratch.
+            pool = get_context("spawn").Pool(
+                kwargs["processes"], initializer=django.setup
+            )
+            results = pool.imap(_index_rows, chunks)
+        else:
+            pool = None
+            results = map(_index_rows, chunks)
+        done = 0
+        try:
+            # imap() yields in order, so the progress recorded after each
+            # chunk covers every chunk before it.
+            for (kind, pks), rows in results:
+                add_rebuild_rows(connection, kind, rows, pks[-1])
+                done += len(pks)
+                if kwargs["verbosity"] > 1:
+                    self.stdout.write(f"Indexed {done} objects.")
+        finally:
+            if pool is not None:
+                pool.terminate()
+        finish_rebuild(connection)
+        self.stdout.write(f"Rebuilt the search index, indexed {done} objects.")
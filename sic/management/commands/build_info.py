@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+from sic.build_info import BUILD_INFO_FILE, from_git, write_file
+
+
+class Command(BaseCommand):
+    help = f"Write the current git commit to {BUILD_INFO_FILE.name}, which running processes pick up as their build info. Run this on every deploy."
+
+    def handle(self, *args, **kwargs):
+        info = from_git()
+        if info is None:
+            raise CommandError("Could not get the current commit from git.")
+        write_file(info)
+        self.stdout.write(f"Wrote {info.commit} {info.subject} {info.date}.")
@@ -15,3 +15,7 @@ class Command(BaseCommand):
                 "UPDATE sic_comment SET karma = (SELECT COUNT(id) FROM sic_vote AS v WHERE v.story_id = sic_comment.story_id AND v.comment_id = sic_comment.id);",
                 [],
             )
+            cursor.execute(
+                "UPDATE sic_user SET karma = (SELECT COUNT(v.id) FROM sic_vote AS v JOIN sic_story AS s ON v.story_id = s.id WHERE s.user_id = sic_user.id AND v.comment_id IS NULL);",
+                [],
+            )
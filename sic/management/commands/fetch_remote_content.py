@@ -1,84 +1,66 @@
-from multiprocessing import Process, Queue
-import queue
-import subprocess
-from datetime import datetime
-from pathlib import Path
-import urllib
+import asyncio
+import collections
 
+from asgiref.sync import sync_to_async
 from django.core.management.base import BaseCommand
-from django.db import connections
-from django.utils.timezone import make_aware
 from django.apps import apps
 
 config = apps.get_app_config("sic")
-from sic.models import Story, StoryRemoteContent
-from sic.search import index_story
-
-BASE_DIR = Path(__file__).resolve().parent.parent.parent.parent
-
-
-def f(qin, qout):
-    try:
-        (pk, url) = qin.get(timeout=5)
-        if url is None or len(url) == 0:
-            return f(qin, qout)
-        with urllib.request.urlopen(
-            urllib.request.Request(
-                url,
-                data=None,
-                headers={},
-                origin_req_host=None,
-                unverifiable=False,
-                method="GET",
-            )
-        ) as response:
-            if not response.getheader("Content-Type").startswith("text/html"):
-                return f(qin, qout)
-        with subprocess.Popen(
-            [
-                BASE_DIR
-                / "tools/fetch_remote_content/target/debug/fetch_remote_content",
-                url,
-            ],
-            stdout=subprocess.PIPE,
-        ) as proc:
-            content = proc.stdout.read().decode("utf-8")
-            qout.put((pk, url, content, datetime.now()))
-    except Exception as exc:
-        pass
-    return
+from sic.models import Story
+from sic.jobs import save_remote_content
+from sic.remote_content import RemoteContentFetcher
 
 
 class Command(BaseCommand):
-    help = "Fetch remote content"
+    help = "Fetch remote content of stories that don't have any"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=16,
+            help="maximum number of simultaneous downloads",
+        )
+        parser.add_argument(
+            "--per-domain",
+            type=int,
+            default=2,
+            help="maximum number of simultaneous downloads from the same host",
+        )
+        parser.add_argument("--timeout", type=float, default=10)
 
     def handle(self, *args, **kwargs):
-        stories = Story.objects.filter(remote_content=None, url__isnull=False)
-        count = stories.count()
-        if count == 0:
+        # Stories are grouped by url, so that reposts are downloaded once
+        stories = collections.defaultdict(list)
+        for url, pk in (
+            Story.objects.filter(remote_content=None, url__isnull=False)
+            .exclude(url="")
+            .values_list("url", "pk")
+        ):
+            stories[url].append(pk)
+        if not stories:
             return
-        if count > 10:
-            count = 10
-        qin = Queue()
-        qout = Queue()
-        stories = {s.pk: s for s in stories}
-        for k in stories:
-            qin.put((k, stories[k].url))
-        procs = []
-        for num in range(count):
-            proc = Process(target=f, args=(qin, qout))
-            proc.start()
-            procs.append(proc)
-
-        for p in procs:
-            p.join(5)
+        asyncio.run(self.fetch(stories, kwargs))
 
-        while not qout.empty():
-            pk, url, content, date = qout.get()
-            StoryRemoteContent(
-                story=stories[pk],
-                url=url,
-                content=content,
-                retrieved_at=make_aware(date),
-            ).save()
-            index_story(stories[pk])
+    async def fetch(self, stories, kwargs):
+        save = sync_to_async(save_remote_content)
+        saved = 0
+        async with RemoteContentFetcher(
+            concurrency=kwargs["concurrency"],
+            per_domain=kwargs["per_domain"],
+            timeout=kwargs["timeout"],
+        ) as fetcher:
+            async for url, result in fetcher.fetch_all(stories):
+                if isinstance(result, Exception):
+                    self.stderr.write(f"{url}: {result}")
+                    continue
+                for pk in stories[url]:
+                    stored, log = await save(pk, result)
+                    if stored:
+                        saved += 1
+                    if log:
+                        self.stderr.write(f"{url}: {log}")
+                    if not stored:
+                        # Nothing to store for any repost of this url
+                        break
+        self.stdout.write(f"Fetched remote content of {saved} stories.")
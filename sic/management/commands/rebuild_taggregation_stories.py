@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+
+class Command(BaseCommand):
+    help = "Rebuild the taggregation_stories table from scratch"
+
+    def handle(self, *args, **kwargs):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("DELETE FROM taggregation_stories;", [])
+            cursor.execute(
+                "INSERT INTO taggregation_stories (id, has_id, taggregation_id) SELECT id, has_id, taggregation_id FROM taggregation_stories_source;",
+                [],
+            )
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from sic.models import Story, Comment
+from sic.markdown import RENDERER_REVISION
+
+
+class Command(BaseCommand):
+    help = "Store the rendered HTML and plain text of stories and comments that are missing it or were rendered by an older sic.markdown.RENDERER_REVISION"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            default=False,
+            help="re-render everything, even if it is up to date",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **kwargs):
+        batch_size = kwargs["batch_size"]
+        for model, render, fields in [
+            (
+                Story,
+                Story.render_descriptions,
+                ["description_html", "description_plain_text"],
+            ),
+            (Comment, Comment.render_texts, ["text_html", "text_plain_text"]),
+        ]:
+            queryset = model.objects.all()
+            if not kwargs["all"]:
+                queryset = queryset.exclude(rendered_revision=RENDERER_REVISION)
+            pks = list(queryset.order_by("pk").values_list("pk", flat=True))
+            for i in range(0, len(pks), batch_size):
+                objs = list(model.objects.filter(pk__in=pks[i : i + batch_size]))
+                render(objs)
+                # bulk_update() doesn't send post_save, so nothing else
+                # (notifications, search index, ...) reacts to this.
+                with transaction.atomic():
+                    model.objects.bulk_update(objs, fields + ["rendered_revision"])
+            self.stdout.write(f"Rendered {len(pks)} {model._meta.verbose_name_plural}.")
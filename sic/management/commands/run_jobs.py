@@ -1,11 +1,72 @@
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    ProcessPoolExecutor,
+    wait,
+    FIRST_COMPLETED,
+)
+from datetime import datetime
 from multiprocessing import get_context
+import django
 from django.core.management.base import BaseCommand
-from sic.jobs import Job
+from django.utils.timezone import make_aware
+from sic.jobs import Job, worker_name, run_claimed_job, wait_for_jobs
 
 
 class Command(BaseCommand):
-    help = "Send digest mails"
+    help = "Run pending jobs, or with --forever keep waiting for and running new ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--forever",
+            action="store_true",
+            default=False,
+            help="don't exit when there are no pending jobs",
+        )
+        parser.add_argument(
+            "--workers", type=int, default=4, help="number of jobs to run at once"
+        )
+        parser.add_argument(
+            "--processes",
+            action="store_true",
+            default=False,
+            help="run jobs in worker processes instead of threads",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="seconds between checks for new jobs",
+        )
 
     def handle(self, *args, **kwargs):
-        for job in Job.objects.filter(active=True):
-            job.run()
+        workers = max(kwargs["workers"], 1)
+        worker = worker_name()
+        if kwargs["processes"]:
+            # Spawn instead of fork, so that the children set up django and
+            # their database connections from scratch.
+            pool = ProcessPoolExecutor(
+                workers, mp_context=get_context("spawn"), initializer=django.setup
+            )
+        else:
+            pool = ThreadPoolExecutor(workers, thread_name_prefix="job")
+        running = set()
+        with pool:
+            while True:
+                if len(running) < workers:
+                    for pk in Job.claim(worker, workers - len(running)):
+                        running.add(pool.submit(run_claimed_job, pk, worker))
+                if running:
+                    _done, running = wait(
+                        running,
+                        timeout=kwargs["poll_interval"],
+                        return_when=FIRST_COMPLETED,
+                    )
+                    continue
+                if not kwargs["forever"]:
+                    break
+                timeout = 60.0
+                due = Job.next_due()
+                if due is not None:
+                    now = make_aware(datetime.now())
+                    timeout = min(max((due - now).total_seconds(), 0.0), timeout)
+                wait_for_jobs(timeout, kwargs["poll_interval"])
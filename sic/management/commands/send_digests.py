@@ -9,4 +9,4 @@ class Command(BaseCommand):
     help = "Send digest mails"
 
     def handle(self, *args, **kwargs):
-        Digest.send_digests()
+        self.stdout.write(Digest.send_digests())
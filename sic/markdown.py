@@ -11,6 +11,8 @@ def link_render(self, tokens, idx, options, env):
 
 
 def make_link_rule(tag: str, url_fn, exists_fn, detect_fn=None):
+    """`exists_fn` and `url_fn` are only used for object names missing from
+    the links that comments_to_html() resolved in bulk beforehand."""
     if detect_fn is None:
         detect_fn = lambda t: len(f"</{tag}") if t.startswith(f"</{tag}/") else False
 
@@ -39,13 +41,16 @@ def make_link_rule(tag: str, url_fn, exists_fn, detect_fn=None):
                     break
 
             objname = state.src[start + 1 : pos]
-            exists = exists_fn(objname)
+            resolved = state.env.get("resolved_links", {}).get(tag, {})
+            if objname in resolved:
+                exists, target_url = resolved[objname]
+            else:
+                exists = exists_fn(objname)
+                target_url = url_fn(objname) if exists else None
 
             if not exists:
                 return False
 
-            target_url = url_fn(objname)
-
             token = state.push(f"{tag}_link_open", "a", 1)
             token.attrs = {}
             token.attrs["href"] = target_url
@@ -78,6 +83,23 @@ def user_exists(username):
     return User.objects.filter(username=username).exists()
 
 
+def resolve_users(usernames):
+    from .models import User
+
+    found = set(
+        User.objects.filter(username__in=usernames).values_list("username", flat=True)
+    )
+    return {
+        username: (
+            True,
+            reverse("profile", kwargs={"name": username}),
+        )
+        if username in found
+        else (False, None)
+        for username in usernames
+    }
+
+
 user_link = make_link_rule(
     "u", lambda username: reverse("profile", kwargs={"name": username}), user_exists
 )
@@ -98,23 +120,61 @@ def tag_url(name):
     return Tag.objects.filter(name=name).first().get_absolute_url()
 
 
+def resolve_tags(names):
+    from .models import Tag
+
+    found = {tag.name: tag for tag in Tag.objects.filter(name__in=names)}
+    return {
+        name: (found[name].name, found[name].get_absolute_url())
+        if name in found
+        else (False, None)
+        for name in names
+    }
+
+
 tag_link = make_link_rule("t", tag_url, tag_exists)
 
 
-def story_exists(story_url):
-    from .models import Story
+def story_pk_from_url(story_url):
     from .views import stories
 
     try:
         func, args, kwargs = resolve(f"/{story_url}")
         if func == stories.story:
-            story_obj = Story.objects.get(pk=kwargs["story_pk"])
+            return int(kwargs["story_pk"])
+    except Exception:
+        pass
+    return None
+
+
+def story_exists(story_url):
+    from .models import Story
+
+    try:
+        story_pk = story_pk_from_url(story_url)
+        if story_pk is not None:
+            story_obj = Story.objects.get(pk=story_pk)
             return story_obj.title
         return False
     except Exception:
         return False
 
 
+def resolve_stories(story_urls):
+    from .models import Story
+
+    story_pks = {url: story_pk_from_url(url) for url in story_urls}
+    titles = dict(
+        Story.objects.filter(
+            pk__in={pk for pk in story_pks.values() if pk is not None}
+        ).values_list("pk", "title")
+    )
+    return {
+        url: (titles[pk], f"/{url}") if pk in titles else (False, None)
+        for url, pk in story_pks.items()
+    }
+
+
 story_link = make_link_rule(
     "story_tag",
     lambda story_url: f"/{story_url}",
@@ -131,9 +191,49 @@ MarkdownRenderer = (
     .use(story_link)
 )
 
+# Everything the link rules above could match: a "</" up to the next ">"
+# with no "<" in between.
+LINK_CANDIDATE_REGEXP = re.compile(r"</([^<>]*)>")
+
+
+def resolve_links(inputs):
+    """Look up every user, tag and story link candidate in `inputs` with one
+    query per kind. Returns {rule tag: {object name: (exists, url)}} in the
+    format make_link_rule() expects in the "resolved_links" env entry."""
+    candidates = {
+        m.group(1)
+        for input_ in inputs
+        for m in LINK_CANDIDATE_REGEXP.finditer(input_ or "")
+    }
+    usernames = {c[2:] for c in candidates if c.startswith("u/")}
+    tag_names = {c[2:] for c in candidates if c.startswith("t/")}
+    return {
+        "u": resolve_users(usernames) if usernames else {},
+        "t": resolve_tags(tag_names) if tag_names else {},
+        "story_tag": resolve_stories(candidates) if candidates else {},
+    }
+
+
+# Bump whenever a change here alters the output of comment_to_html(), so that
+# the rendered HTML stored in Story and Comment rows is regenerated. See the
+# render_markdown management command.
+RENDERER_REVISION = 1
+
 
 def comment_to_html(input_):
-    return mark_safe(MarkdownRenderer.render(input_))
+    return comments_to_html([input_])[0]
+
+
+def comments_to_html(inputs):
+    """Render many documents, resolving the links in all of them at once."""
+    inputs = list(inputs)
+    resolved_links = resolve_links(inputs)
+    # Each document needs its own env, since markdown-it keeps link
+    # reference definitions in it.
+    return [
+        mark_safe(MarkdownRenderer.render(input_, {"resolved_links": resolved_links}))
+        for input_ in inputs
+    ]
 
 
 # Extract plain text from HTML.
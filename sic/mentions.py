@@ -0,0 +1,115 @@
+import threading
+import uuid
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.apps import apps
+
+config = apps.get_app_config("sic")
+from sic.models import User
+
+VERSION_KEY = "username_index_version"
+
+
+def _is_word_char(c: str) -> bool:
+    return c.isalnum() or c == "_"
+
+
+class UsernameIndex:
+    """Aho-Corasick automaton over the case-folded usernames of all users.
+
+    find() scans a text once and returns the primary keys of the users whose
+    username occurs in it as a whole word, i.e. not preceded or followed by a
+    letter, digit or underscore. That covers both "@name" and a bare "name".
+    """
+
+    def __init__(self, usernames):
+        # Node 0 is the root. goto[n] maps a character to the next node,
+        # fail[n] is the node of the longest proper suffix of n's path that is
+        # also in the trie, and output[n] lists (length, user pk) of the
+        # usernames that end at n.
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for pk, username in usernames:
+            node = 0
+            name = username.casefold()
+            for c in name:
+                next_node = self.goto[node].get(c)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][c] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                node = next_node
+            self.output[node].append((len(name), pk))
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for c, child in self.goto[node].items():
+                fail = self.fail[node]
+                while fail and c not in self.goto[fail]:
+                    fail = self.fail[fail]
+                fail = self.goto[fail].get(c, 0)
+                self.fail[child] = fail
+                if self.output[fail]:
+                    self.output[child] = self.output[child] + self.output[fail]
+                queue.append(child)
+
+    def find(self, text: str) -> set:
+        text = text.casefold()
+        found = set()
+        node = 0
+        for i, c in enumerate(text):
+            while node and c not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(c, 0)
+            for length, pk in self.output[node]:
+                start = i - length + 1
+                if start > 0 and _is_word_char(text[start - 1]):
+                    continue
+                if i + 1 < len(text) and _is_word_char(text[i + 1]):
+                    continue
+                found.add(pk)
+        return found
+
+
+_lock = threading.Lock()
+_index = None
+_index_version = None
+
+
+def username_index() -> UsernameIndex:
+    """Return this process's UsernameIndex, rebuilding it if a user was
+    created, renamed or deleted since it was built, in this or another
+    process (provided the cache is shared between processes)."""
+    global _index, _index_version
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set(VERSION_KEY, version, timeout=None)
+    with _lock:
+        if _index is None or _index_version != version:
+            _index = UsernameIndex(
+                User.objects.exclude(username__isnull=True)
+                .exclude(username="")
+                .values_list("pk", "username")
+            )
+            _index_version = version
+        return _index
+
+
+def mentioned_users(text: str):
+    """Users mentioned in `text`, as a queryset."""
+    return User.objects.filter(pk__in=username_index().find(text or ""))
+
+
+@receiver(post_save, sender=User)
+def user_save_receiver(sender, instance, created, raw, using, update_fields, **kwargs):
+    if created or update_fields is None or "username" in update_fields:
+        cache.delete(VERSION_KEY)
+
+
+@receiver(post_delete, sender=User)
+def user_delete_receiver(sender, instance, using, **kwargs):
+    cache.delete(VERSION_KEY)
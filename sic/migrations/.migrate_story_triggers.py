@@ -143,11 +143,34 @@ CREATE_DELETE_COMMENT = """CREATE TRIGGER sic_vote_delete_comment AFTER DELETE O
                         id = OLD.comment_id;
                         END;"""
 
+CREATE_INSERT_HOTNESS = """CREATE TRIGGER sic_vote_insert_hotness AFTER INSERT ON sic_vote
+                    FOR EACH ROW
+                    BEGIN
+                    UPDATE sic_story
+                    SET hotness_score = (hotness_score + (CASE WHEN NEW.comment_id IS NULL THEN 1.0 ELSE 0.25 END))
+                    WHERE
+                        id = NEW.story_id
+                        AND (NEW.comment_id IS NULL OR NOT EXISTS (SELECT 1 FROM sic_comment AS c WHERE c.id = NEW.comment_id AND c.user_id = sic_story.user_id));
+                        END;"""
+
+CREATE_DELETE_HOTNESS = """CREATE TRIGGER sic_vote_delete_hotness AFTER DELETE ON sic_vote
+                    FOR EACH ROW
+                    BEGIN
+                    UPDATE sic_story
+                    SET hotness_score = (hotness_score - (CASE WHEN OLD.comment_id IS NULL THEN 1.0 ELSE 0.25 END))
+                    WHERE
+                        id = OLD.story_id
+                        AND (OLD.comment_id IS NULL OR NOT EXISTS (SELECT 1 FROM sic_comment AS c WHERE c.id = OLD.comment_id AND c.user_id = sic_story.user_id));
+                        END;"""
+
 DROP_INSERT = """DROP TRIGGER sic_vote_insert;"""
 DROP_DELETE = """DROP TRIGGER sic_vote_delete;"""
 DROP_INSERT_COMMENT = """DROP TRIGGER sic_vote_insert_comment;"""
 DROP_DELETE_COMMENT = """DROP TRIGGER sic_vote_delete_comment;"""
 
+DROP_INSERT_HOTNESS = """DROP TRIGGER sic_vote_insert_hotness;"""
+DROP_DELETE_HOTNESS = """DROP TRIGGER sic_vote_delete_hotness;"""
+
 DROP_TAGGREGATION_TAGS = """DROP VIEW taggregation_tags;"""
 DROP_VIEW_TAGGREGATION_STORIES = """DROP VIEW taggregation_stories;"""
 DROP_UPDATE_LAST_MODIFIED_STORY_ON_INSERT_VOTE = (
@@ -186,5 +209,171 @@ CREATES = [
     CREATE_TAGGREGATION_LAST_ACTIVE,
 ]
 
-if len(DROPS) != len(CREATES):
+# Added in 0088_story_hotness_score.
+HOTNESS_DROPS = [
+    DROP_INSERT_HOTNESS,
+    DROP_DELETE_HOTNESS,
+]
+HOTNESS_CREATES = [
+    CREATE_INSERT_HOTNESS,
+    CREATE_DELETE_HOTNESS,
+]
+
+# Added in 0089_materialize_taggregation_stories: taggregation_stories is a
+# table kept current by the following triggers, which recompute the rows of the
+# affected stories or taggregations from the taggregation_stories_source view
+# (the former taggregation_stories view).
+CREATE_VIEW_TAGGREGATION_STORIES_SOURCE = CREATE_VIEW_TAGGREGATION_STORIES.replace(
+    "CREATE VIEW taggregation_stories AS", "CREATE VIEW taggregation_stories_source AS"
+)
+DROP_VIEW_TAGGREGATION_STORIES_SOURCE = """DROP VIEW taggregation_stories_source;"""
+
+CREATE_TABLE_TAGGREGATION_STORIES = """CREATE TABLE taggregation_stories (
+    id integer NOT NULL,
+    has_id integer NOT NULL,
+    taggregation_id integer NOT NULL,
+    PRIMARY KEY (taggregation_id, id, has_id)
+) WITHOUT ROWID;"""
+CREATE_INDEX_TAGGREGATION_STORIES = (
+    """CREATE INDEX taggregation_stories_story_id ON taggregation_stories (id);"""
+)
+DROP_TABLE_TAGGREGATION_STORIES = """DROP TABLE taggregation_stories;"""
+
+POPULATE_TAGGREGATION_STORIES = """INSERT INTO taggregation_stories (id, has_id, taggregation_id)
+SELECT id, has_id, taggregation_id FROM taggregation_stories_source;"""
+
+
+def refresh_taggregation_stories(column, where):
+    return f"""DELETE FROM taggregation_stories WHERE {column} {where};
+    INSERT INTO taggregation_stories (id, has_id, taggregation_id)
+    SELECT id, has_id, taggregation_id FROM taggregation_stories_source WHERE {column} {where};"""
+
+
+def filter_taggregations(storyfilter_id):
+    return f"""IN (SELECT has.taggregation_id FROM sic_taggregationhastag AS has
+        JOIN sic_taggregationhastag_exclude_filters AS ef ON ef.taggregationhastag_id = has.id
+        WHERE ef.storyfilter_id = {storyfilter_id})"""
+
+
+TAGGREGATION_STORIES_TRIGGERS = {
+    "taggregation_stories_story_tags_insert": f"""AFTER INSERT ON sic_story_tags FOR EACH ROW
+BEGIN
+    {refresh_taggregation_stories("id", "= NEW.story_id")}
+END;""",
+    "taggregation_stories_story_tags_delete": f"""AFTER DELETE ON sic_story_tags FOR EACH ROW
+BEGIN
+    {refresh_taggregation_stories("id", "= OLD.story_id")}
+END;""",
+    "taggregation_stories_story_update": f"""AFTER UPDATE OF domain_id, user_id ON sic_story FOR EACH ROW
+BEGIN
+    {refresh_taggregation_stories("id", "= NEW.id")}
+END;""",
+    "taggregation_stories_story_delete": """AFTER DELETE ON sic_story FOR EACH ROW
+BEGIN
+    DELETE FROM taggregation_stories WHERE id = OLD.id;
+END;""",
+    # A tag's membership in a taggregation doesn't depend on the edges to its
+    # children, so the taggregations to refresh are the ones that contain the
+    # parent.
+    "taggregation_stories_tag_parents_insert": f"""AFTER INSERT ON sic_tag_parents FOR EACH ROW
+BEGIN
+    {refresh_taggregation_stories("taggregation_id", "IN (SELECT taggregation_id FROM taggregation_tags WHERE tag_id = NEW.to_tag_id)")}
+END;""",
+    "taggregation_stories_tag_parents_delete": f"""AFTER DELETE ON sic_tag_parents FOR EACH ROW
+BEGIN
+    {refresh_taggregation_stories("taggregation_id", "IN (SELECT taggregation_id FROM taggregation_tags WHERE tag_id = OLD.to_tag_id)")}
+END;""",
+    "taggregation_stories_has_insert": f"""AFTER INSERT ON sic_taggregationhastag FOR EACH ROW
+BEGIN
+    {refresh_taggregation_stories("taggregation_id", "= NEW.taggregation_id")}
+END;""",
+    "taggregation_stories_has_update": f"""AFTER UPDATE ON sic_taggregationhastag FOR EACH ROW
+BEGIN
+    {refresh_taggregation_stories("taggregation_id", "IN (OLD.taggregation_id, NEW.taggregation_id)")}
+END;""",
+    "taggregation_stories_has_delete": f"""AFTER DELETE ON sic_taggregationhastag FOR EACH ROW
+BEGIN
+    {refresh_taggregation_stories("taggregation_id", "= OLD.taggregation_id")}
+END;""",
+    "taggregation_stories_exclude_filters_insert": f"""AFTER INSERT ON sic_taggregationhastag_exclude_filters FOR EACH ROW
+BEGIN
+    {refresh_taggregation_stories("taggregation_id", "IN (SELECT taggregation_id FROM sic_taggregationhastag WHERE id = NEW.taggregationhastag_id)")}
+END;""",
+    "taggregation_stories_exclude_filters_delete": f"""AFTER DELETE ON sic_taggregationhastag_exclude_filters FOR EACH ROW
+BEGIN
+    {refresh_taggregation_stories("taggregation_id", "IN (SELECT taggregation_id FROM sic_taggregationhastag WHERE id = OLD.taggregationhastag_id)")}
+END;""",
+    "taggregation_stories_matchfilter_update": f"""AFTER UPDATE ON sic_matchfilter FOR EACH ROW
+BEGIN
+    {refresh_taggregation_stories("taggregation_id", filter_taggregations("NEW.storyfilter_ptr_id"))}
+END;""",
+    "taggregation_stories_userfilter_update": f"""AFTER UPDATE ON sic_userfilter FOR EACH ROW
+BEGIN
+    {refresh_taggregation_stories("taggregation_id", filter_taggregations("NEW.storyfilter_ptr_id"))}
+END;""",
+    "taggregation_stories_exacttagfilter_update": f"""AFTER UPDATE ON sic_exacttagfilter FOR EACH ROW
+BEGIN
+    {refresh_taggregation_stories("taggregation_id", filter_taggregations("NEW.storyfilter_ptr_id"))}
+END;""",
+}
+
+TAGGREGATION_STORIES_DROPS = [
+    f"DROP TRIGGER {name};" for name in TAGGREGATION_STORIES_TRIGGERS
+] + [DROP_VIEW_TAGGREGATION_STORIES_SOURCE]
+TAGGREGATION_STORIES_CREATES = [CREATE_VIEW_TAGGREGATION_STORIES_SOURCE] + [
+    f"CREATE TRIGGER {name} {body}"
+    for name, body in TAGGREGATION_STORIES_TRIGGERS.items()
+]
+
+# Migrations that rebuild sic_story after 0089_materialize_taggregation_stories
+# should use LATEST_DROPS and LATEST_CREATES.
+LATEST_DROPS = (
+    [d for d in DROPS if d != DROP_VIEW_TAGGREGATION_STORIES]
+    + HOTNESS_DROPS
+    + TAGGREGATION_STORIES_DROPS
+)
+LATEST_CREATES = (
+    [c for c in CREATES if c != CREATE_VIEW_TAGGREGATION_STORIES]
+    + HOTNESS_CREATES
+    + TAGGREGATION_STORIES_CREATES
+)
+
+# Added in 0095_user_karma. These read sic_story and write sic_user, so
+# migrations after it that rebuild either table should also use USER_KARMA_DROPS
+# and USER_KARMA_CREATES.
+CREATE_INSERT_USER = """CREATE TRIGGER sic_vote_insert_user AFTER INSERT ON sic_vote
+                    FOR EACH ROW WHEN NEW.comment_id IS NULL
+                    BEGIN
+                    UPDATE sic_user
+                    SET karma = (karma + 1)
+                    WHERE
+                        id = (SELECT user_id FROM sic_story WHERE id = NEW.story_id);
+                        END;"""
+CREATE_DELETE_USER = """CREATE TRIGGER sic_vote_delete_user AFTER DELETE ON sic_vote
+                    FOR EACH ROW WHEN OLD.comment_id IS NULL
+                    BEGIN
+                    UPDATE sic_user
+                    SET karma = (karma - 1)
+                    WHERE
+                        id = (SELECT user_id FROM sic_story WHERE id = OLD.story_id);
+                        END;"""
+DROP_INSERT_USER = """DROP TRIGGER sic_vote_insert_user;"""
+DROP_DELETE_USER = """DROP TRIGGER sic_vote_delete_user;"""
+
+USER_KARMA_DROPS = [
+    DROP_INSERT_USER,
+    DROP_DELETE_USER,
+]
+USER_KARMA_CREATES = [
+    CREATE_INSERT_USER,
+    CREATE_DELETE_USER,
+]
+
+if (
+    len(DROPS) != len(CREATES)
+    or len(HOTNESS_DROPS) != len(HOTNESS_CREATES)
+    or len(TAGGREGATION_STORIES_DROPS) != len(TAGGREGATION_STORIES_CREATES)
+    or len(LATEST_DROPS) != len(LATEST_CREATES)
+    or len(USER_KARMA_DROPS) != len(USER_KARMA_CREATES)
+):
     raise Exception("Mismatched CREATEs and DROPs")
@@ -0,0 +1,66 @@
+# Generated by Django 3.2.20 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+import importlib.util
+import sys
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+spec = importlib.util.spec_from_file_location(
+    "migrate_story_triggers", BASE_DIR / ".migrate_story_triggers.py"
+)
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+sys.modules["migrate_story_triggers"] = module
+
+from migrate_story_triggers import CREATES, DROPS, HOTNESS_CREATES, HOTNESS_DROPS
+
+# Keep in sync with KarmaRanking.decay_hotness() in sic/voting.py
+CALCULATE_HOTNESS = """UPDATE sic_story SET hotness_score = karma
+    + (CASE WHEN user_is_author AND url IS NOT NULL THEN 0.25 ELSE 0.0 END)
+    + 0.25 * COALESCE((SELECT SUM(c.karma) FROM sic_comment AS c WHERE c.story_id = sic_story.id AND c.user_id != sic_story.user_id), 0)
+    - ROUND(CAST((julianday('now') - julianday(created)) * 86400 AS INTEGER) / 79200.0, 3);"""
+
+
+def create_decay_job(apps, schema_editor):
+    JobKind = apps.get_model("sic", "JobKind")
+    Job = apps.get_model("sic", "Job")
+    kind, _ = JobKind.objects.get_or_create(dotted_path="sic.jobs.decay_hotness")
+    Job.objects.get_or_create(kind=kind, periodic=True, defaults={"active": True})
+
+
+def delete_decay_job(apps, schema_editor):
+    JobKind = apps.get_model("sic", "JobKind")
+    JobKind.objects.filter(dotted_path="sic.jobs.decay_hotness").delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sic", "0087_add_story_requires_javascript"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=DROPS,
+            reverse_sql=CREATES,
+        ),
+        migrations.AddField(
+            model_name="story",
+            name="hotness_score",
+            field=models.FloatField(blank=True, db_index=True, default=0.0),
+        ),
+        migrations.RunSQL(
+            sql=CREATES,
+            reverse_sql=DROPS,
+        ),
+        migrations.RunSQL(
+            sql=HOTNESS_CREATES,
+            reverse_sql=HOTNESS_DROPS,
+        ),
+        migrations.RunSQL(
+            sql=[(CALCULATE_HOTNESS, [])],
+            reverse_sql=[("", [])],
+        ),
+        migrations.RunPython(create_decay_job, delete_decay_job),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 3.2.20 on 2026-10-17 11:40
+
+from django.db import migrations
+
+import importlib.util
+import sys
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+spec = importlib.util.spec_from_file_location(
+    "migrate_story_triggers", BASE_DIR / ".migrate_story_triggers.py"
+)
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+sys.modules["migrate_story_triggers"] = module
+
+from migrate_story_triggers import (
+    CREATE_INDEX_TAGGREGATION_STORIES,
+    CREATE_TABLE_TAGGREGATION_STORIES,
+    CREATE_TAGGREGATION_LAST_ACTIVE,
+    CREATE_VIEW_TAGGREGATION_STORIES,
+    DROP_TABLE_TAGGREGATION_STORIES,
+    DROP_TAGGREGATION_LAST_ACTIVE,
+    DROP_VIEW_TAGGREGATION_STORIES,
+    POPULATE_TAGGREGATION_STORIES,
+    TAGGREGATION_STORIES_CREATES,
+    TAGGREGATION_STORIES_DROPS,
+)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sic", "0088_story_hotness_score"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                DROP_TAGGREGATION_LAST_ACTIVE,
+                DROP_VIEW_TAGGREGATION_STORIES,
+                CREATE_TABLE_TAGGREGATION_STORIES,
+                CREATE_INDEX_TAGGREGATION_STORIES,
+                CREATE_TAGGREGATION_LAST_ACTIVE,
+            ],
+            reverse_sql=[
+                DROP_TAGGREGATION_LAST_ACTIVE,
+                DROP_TABLE_TAGGREGATION_STORIES,
+                CREATE_VIEW_TAGGREGATION_STORIES,
+                CREATE_TAGGREGATION_LAST_ACTIVE,
+            ],
+        ),
+        migrations.RunSQL(
+            sql=TAGGREGATION_STORIES_CREATES,
+            reverse_sql=list(reversed(TAGGREGATION_STORIES_DROPS)),
+        ),
+        migrations.RunSQL(
+            sql=[(POPULATE_TAGGREGATION_STORIES, [])],
+            reverse_sql=[("", [])],
+        ),
+    ]
@@ -0,0 +1,152 @@
+# Generated by Django 3.2.20 on 2026-10-17 12:25
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sic", "0089_materialize_taggregation_stories"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                """CREATE TABLE tag_closure (
+    ancestor_id integer NOT NULL,
+    descendant_id integer NOT NULL,
+    depth integer NOT NULL,
+    paths integer NOT NULL,
+    PRIMARY KEY (ancestor_id, depth, descendant_id)
+) WITHOUT ROWID;""",
+                """CREATE INDEX tag_closure_descendant ON tag_closure (descendant_id, ancestor_id);""",
+                # Every path from ancestor to descendant, grouped by length.
+                """INSERT INTO tag_closure (ancestor_id, descendant_id, depth, paths)
+WITH RECURSIVE w (
+    ancestor_id,
+    descendant_id,
+    depth
+) AS (
+    SELECT
+        id,
+        id,
+        0
+    FROM
+        sic_tag
+    UNION ALL
+    SELECT
+        w.ancestor_id,
+        p.from_tag_id,
+        w.depth + 1
+    FROM
+        sic_tag_parents AS p
+        JOIN w ON w.descendant_id = p.to_tag_id
+) SELECT
+    ancestor_id,
+    descendant_id,
+    depth,
+    COUNT(*)
+FROM
+    w
+GROUP BY
+    ancestor_id,
+    descendant_id,
+    depth;""",
+            ],
+            reverse_sql=[
+                "DROP INDEX tag_closure_descendant;",
+                "DROP TABLE tag_closure;",
+            ],
+        ),
+        migrations.RunSQL(
+            sql=[
+                """CREATE TRIGGER tag_closure_tag_insert
+AFTER INSERT ON sic_tag
+FOR EACH ROW
+BEGIN
+    INSERT INTO tag_closure (ancestor_id, descendant_id, depth, paths) VALUES (NEW.id, NEW.id, 0, 1);
+END;""",
+                """CREATE TRIGGER tag_closure_tag_delete
+AFTER DELETE ON sic_tag
+FOR EACH ROW
+BEGIN
+    DELETE FROM tag_closure WHERE ancestor_id = OLD.id OR descendant_id = OLD.id;
+END;""",
+                # from_tag is the child and to_tag the parent. Each path through
+                # the new edge is an ancestor path of to_tag joined with a
+                # descendant path of from_tag.
+                """CREATE TRIGGER tag_closure_parents_insert
+AFTER INSERT ON sic_tag_parents
+FOR EACH ROW
+BEGIN
+    INSERT INTO tag_closure (ancestor_id, descendant_id, depth, paths)
+    SELECT
+        a.ancestor_id,
+        d.descendant_id,
+        a.depth + 1 + d.depth,
+        a.paths * d.paths
+    FROM
+        tag_closure AS a,
+        tag_closure AS d
+    WHERE
+        a.descendant_id = NEW.to_tag_id
+        AND d.ancestor_id = NEW.from_tag_id
+    ON CONFLICT (ancestor_id, depth, descendant_id) DO UPDATE SET paths = paths + excluded.paths;
+END;""",
+                """CREATE TRIGGER tag_closure_parents_delete
+AFTER DELETE ON sic_tag_parents
+FOR EACH ROW
+BEGIN
+    UPDATE tag_closure SET paths = paths - COALESCE((
+        SELECT
+            SUM(a.paths * d.paths)
+        FROM
+            tag_closure AS a,
+            tag_closure AS d
+        WHERE
+            a.descendant_id = OLD.to_tag_id
+            AND d.ancestor_id = OLD.from_tag_id
+            AND a.ancestor_id = tag_closure.ancestor_id
+            AND d.descendant_id = tag_closure.descendant_id
+            AND a.depth + 1 + d.depth = tag_closure.depth), 0)
+    WHERE
+        ancestor_id IN (SELECT ancestor_id FROM tag_closure WHERE descendant_id = OLD.to_tag_id)
+        AND descendant_id IN (SELECT descendant_id FROM tag_closure WHERE ancestor_id = OLD.from_tag_id);
+    DELETE FROM tag_closure
+    WHERE
+        paths <= 0
+        AND ancestor_id IN (SELECT ancestor_id FROM tag_closure WHERE descendant_id = OLD.to_tag_id)
+        AND descendant_id IN (SELECT descendant_id FROM tag_closure WHERE ancestor_id = OLD.from_tag_id);
+END;""",
+            ],
+            reverse_sql=[
+                "DROP TRIGGER tag_closure_tag_insert;",
+                "DROP TRIGGER tag_closure_tag_delete;",
+                "DROP TRIGGER tag_closure_parents_insert;",
+                "DROP TRIGGER tag_closure_parents_delete;",
+            ],
+        ),
+        migrations.RunSQL(
+            sql=[
+                "DROP TRIGGER IF EXISTS sic_tag_parents_cycle_check;",
+                """CREATE TRIGGER sic_tag_parents_cycle_check
+BEFORE INSERT ON sic_tag_parents
+FOR EACH ROW
+BEGIN
+    SELECT RAISE(ABORT, 'Cycle detected ') WHERE EXISTS (
+    SELECT 1 FROM tag_closure WHERE ancestor_id = NEW.from_tag_id AND descendant_id = NEW.to_tag_id
+    );
+END;""",
+            ],
+            reverse_sql=[
+                "DROP TRIGGER IF EXISTS sic_tag_parents_cycle_check;",
+                """CREATE TRIGGER sic_tag_parents_cycle_check
+BEFORE INSERT ON sic_tag_parents
+FOR EACH ROW
+BEGIN
+    SELECT RAISE(ABORT, 'Cycle detected ') WHERE EXISTS (
+    SELECT 1 FROM cycle_check_view WHERE last_visited = NEW.to_tag_id AND already_visited LIKE '%'||NEW.from_tag_id||'%'
+    );
+END;""",
+            ],
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 3.2.20 on 2026-10-17 10:05
+
+from django.db import migrations, models
+
+import importlib.util
+import sys
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+spec = importlib.util.spec_from_file_location(
+    "migrate_story_triggers", BASE_DIR / ".migrate_story_triggers.py"
+)
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+sys.modules["migrate_story_triggers"] = module
+
+from migrate_story_triggers import LATEST_CREATES, LATEST_DROPS
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sic", "0090_tag_closure"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=LATEST_DROPS,
+            reverse_sql=LATEST_CREATES,
+        ),
+        migrations.AddField(
+            model_name="story",
+            name="description_html",
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="story",
+            name="description_plain_text",
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="story",
+            name="rendered_revision",
+            field=models.IntegerField(blank=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="comment",
+            name="text_html",
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="comment",
+            name="text_plain_text",
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="comment",
+            name="rendered_revision",
+            field=models.IntegerField(blank=True, default=0, editable=False),
+        ),
+        migrations.RunSQL(
+            sql=LATEST_CREATES,
+            reverse_sql=LATEST_DROPS,
+        ),
+    ]
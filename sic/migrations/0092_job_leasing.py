@@ -0,0 +1,32 @@
+# Generated by Django 3.2.20 on 2026-10-17 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sic", "0091_rendered_markdown_columns"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="job",
+            name="attempts",
+            field=models.IntegerField(blank=True, default=0),
+        ),
+        migrations.AddField(
+            model_name="job",
+            name="run_after",
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name="job",
+            name="locked_by",
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="job",
+            name="locked_until",
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 3.2.20 on 2026-10-17 07:59
+
+from django.db import migrations, models
+
+
+def create_index_job(apps, schema_editor):
+    JobKind = apps.get_model("sic", "JobKind")
+    Job = apps.get_model("sic", "Job")
+    kind, _ = JobKind.objects.get_or_create(dotted_path="sic.search.index_queued")
+    Job.objects.get_or_create(kind=kind, periodic=True, defaults={"active": True})
+
+
+def delete_index_job(apps, schema_editor):
+    JobKind = apps.get_model("sic", "JobKind")
+    JobKind.objects.filter(dotted_path="sic.search.index_queued").delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sic", "0092_job_leasing"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SearchIndexQueueEntry",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[("C", "Comment"), ("S", "Story")], max_length=1
+                    ),
+                ),
+                ("object_id", models.IntegerField()),
+                ("created", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "verbose_name_plural": "search index queue entries",
+            },
+        ),
+        migrations.RunPython(create_index_job, delete_index_job),
+    ]
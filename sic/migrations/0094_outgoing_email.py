@@ -0,0 +1,50 @@
+# Generated by Django 3.2.20 on 2026-10-17 08:06
+
+from django.db import migrations, models
+
+
+def create_outbox_job(apps, schema_editor):
+    JobKind = apps.get_model("sic", "JobKind")
+    Job = apps.get_model("sic", "Job")
+    kind, _ = JobKind.objects.get_or_create(dotted_path="sic.outbox.send_outbox")
+    Job.objects.get_or_create(kind=kind, periodic=True, defaults={"active": True})
+
+
+def delete_outbox_job(apps, schema_editor):
+    JobKind = apps.get_model("sic", "JobKind")
+    JobKind.objects.filter(dotted_path="sic.outbox.send_outbox").delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sic", "0093_search_index_queue"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OutgoingEmail",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                ("subject", models.TextField(blank=True)),
+                ("body", models.TextField(blank=True)),
+                ("from_email", models.TextField()),
+                ("to", models.JSONField()),
+                ("headers", models.JSONField(blank=True, default=dict)),
+                ("attempts", models.IntegerField(blank=True, default=0)),
+                (
+                    "send_after",
+                    models.DateTimeField(blank=True, default=None, null=True),
+                ),
+                (
+                    "locked_until",
+                    models.DateTimeField(blank=True, default=None, null=True),
+                ),
+                ("last_error", models.TextField(blank=True, default=None, null=True)),
+            ],
+            options={
+                "verbose_name_plural": "outgoing emails",
+            },
+        ),
+        migrations.RunPython(create_outbox_job, delete_outbox_job),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 3.2.20 on 2026-10-17 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sic", "0094_outgoing_email"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="karma",
+            field=models.IntegerField(blank=True, default=0),
+        ),
+        migrations.RunSQL(
+            sql=[
+                (
+                    """CREATE TRIGGER sic_vote_insert_user AFTER INSERT ON sic_vote
+                    FOR EACH ROW WHEN NEW.comment_id IS NULL
+                    BEGIN
+                    UPDATE sic_user
+                    SET karma = (karma + 1)
+                    WHERE
+                        id = (SELECT user_id FROM sic_story WHERE id = NEW.story_id);
+                        END;""",
+                    [],
+                )
+            ],
+            reverse_sql=[("DROP TRIGGER IF EXISTS sic_vote_insert_user", [])],
+        ),
+        migrations.RunSQL(
+            sql=[
+                (
+                    """CREATE TRIGGER sic_vote_delete_user AFTER DELETE ON sic_vote
+                    FOR EACH ROW WHEN OLD.comment_id IS NULL
+                    BEGIN
+                    UPDATE sic_user
+                    SET karma = (karma - 1)
+                    WHERE
+                        id = (SELECT user_id FROM sic_story WHERE id = OLD.story_id);
+                        END;""",
+                    [],
+                )
+            ],
+            reverse_sql=[("DROP TRIGGER IF EXISTS sic_vote_delete_user", [])],
+        ),
+        migrations.RunSQL(
+            sql=[
+                (
+                    """UPDATE sic_user SET karma = (SELECT COUNT(v.id) FROM sic_vote AS v JOIN sic_story AS s ON v.story_id = s.id WHERE s.user_id = sic_user.id AND v.comment_id IS NULL);""",
+                    [],
+                )
+            ],
+            reverse_sql=[("", [])],
+        ),
+    ]
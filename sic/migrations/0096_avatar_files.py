@@ -0,0 +1,107 @@
+# Generated by Django 3.2.20 on 2026-10-17 08:31
+
+import base64
+import hashlib
+import logging
+from django.db import migrations, models
+import django.db.models.deletion
+
+import importlib.util
+import sys
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+spec = importlib.util.spec_from_file_location(
+    "migrate_story_triggers", BASE_DIR / ".migrate_story_triggers.py"
+)
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+sys.modules["migrate_story_triggers"] = module
+
+from migrate_story_triggers import USER_KARMA_CREATES, USER_KARMA_DROPS
+
+logger = logging.getLogger("sic")
+
+
+def data_urls_to_avatars(apps, schema_editor):
+    User = apps.get_model("sic", "User")
+    Avatar = apps.get_model("sic", "Avatar")
+    for user in User.objects.exclude(avatar_data_url__isnull=True).exclude(
+        avatar_data_url=""
+    ):
+        try:
+            header, encoded = user.avatar_data_url.split(",", 1)
+            if not header.startswith("data:") or not header.endswith(";base64"):
+                raise ValueError(f"not a base64 data URL: {header}")
+            content_type = header[len("data:") :].split(";")[0] or "image/webp"
+            data = base64.b64decode(encoded)
+        except ValueError as exc:
+            logger.warning(f"Could not convert the avatar of user {user.pk}: {exc}")
+            continue
+        avatar, _ = Avatar.objects.get_or_create(
+            digest=hashlib.sha256(data).hexdigest(),
+            defaults={"content_type": content_type, "data": data},
+        )
+        user.avatar = avatar
+        user.save(update_fields=["avatar"])
+
+
+def avatars_to_data_urls(apps, schema_editor):
+    User = apps.get_model("sic", "User")
+    for user in User.objects.exclude(avatar=None).select_related("avatar"):
+        encoded = base64.b64encode(bytes(user.avatar.data)).decode("ascii")
+        user.avatar_data_url = f"data:{user.avatar.content_type};base64,{encoded}"
+        user.save(update_fields=["avatar_data_url"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sic", "0095_user_karma"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=USER_KARMA_DROPS,
+            reverse_sql=USER_KARMA_CREATES,
+        ),
+        migrations.CreateModel(
+            name="Avatar",
+            fields=[
+                (
+                    "digest",
+                    models.CharField(
+                        editable=False, max_length=64, primary_key=True, serialize=False
+                    ),
+                ),
+                ("content_type", models.CharField(max_length=64)),
+                ("data", models.BinaryField()),
+                ("created", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RenameField(
+            model_name="user",
+            old_name="avatar",
+            new_name="avatar_data_url",
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="avatar",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="sic.avatar",
+            ),
+        ),
+        migrations.RunPython(data_urls_to_avatars, avatars_to_data_urls),
+        migrations.RemoveField(
+            model_name="user",
+            name="avatar_data_url",
+        ),
+        migrations.RunSQL(
+            sql=USER_KARMA_CREATES,
+            reverse_sql=USER_KARMA_DROPS,
+        ),
+    ]
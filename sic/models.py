@@ -1,10 +1,12 @@
 from urllib.parse import urlparse, unquote_plus, quote_plus
 from datetime import datetime, timedelta
+import hashlib
 import string
 import uuid
 import abc
 import functools
 import itertools
+import operator
 import typing
 from django.db import models, connection, migrations
 from django.db.models import Q
@@ -27,6 +29,7 @@ from django.core.mail import EmailMessage
 from django.contrib.sites.shortcuts import get_current_site
 from django.contrib.sites.models import Site
 from django.conf import settings
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 from django.core.exceptions import ValidationError, MultipleObjectsReturned
 from django.core.validators import MinLengthValidator, URLValidator
@@ -34,7 +37,12 @@ from django.apps import apps
 
 config = apps.get_app_config("sic")
 
-from .markdown import comment_to_html, Textractor
+from .markdown import (
+    comment_to_html,
+    comments_to_html,
+    Textractor,
+    RENDERER_REVISION,
+)
 
 url_decode_translation = str.maketrans(string.ascii_lowercase[:10], string.digits)
 url_encode_translation = str.maketrans(string.digits, string.ascii_lowercase[:10])
@@ -143,8 +151,19 @@ class Story(models.Model):
     )
     content_warning = models.CharField(null=True, blank=True, max_length=30)
     karma = models.IntegerField(null=False, blank=True, default=0)
+    # Persisted config.post_ranking.story_hotness(), see sic/voting.py
+    hotness_score = models.FloatField(
+        null=False, blank=True, default=0.0, db_index=True
+    )
     message_id = models.TextField(null=True, blank=True)
     requires_javascript = models.BooleanField(default=False, null=False)
+    # Rendered description, valid only if rendered_revision is the current
+    # sic.markdown.RENDERER_REVISION
+    description_html = models.TextField(null=True, blank=True, editable=False)
+    description_plain_text = models.TextField(null=True, blank=True, editable=False)
+    rendered_revision = models.IntegerField(
+        null=False, blank=True, default=0, editable=False
+    )
 
     class Meta:
         verbose_name_plural = "stories"
@@ -186,19 +205,119 @@ class Story(models.Model):
     def hotness(self):
         return config.post_ranking.story_hotness(self)
 
+    @staticmethod
+    def annotate_pinned(stories):
+        """Annotate a Story queryset with `pinned_status`, true for currently
+        pinned stories."""
+        now = make_aware(datetime.now())
+        unix_epoch = make_aware(datetime.fromtimestamp(0))
+        return stories.annotate(
+            pinned_status=models.Case(
+                models.When(Q(pinned__gte=now) | Q(pinned=unix_epoch), then=True),
+                default=False,
+                output_field=models.BooleanField(),
+            )
+        )
+
+    @staticmethod
+    def order_by_hotness(stories, reverse=True):
+        """Order a Story queryset by its persisted hotness score, with
+        currently pinned stories first. Pinned stories are annotated with
+        `pinned_status`. Ties are broken by primary key so that the ordering
+        can be used for keyset pagination."""
+        return Story.annotate_pinned(stories).order_by(
+            "-pinned_status",
+            "-hotness_score" if reverse else "hotness_score",
+            "created",
+            "id",
+        )
+
+    @cached_property
+    def active_comment_count(self):
+        return self.active_comments.count()
+
+    @staticmethod
+    def preload_listing_context(stories, user):
+        """Fetch what posts/story_list_item.html shows for each of `stories`
+        with a fixed number of queries instead of several per story: authors,
+        domains, tags, comment counts and whether `user` has upvoted or
+        bookmarked them. Items of `stories` that aren't stories are ignored."""
+        stories = [s for s in stories if isinstance(s, Story)]
+        if not stories:
+            return
+        models.prefetch_related_objects(
+            stories, "user__banned_by_user", "domain", "tags"
+        )
+        pks = [s.pk for s in stories]
+        comment_counts = dict(
+            Comment.objects.filter(story_id__in=pks, deleted=False)
+            .order_by()
+            .values("story_id")
+            .annotate(count=models.Count("id"))
+            .values_list("story_id", "count")
+        )
+        upvoted = set()
+        bookmarked = set()
+        if user.is_authenticated:
+            upvoted = set(
+                Vote.objects.filter(
+                    user=user, story_id__in=pks, comment=None
+                ).values_list("story_id", flat=True)
+            )
+            bookmarked = set(
+                StoryBookmark.objects.filter(user=user, story_id__in=pks).values_list(
+                    "story_id", flat=True
+                )
+            )
+        for story in stories:
+            # Fill in the cached properties the template reads
+            story.__dict__["active_comment_count"] = comment_counts.get(story.pk, 0)
+            story.listing_context = {
+                "user_pk": user.pk,
+                "upvoted": story.pk in upvoted,
+                "bookmarked": story.pk in bookmarked,
+            }
+
     @cached_property
     def description_to_html(self):
+        if self.rendered_revision == RENDERER_REVISION:
+            return mark_safe(self.description_html)
         return comment_to_html(self.description)
 
     @cached_property
     def description_to_plain_text(self):
+        if self.rendered_revision == RENDERER_REVISION:
+            return self.description_plain_text
         return Textractor.extract(self.description_to_html).strip()
 
+    def render_description(self):
+        Story.render_descriptions([self])
+
+    @staticmethod
+    def render_descriptions(stories):
+        htmls = comments_to_html(story.description or "" for story in stories)
+        for story, html in zip(stories, htmls):
+            story.__dict__.pop("description_to_html", None)
+            story.__dict__.pop("description_to_plain_text", None)
+            story.description_html = html
+            story.description_plain_text = Textractor.extract(html).strip()
+            story.rendered_revision = RENDERER_REVISION
+
     @cached_property
     def active_comments(self):
         return self.comments.filter(deleted=False)
 
     def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "description" in update_fields:
+            self.render_description()
+            if update_fields is not None:
+                kwargs["update_fields"] = {
+                    *update_fields,
+                    "description_html",
+                    "description_plain_text",
+                    "rendered_revision",
+                }
         if self.url:
             netloc = urlparse(self.url).netloc
             if netloc.startswith("www."):
@@ -262,6 +381,48 @@ class Story(models.Model):
             match |= has_match
         return match
 
+    def subscribed_users(self, users):
+        """The users of the `users` queryset subscribed to a taggregation
+        whose page lists this story and whose own exclude filters don't hide
+        it, found with a fixed number of queries however many users and
+        subscriptions there are."""
+        if (
+            not Story.objects.filter(pk=self.pk, active=True)
+            .exclude(~Q(story__pk=None))
+            .exists()
+        ):
+            return users.none()
+        tag_pks = list(self.tags.values_list("pk", flat=True))
+        # The filters whose as_q() matches this story
+        tag_filters = ExactTagFilter.objects.filter(tag__in=tag_pks).values("pk")
+        domain_filters = DomainFilter.objects.none()
+        if self.domain_id is not None:
+            domain_filters = (
+                DomainFilter.objects.annotate(
+                    story_domain=models.Value(
+                        self.domain_id, output_field=models.TextField()
+                    )
+                )
+                .filter(
+                    Q(is_regexp=False, story_domain__contains=models.F("match_string"))
+                    | Q(is_regexp=True, story_domain__regex=models.F("match_string"))
+                )
+                .values("pk")
+            )
+        # The taggregations whose page lists this story, with the filters
+        # of their tags (tag, domain and user) applied like on the front
+        # page. Users' own exclude filters only match by tag and domain.
+        subscribed = RawSQL(
+            "SELECT taggregation_id FROM taggregation_stories WHERE id = %s",
+            [self.pk],
+        )
+        return (
+            users.filter(taggregation_subscriptions__in=subscribed)
+            .exclude(exclude_filters__in=tag_filters)
+            .exclude(exclude_filters__in=domain_filters)
+            .distinct()
+        )
+
     @staticmethod
     @functools.lru_cache(None)
     def content_type():
@@ -357,10 +518,30 @@ class Comment(models.Model):
     text = models.TextField(null=True, blank=False)
     karma = models.IntegerField(null=False, blank=True, default=0)
     message_id = models.TextField(null=True, blank=True)
+    # Rendered text, valid only if rendered_revision is the current
+    # sic.markdown.RENDERER_REVISION
+    text_html = models.TextField(null=True, blank=True, editable=False)
+    text_plain_text = models.TextField(null=True, blank=True, editable=False)
+    rendered_revision = models.IntegerField(
+        null=False, blank=True, default=0, editable=False
+    )
 
     def __str__(self):
         return f"{self.user} {self.created}"
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "text" in update_fields:
+            self.render_text()
+            if update_fields is not None:
+                kwargs["update_fields"] = {
+                    *update_fields,
+                    "text_html",
+                    "text_plain_text",
+                    "rendered_revision",
+                }
+        super().save(*args, **kwargs)
+
     @staticmethod
     @functools.lru_cache(None)
     def content_type():
@@ -394,12 +575,84 @@ class Comment(models.Model):
 
     @cached_property
     def text_to_html(self):
+        if self.rendered_revision == RENDERER_REVISION:
+            return mark_safe(self.text_html)
         return comment_to_html(self.text)
 
     @cached_property
     def text_to_plain_text(self):
+        if self.rendered_revision == RENDERER_REVISION:
+            return self.text_plain_text
         return Textractor.extract(self.text_to_html).strip()
 
+    def render_text(self):
+        Comment.render_texts([self])
+
+    @staticmethod
+    def render_texts(comments):
+        htmls = comments_to_html(comment.text or "" for comment in comments)
+        for comment, html in zip(comments, htmls):
+            comment.__dict__.pop("text_to_html", None)
+            comment.__dict__.pop("text_to_plain_text", None)
+            comment.text_html = html
+            comment.text_plain_text = Textractor.extract(html).strip()
+            comment.rendered_revision = RENDERER_REVISION
+
+    @cached_property
+    def has_replies(self):
+        return self.replies.exists()
+
+    @staticmethod
+    def preload_thread_context(comments, user):
+        """Fetch what posts/comment.html shows for each of `comments` with a
+        fixed number of queries: authors, stories, hats, whether they have
+        replies, their last moderation log entry and whether `user` has
+        upvoted them. Comments without up to date rendered HTML are rendered
+        together (but not saved)."""
+        from .moderation import ModerationLogEntry
+
+        comments = list(comments)
+        if not comments:
+            return
+        models.prefetch_related_objects(
+            comments, "user__banned_by_user", "story", "hat"
+        )
+        Comment.render_texts(
+            [c for c in comments if c.rendered_revision != RENDERER_REVISION]
+        )
+        pks = [c.pk for c in comments]
+        with_replies = set(
+            Comment.objects.filter(parent_id__in=pks)
+            .order_by()
+            .values_list("parent_id", flat=True)
+            .distinct()
+        )
+        log_entries = {}
+        for entry in (
+            ModerationLogEntry.objects.filter(
+                content_type_id=Comment.content_type().id,
+                object_id__in=[str(pk) for pk in pks],
+            )
+            .select_related("user")
+            .order_by("action_time")
+        ):
+            log_entries[entry.object_id] = entry
+        upvoted = set()
+        if user.is_authenticated:
+            upvoted = set(
+                Vote.objects.filter(user=user, comment_id__in=pks).values_list(
+                    "comment_id", flat=True
+                )
+            )
+        for comment in comments:
+            # Fill in the cached properties the template reads
+            comment.__dict__["has_replies"] = comment.pk in with_replies
+            comment.__dict__["last_log_entry"] = log_entries.get(str(comment.pk))
+            comment.thread_context = {
+                "user_pk": user.pk,
+                "upvoted": comment.pk in upvoted,
+            }
+
     @property
     def get_message_id(self) -> str:
         if not self.message_id:
@@ -434,67 +687,17 @@ class Tag(models.Model):
 
     def get_stories(self, depth=0):
         if depth is None:
-            return Story.objects.filter(
-                tags__pk__in=RawSQL(
-                    """WITH RECURSIVE w (
-    root_tag_id,
-    tag_id,
-    depth
-) AS (
-    SELECT DISTINCT
-        id,
-        id,
-        0
-    FROM
-        sic_tag
-    UNION ALL
-    SELECT
-        w.root_tag_id,
-        p.from_tag_id,
-        w.depth + 1
-    FROM
-        sic_tag_parents AS p
-        JOIN w ON w.tag_id = p.to_tag_id
-) SELECT DISTINCT
-    tag_id
-FROM
-    w
-WHERE
-    root_tag_id = %s""",
-                    [self.pk],
-                ),
-                active=True,
-            ).prefetch_related("tags", "user", "comments")
-        return Story.objects.filter(
-            tags__pk__in=RawSQL(
-                """WITH RECURSIVE w (
-    root_tag_id,
-    tag_id,
-    depth
-) AS (
-    SELECT DISTINCT
-        id,
-        id,
-        0
-    FROM
-        sic_tag
-    UNION ALL
-    SELECT
-        w.root_tag_id,
-        p.from_tag_id,
-        w.depth + 1
-    FROM
-        sic_tag_parents AS p
-        JOIN w ON w.tag_id = p.to_tag_id
-) SELECT DISTINCT
-    tag_id
-FROM
-    w
-WHERE
-    root_tag_id = %s AND
-    depth <= %s""",
+            sql, params = (
+                "SELECT descendant_id FROM tag_closure WHERE ancestor_id = %s",
+                [self.pk],
+            )
+        else:
+            sql, params = (
+                "SELECT descendant_id FROM tag_closure WHERE ancestor_id = %s AND depth <= %s",
                 [self.pk, depth],
-            ),
+            )
+        return Story.objects.filter(
+            tags__pk__in=RawSQL(sql, params),
             active=True,
         ).prefetch_related("tags", "user", "comments")
 
@@ -1013,6 +1216,41 @@ class UserManager(BaseUserManager):
         return user
 
 
+class Avatar(models.Model):
+    """An avatar image, stored once per distinct content under its SHA-256
+    digest. The avatar view serves it with a long-lived cache lifetime, since
+    the content of a URL never changes."""
+
+    digest = models.CharField(primary_key=True, max_length=64, editable=False)
+    content_type = models.CharField(null=False, blank=False, max_length=64)
+    data = models.BinaryField(null=False, blank=False)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.digest
+
+    @staticmethod
+    def store(data: bytes, content_type: str) -> "Avatar":
+        digest = hashlib.sha256(data).hexdigest()
+        avatar, _ = Avatar.objects.get_or_create(
+            digest=digest, defaults={"content_type": content_type, "data": data}
+        )
+        return avatar
+
+    @staticmethod
+    def delete_unused(digest):
+        """Delete the avatar with `digest` unless some user still has it.
+        Call after a user's avatar changes, with the digest of the old one."""
+        if digest is None:
+            return
+        Avatar.objects.filter(digest=digest).exclude(
+            models.Exists(User.objects.filter(avatar=models.OuterRef("pk")))
+        ).delete()
+
+    def get_absolute_url(self):
+        return reverse("avatar", kwargs={"digest": self.digest})
+
+
 class User(PermissionsMixin, AbstractBaseUser):
     id = models.AutoField(primary_key=True)
     username = models.CharField(null=True, blank=True, unique=True, max_length=100)
@@ -1024,7 +1262,14 @@ class User(PermissionsMixin, AbstractBaseUser):
     email_validated = models.BooleanField(default=False, null=False, blank=True)
     created = models.DateTimeField(auto_now_add=True)
     about = models.TextField(null=True, blank=True)
-    avatar = models.CharField(null=True, blank=True, editable=False, max_length=8196)
+    avatar = models.ForeignKey(
+        Avatar,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="+",
+        on_delete=models.SET_NULL,
+    )
     avatar_title = models.CharField(
         null=True, blank=True, editable=True, max_length=256
     )
@@ -1044,6 +1289,8 @@ class User(PermissionsMixin, AbstractBaseUser):
     exclude_filters = models.ManyToManyField(
         "StoryFilter", blank=True, related_name="excluded_in_user"
     )
+    # Votes on the user's stories, kept up to date by triggers on sic_vote
+    karma = models.IntegerField(null=False, blank=True, default=0)
 
     # options
     email_notifications = models.BooleanField(default=True, null=False)
@@ -1141,10 +1388,6 @@ class User(PermissionsMixin, AbstractBaseUser):
                 request, messages.ERROR, f"Could not send email: {error}"
             )
 
-    @cached_property
-    def karma(self):
-        return Vote.objects.filter(story__user__id=self.pk, comment_id=None).count()
-
     def get_absolute_url(self):
         return reverse(
             "profile",
@@ -1155,6 +1398,21 @@ class User(PermissionsMixin, AbstractBaseUser):
     def is_banned(self):
         return self.banned_by_user is not None
 
+    @property
+    def avatar_url(self):
+        """URL of the avatar image, without loading it."""
+        if self.avatar_id is None:
+            return None
+        return reverse("avatar", kwargs={"digest": self.avatar_id})
+
+    def invalidate_permissions(self):
+        """Forget the permissions cached on this object by SicBackend, after
+        the user is banned or unbanned or their karma changes."""
+        self.__dict__.pop("_sic_perm_cache", None)
+        self.__dict__.pop("is_banned", None)
+        if self.pk is not None:
+            self.refresh_from_db(fields=["karma"])
+
     @cached_property
     def is_new_user(self):
         return (make_aware(datetime.now()) - self.created) < timedelta(
@@ -1364,18 +1622,17 @@ class Notification(models.Model):
             body += "\n\n"
             body += self.body
         body += f"\n\nYou can disable email notifications in your account settings: {root_url}{reverse('edit_settings')}"
-        try:
+        from sic.outbox import OutgoingEmail
+
+        OutgoingEmail.queue(
             EmailMessage(
                 f"[{config.verbose_name}] {self.name}",
                 body,
                 config.NOTIFICATION_FROM,
                 [self.user.email],
                 headers={"Message-ID": config.make_msgid()},
-            ).send(fail_silently=False)
-        except Exception as error:
-            messages.add_message(
-                request, messages.ERROR, f"Could not send notification. Error: {error}"
             )
+        )
 
     @staticmethod
     def latest(user):
@@ -1408,3 +1665,73 @@ class StoryRemoteContent(models.Model):
 
     def __str__(self):
         return f"{self.story} {self.url} {len(self.content)} bytes"
+
+
+# Link rules render story titles and whether users and tags exist into the
+# stored HTML of stories and comments, so it goes stale when those change.
+
+
+def rendered_links(sender, instance, old_value=None) -> typing.List[str]:
+    """Link markup whose rendering depends on `instance`."""
+    if sender is Story:
+        return [f"</s/{instance.pk}/"]
+    prefix = "u" if sender is User else "t"
+    names = {getattr(instance, LINKED_FIELDS[sender]), old_value} - {None, ""}
+    return [f"</{prefix}/{name}>" for name in names]
+
+
+def invalidate_rendered_links(links):
+    """Mark the stored HTML of stories and comments that contain any of
+    `links` as stale. It's rendered on read until the render_markdown
+    command stores it again."""
+    if not links:
+        return
+    Comment.objects.filter(
+        functools.reduce(operator.or_, (Q(text__contains=link) for link in links))
+    ).exclude(rendered_revision=0).update(rendered_revision=0)
+    Story.objects.filter(
+        functools.reduce(
+            operator.or_, (Q(description__contains=link) for link in links)
+        )
+    ).exclude(rendered_revision=0).update(rendered_revision=0)
+
+
+LINKED_FIELDS = {Story: "title", User: "username", Tag: "name"}
+
+
+@receiver(pre_save, sender=Story)
+@receiver(pre_save, sender=User)
+@receiver(pre_save, sender=Tag)
+def rendered_links_pre_save_receiver(
+    sender, instance, raw=False, update_fields=None, **kwargs
+):
+    field = LINKED_FIELDS[sender]
+    instance.__dict__.pop("_linked_field_value", None)
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and field not in update_fields:
+        return
+    instance._linked_field_value = (
+        sender.objects.filter(pk=instance.pk).values_list(field, flat=True).first()
+    )
+
+
+@receiver(post_save, sender=Story)
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Tag)
+def rendered_links_post_save_receiver(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        invalidate_rendered_links(rendered_links(sender, instance))
+    elif "_linked_field_value" in instance.__dict__:
+        old_value = instance.__dict__.pop("_linked_field_value")
+        if old_value != getattr(instance, LINKED_FIELDS[sender]):
+            invalidate_rendered_links(rendered_links(sender, instance, old_value))
+
+
+@receiver(post_delete, sender=Story)
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Tag)
+def rendered_links_post_delete_receiver(sender, instance, **kwargs):
+    invalidate_rendered_links(rendered_links(sender, instance))
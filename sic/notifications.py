@@ -1,6 +1,4 @@
-from django.db import connections
 from django.db.models.signals import post_save
-from django.db.models.expressions import RawSQL
 from django.dispatch import receiver
 from django.core.mail import EmailMessage
 from django.apps import apps
@@ -8,6 +6,8 @@ from django.urls import reverse
 
 config = apps.get_app_config("sic")
 from .models import Comment, Story, User, Message, Notification, InvitationRequest
+from .mentions import mentioned_users
+from .outbox import OutgoingEmail
 
 
 @receiver(post_save, sender=Comment)
@@ -34,28 +34,23 @@ def comment_save_receiver(
             url=comment.get_absolute_url(),
         )
     if config.DETECT_USERNAME_MENTIONS_IN_COMMENTS:
-        with connections["default"].cursor() as cursor:
-            mentioned_users = User.objects.filter(
-                id__in=RawSQL(
-                    f"SELECT user.id AS id FROM {config.MENTION_TOKENIZER_NAME}, sic_user AS user, sic_comment AS comment WHERE input = comment.text AND comment.id = %s AND token = user.username",
-                    (instance.pk,),
-                ),
-            ).exclude(id=comment.user.pk)
-            if comment.parent:
-                mentioned_users = mentioned_users.exclude(id=comment.parent.user.pk)
-            else:
-                mentioned_users = mentioned_users.exclude(id=comment.story.user.pk)
-            if mentioned_users.exists():
-                plain_text_comment = comment.text_to_plain_text
-                for user in mentioned_users:
-                    Notification.objects.create(
-                        user=user,
-                        name=f"{comment.user} has mentioned you in {comment.story.title}",
-                        kind=Notification.Kind.MENTION,
-                        body=f"{comment.user} has mentioned you:\n\n{plain_text_comment}",
-                        caused_by=comment.user,
-                        url=comment.get_absolute_url(),
-                    )
+        users = mentioned_users(comment.text).exclude(id=comment.user.pk)
+        if comment.parent:
+            users = users.exclude(id=comment.parent.user.pk)
+        else:
+            users = users.exclude(id=comment.story.user.pk)
+        users = list(users)
+        if users:
+            plain_text_comment = comment.text_to_plain_text
+            for user in users:
+                Notification.objects.create(
+                    user=user,
+                    name=f"{comment.user} has mentioned you in {comment.story.title}",
+                    kind=Notification.Kind.MENTION,
+                    body=f"{comment.user} has mentioned you:\n\n{plain_text_comment}",
+                    caused_by=comment.user,
+                    url=comment.get_absolute_url(),
+                )
 
 
 @receiver(post_save, sender=Message)
@@ -108,10 +103,12 @@ def new_invitation_request_receiver(
                 caused_by=None,
                 url=reverse("invitation_requests"),
             )
-        EmailMessage(
-            f"[{config.verbose_name}] confirmation of your invitation request",
-            f"This message is just a confirmation we have received your request.",
-            config.NOTIFICATION_FROM,
-            [req.address],
-            headers={"Message-ID": config.make_msgid()},
-        ).send(fail_silently=False)
+        OutgoingEmail.queue(
+            EmailMessage(
+                f"[{config.verbose_name}] confirmation of your invitation request",
+                f"This message is just a confirmation we have received your request.",
+                config.NOTIFICATION_FROM,
+                [req.address],
+                headers={"Message-ID": config.make_msgid()},
+            )
+        )
@@ -0,0 +1,154 @@
+import logging
+import time
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.db import models, transaction
+from django.apps import apps
+
+config = apps.get_app_config("sic")
+from sic import workers
+
+logger = logging.getLogger("sic")
+
+
+class OutgoingEmail(models.Model):
+    """An email waiting to be sent by send_outbox(), so that the request that
+    caused it doesn't wait on the mail server. Deleted once it's sent."""
+
+    id = models.AutoField(primary_key=True)
+    created = models.DateTimeField(auto_now_add=True)
+    subject = models.TextField(null=False, blank=True)
+    body = models.TextField(null=False, blank=True)
+    from_email = models.TextField(null=False, blank=False)
+    to = models.JSONField(null=False, blank=False)
+    headers = models.JSONField(null=False, blank=True, default=dict)
+    # Failed attempts so far; the email is given up on after
+    # EMAIL_MAX_ATTEMPTS and stays here for inspection.
+    attempts = models.IntegerField(null=False, blank=True, default=0)
+    send_after = models.DateTimeField(null=True, blank=True, default=None)
+    locked_until = models.DateTimeField(null=True, blank=True, default=None)
+    last_error = models.TextField(null=True, blank=True, default=None)
+
+    class Meta:
+        verbose_name_plural = "outgoing emails"
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.to)}"
+
+    @staticmethod
+    def from_message(message: EmailMessage, to=None) -> "OutgoingEmail":
+        """Raises ValueError for messages with parts that aren't stored, so
+        that they're not dropped silently."""
+        unsupported = [
+            field
+            for field in ["cc", "bcc", "reply_to", "attachments", "alternatives"]
+            if getattr(message, field, None)
+        ]
+        if unsupported:
+            raise ValueError(
+                f"Cannot queue an email with {', '.join(unsupported)}: only the subject, body, sender, recipients and headers are stored."
+            )
+        return OutgoingEmail(
+            subject=message.subject,
+            body=message.body,
+            from_email=message.from_email,
+            to=list(message.to if to is None else to),
+            headers=message.extra_headers,
+        )
+
+    @staticmethod
+    def queue(message: EmailMessage, recipients=None):
+        """Queue `message` for sending after the current transaction
+        commits. If `recipients` is given, `message` is a template that is
+        sent to each of them separately instead of to `message.to`."""
+        if recipients is None:
+            OutgoingEmail.queue_many([message])
+            return
+        OutgoingEmail.objects.bulk_create(
+            OutgoingEmail.from_message(message, [address]) for address in recipients
+        )
+        transaction.on_commit(OutboxSender.wake)
+
+    @staticmethod
+    def queue_many(messages):
+        """Queue several messages with a single insert."""
+        OutgoingEmail.objects.bulk_create(
+            OutgoingEmail.from_message(message) for message in messages
+        )
+        transaction.on_commit(OutboxSender.wake)
+
+    def message(self, connection=None) -> EmailMessage:
+        return EmailMessage(
+            self.subject,
+            self.body,
+            self.from_email,
+            self.to,
+            headers=self.headers,
+            connection=connection,
+        )
+
+    @staticmethod
+    def pending():
+        return OutgoingEmail.objects.filter(
+            workers.due("send_after"),
+            workers.unleased(),
+            attempts__lt=config.EMAIL_MAX_ATTEMPTS,
+        )
+
+    @staticmethod
+    def claim(limit):
+        """Lease up to `limit` pending emails to this sender and return their
+        primary keys."""
+        return workers.claim(OutgoingEmail.pending(), limit, ["pk"], config.EMAIL_LEASE)
+
+    def failed(self, exc):
+        self.attempts += 1
+        self.send_after = workers.retry_after(
+            self.attempts, config.EMAIL_RETRY_DELAY, config.EMAIL_MAX_RETRY_DELAY
+        )
+        self.locked_until = None
+        self.last_error = str(exc)
+        self.save(
+            update_fields=["attempts", "send_after", "locked_until", "last_error"]
+        )
+
+
+def send_outbox(job=None):
+    """Send pending emails in batches over one SMTP connection, at most one
+    every EMAIL_SEND_INTERVAL seconds. Can also run as a periodic job, which
+    retries failed emails."""
+    connection = None
+    last_sent = 0.0
+    try:
+        while True:
+            pks = OutgoingEmail.claim(config.EMAIL_BATCH_SIZE)
+            if not pks:
+                return True
+            if connection is None:
+                connection = mail.get_connection(fail_silently=False)
+            for email in OutgoingEmail.objects.filter(pk__in=pks).order_by("pk"):
+                wait = last_sent + config.EMAIL_SEND_INTERVAL - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                last_sent = time.monotonic()
+                try:
+                    # A no-op while the connection is open, so that it's kept
+                    # open instead of being opened and closed per message.
+                    connection.open()
+                    email.message(connection).send()
+                except Exception as exc:
+                    logger.exception(f"Could not send email {email.pk}: {exc}")
+                    email.failed(exc)
+                    # Start over with a new connection in case this one broke
+                    connection.close()
+                    continue
+                email.delete()
+    finally:
+        if connection is not None:
+            connection.close()
+
+
+# Runs send_outbox() whenever a transaction that queued an email commits
+OutboxSender = workers.BackgroundWorker(
+    "outbox_sender_thread", lambda: send_outbox(), "Could not send queued emails"
+)
@@ -0,0 +1,46 @@
+"""Extract the text of a PDF file page by page, stopping at a page and a
+character limit. Used by sic.remote_content in a separate process, so that
+a pathological PDF can be killed on a timeout:
+
+    python -m sic.pdf_text FILE MAX_PAGES MAX_CHARS
+"""
+import sys
+
+TRUNCATED_MARKER = "\n\n[truncated]"
+
+
+def extract(path, max_pages: int, max_chars: int) -> str:
+    from pdfminer.high_level import extract_pages
+    from pdfminer.layout import LTTextContainer
+
+    output = []
+    length = 0
+    truncated = False
+    for page_number, page_layout in enumerate(extract_pages(path)):
+        if page_number >= max_pages or length >= max_chars:
+            truncated = True
+            break
+        for element in page_layout:
+            if isinstance(element, LTTextContainer):
+                text = element.get_text().strip()
+                output.append(text)
+                length += len(text)
+    content = "".join(output).strip()
+    if len(content) > max_chars:
+        content = content[:max_chars]
+        truncated = True
+    if truncated:
+        content += TRUNCATED_MARKER
+    return content
+
+
+if __name__ == "__main__":
+    try:
+        _, path, max_pages, max_chars = sys.argv
+    except ValueError:
+        sys.exit(__doc__)
+    try:
+        content = extract(path, int(max_pages), int(max_chars))
+    except ImportError:
+        sys.exit("could not import pdfminer.six")
+    sys.stdout.buffer.write(content.encode("utf-8"))
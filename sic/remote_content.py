@@ -0,0 +1,378 @@
+import asyncio
+import collections
+import http.client
+import os
+import ssl
+import sys
+import tempfile
+import threading
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from urllib.parse import urlsplit, urljoin
+from django.apps import apps
+
+config = apps.get_app_config("sic")
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+FETCH_REMOTE_CONTENT_BIN = (
+    BASE_DIR / "tools/fetch_remote_content/target/debug/fetch_remote_content"
+)
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_4) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/80.0.3987.163 Safari/537.36"
+MAX_REDIRECTS = 5
+CHUNK_SIZE = 64 * 1024
+
+
+class Response(typing.NamedTuple):
+    url: str
+    status: int
+    content_type: str
+    # PDFs are spooled to the temporary file `path` instead, which the
+    # receiver must delete.
+    body: bytes
+    path: typing.Optional[str] = None
+    # Whether the document was larger than allowed and was cut off
+    truncated: bool = False
+    location: typing.Optional[str] = None
+
+
+class RemoteContent(typing.NamedTuple):
+    url: str
+    # Text extracted by tools/fetch_remote_content (or pdfminer for PDFs).
+    # None if nothing could be extracted, see `log`.
+    content: typing.Optional[str]
+    w3m_content: typing.Optional[str] = None
+    log: typing.Optional[str] = None
+
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections, reused across requests to the same
+    host. Blocking; RemoteContentFetcher calls it from executor threads."""
+
+    def __init__(self, timeout, max_idle_per_host, max_bytes, pdf_max_bytes):
+        self.timeout = timeout
+        self.max_idle_per_host = max_idle_per_host
+        self.max_bytes = max_bytes
+        self.pdf_max_bytes = pdf_max_bytes
+        self.ssl_context = ssl.create_default_context()
+        self.idle = collections.defaultdict(list)
+        self.lock = threading.Lock()
+
+    def _connect(self, scheme, netloc):
+        if scheme == "https":
+            return http.client.HTTPSConnection(
+                netloc, timeout=self.timeout, context=self.ssl_context
+            )
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def get(self, url) -> Response:
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            if parts.scheme not in ("http", "https"):
+                raise ValueError(f"Unsupported URL scheme: {parts.scheme}")
+            path = parts.path or "/"
+            if parts.query:
+                path += f"?{parts.query}"
+            key = (parts.scheme, parts.netloc)
+            response = self._request(key, path, url)
+            if response.location:
+                url = urljoin(url, response.location)
+                continue
+            return response
+        raise ValueError(f"Too many redirects: {url}")
+
+    def _request(self, key, path, url) -> Response:
+        with self.lock:
+            conn = self.idle[key].pop() if self.idle[key] else None
+        reused = conn is not None
+        if conn is None:
+            conn = self._connect(*key)
+        try:
+            try:
+                response = self._send(conn, path)
+            except (http.client.RemoteDisconnected, ConnectionError):
+                if not reused:
+                    raise
+                # The server closed an idle keep-alive connection; retry once
+                # with a new one.
+                conn.close()
+                conn = self._connect(*key)
+                response = self._send(conn, path)
+            ret = self._read(response, url)
+        except Exception:
+            conn.close()
+            raise
+        with self.lock:
+            if (
+                ret.truncated
+                or response.will_close
+                or len(self.idle[key]) >= self.max_idle_per_host
+            ):
+                conn.close()
+            else:
+                self.idle[key].append(conn)
+        return ret
+
+    @staticmethod
+    def _send(conn, path):
+        conn.request("GET", path, headers={"User-Agent": USER_AGENT})
+        return conn.getresponse()
+
+    def _read(self, response, url) -> Response:
+        """Read the body of `response` in chunks, up to the size limit of its
+        content type."""
+        content_type = response.getheader("Content-Type") or ""
+        if response.status in (301, 302, 303, 307, 308):
+            response.read()
+            return Response(
+                url=url,
+                status=response.status,
+                content_type=content_type,
+                body=b"",
+                location=response.getheader("Location"),
+            )
+        if "application/pdf" in content_type and response.status < 400:
+            output = tempfile.NamedTemporaryFile(
+                prefix="sic-remote-content-", suffix=".pdf", delete=False
+            )
+            max_bytes = self.pdf_max_bytes
+        else:
+            output = BytesIO()
+            max_bytes = self.max_bytes
+        truncated = False
+        try:
+            size = 0
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if size + len(chunk) > max_bytes:
+                    output.write(chunk[: max_bytes - size])
+                    truncated = True
+                    break
+                output.write(chunk)
+                size += len(chunk)
+        except Exception:
+            if isinstance(output, BytesIO):
+                raise
+            output.close()
+            os.unlink(output.name)
+            raise
+        if isinstance(output, BytesIO):
+            body, path = output.getvalue(), None
+        else:
+            output.close()
+            body, path = b"", output.name
+        return Response(
+            url=url,
+            status=response.status,
+            content_type=content_type,
+            body=body,
+            path=path,
+            truncated=truncated,
+        )
+
+    def close(self):
+        with self.lock:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+            self.idle.clear()
+
+
+class RemoteContentFetcher:
+    """Download story URLs and extract their text. Each URL is downloaded
+    once and the bytes are shared by tools/fetch_remote_content, w3m and
+    pdfminer. At most `concurrency` URLs are downloaded at once, at most
+    `per_domain` of them from the same host, and at most `extractors`
+    documents are processed at once.
+
+    Use as `async with RemoteContentFetcher() as fetcher:`.
+    """
+
+    def __init__(self, concurrency=16, per_domain=2, extractors=None, timeout=10):
+        self.concurrency = concurrency
+        self.per_domain = per_domain
+        self.extractors = extractors or os.cpu_count() or 2
+        self.pool = ConnectionPool(
+            timeout,
+            max_idle_per_host=per_domain,
+            max_bytes=config.REMOTE_CONTENT_MAX_BYTES,
+            pdf_max_bytes=config.PDF_MAX_BYTES,
+        )
+        self.timeout = timeout
+        self.executor = None
+        self.semaphore = None
+        self.domain_semaphores = None
+        self.extract_semaphore = None
+
+    async def __aenter__(self):
+        self.executor = ThreadPoolExecutor(self.concurrency + self.extractors)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.domain_semaphores = collections.defaultdict(
+            lambda: asyncio.Semaphore(self.per_domain)
+        )
+        self.extract_semaphore = asyncio.Semaphore(self.extractors)
+        return self
+
+    async def __aexit__(self, *_exc):
+        self.executor.shutdown(wait=True)
+        self.pool.close()
+
+    async def _run_in_executor(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, func, *args
+        )
+
+    async def download(self, url) -> Response:
+        # Wait for the domain first, so that URLs of a busy domain don't hold
+        # slots other domains could use.
+        async with self.domain_semaphores[urlsplit(url).hostname], self.semaphore:
+            return await self._run_in_executor(self.pool.get, url)
+
+    async def fetch(self, url) -> RemoteContent:
+        if url.startswith("gemini://"):
+            async with self.semaphore:
+                content = await run_extractor([url], timeout=self.timeout)
+            return RemoteContent(url=url, content=content)
+        response = await self.download(url)
+        try:
+            async with self.extract_semaphore:
+                return await self.extract(url, response)
+        finally:
+            if response.path is not None:
+                os.unlink(response.path)
+
+    async def extract(self, url, response: Response) -> RemoteContent:
+        if response.status >= 400:
+            return RemoteContent(
+                url=url, content=None, log=f"HTTP status {response.status}"
+            )
+        if response.path is not None:
+            if response.truncated:
+                return RemoteContent(
+                    url=url,
+                    content=None,
+                    log=f"PDF is larger than {config.PDF_MAX_BYTES} bytes",
+                )
+            try:
+                content = await extract_pdf(response.path)
+            except asyncio.TimeoutError:
+                return RemoteContent(
+                    url=url,
+                    content=None,
+                    log=f"PDF text extraction took longer than {config.PDF_EXTRACTION_TIMEOUT} seconds",
+                )
+            except ValueError as exc:
+                return RemoteContent(
+                    url=url,
+                    content=None,
+                    log=f"Content-Type is {response.content_type} and text extraction failed: {exc}",
+                )
+            return RemoteContent(url=url, content=content)
+        if "html" not in response.content_type:
+            return RemoteContent(
+                url=url, content=None, log=f"Content-Type is {response.content_type}"
+            )
+        content, w3m_output = await asyncio.gather(
+            run_extractor(
+                ["--stdin", response.url], response.body, timeout=self.timeout
+            ),
+            run_w3m(response.body, response.content_type, timeout=self.timeout),
+            return_exceptions=True,
+        )
+        if isinstance(content, BaseException):
+            raise content
+        if isinstance(w3m_output, BaseException):
+            return RemoteContent(url=url, content=content, log=str(w3m_output))
+        return RemoteContent(url=url, content=content, w3m_content=w3m_output)
+
+    async def fetch_all(self, urls):
+        """Yield (url, RemoteContent or exception) in order of completion.
+        Only a bounded number of URLs is in flight at any time, so `urls`
+        can be a long iterator."""
+
+        async def _fetch(url):
+            try:
+                return url, await self.fetch(url)
+            except Exception as exc:
+                return url, exc
+
+        urls = iter(urls)
+        pending = set()
+        while True:
+            for url in urls:
+                pending.add(asyncio.ensure_future(_fetch(url)))
+                if len(pending) >= 4 * self.concurrency:
+                    break
+            if not pending:
+                return
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                yield task.result()
+
+
+async def run_process(args, stdin=None, timeout=None, cwd=None) -> bytes:
+    proc = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=asyncio.subprocess.PIPE if stdin is not None else None,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=cwd,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(stdin), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise
+    if proc.returncode != 0:
+        raise ValueError(
+            f"{Path(args[0]).name} exited with {proc.returncode}: {stderr.decode('utf-8', 'replace').strip()}"
+        )
+    return stdout
+
+
+async def run_extractor(args, stdin=None, timeout=None) -> str:
+    output = await run_process([FETCH_REMOTE_CONTENT_BIN, *args], stdin, timeout)
+    return output.decode("utf-8").strip()
+
+
+async def run_w3m(body, content_type, timeout=None) -> str:
+    args = ["w3m", "-T", "text/html", "-dump", "-O", "UTF-8"]
+    _, _, charset = content_type.partition("charset=")
+    if charset:
+        args += ["-I", charset.split(";")[0].strip().strip('"')]
+    output = await run_process(args, body, timeout)
+    return output.decode("utf-8")
+
+
+async def extract_pdf(path) -> str:
+    """Extract text with sic/pdf_text.py in a separate process, so that it
+    can be killed if it takes too long."""
+    output = await run_process(
+        [
+            sys.executable,
+            "-m",
+            "sic.pdf_text",
+            path,
+            str(config.PDF_MAX_PAGES),
+            str(config.PDF_MAX_CHARS),
+        ],
+        timeout=config.PDF_EXTRACTION_TIMEOUT,
+        cwd=BASE_DIR,
+    )
+    return output.decode("utf-8")
+
+
+def fetch(url) -> RemoteContent:
+    """Synchronous fetch of a single url."""
+
+    async def _fetch():
+        async with RemoteContentFetcher(concurrency=1) as fetcher:
+            return await fetcher.fetch(url)
+
+    return asyncio.run(_fetch())
@@ -1,17 +1,60 @@
 import html
 import re
-import os
 import sqlite3
 import threading
+import typing
+from pathlib import Path
 
 from django.utils.safestring import mark_safe
-from django.db.models.signals import post_save, pre_delete
+from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.conf import settings
 from django.apps import apps
 
 config = apps.get_app_config("sic")
-from sic.models import Comment, Story
+from sic.models import Comment, Story, StoryRemoteContent
+from sic import workers
+
+# Maximum number of queued objects indexed in one FTS transaction
+INDEX_BATCH_SIZE = 500
+
+
+class IndexTables(typing.NamedTuple):
+    comments: str
+    stories: str
+    # External content table of `stories`
+    stories_content: str
+
+
+LIVE_TABLES = IndexTables(
+    config.FTS_COMMENTS_TABLE_NAME,
+    config.FTS_STORIES_TABLE_NAME,
+    f"{config.FTS_STORIES_TABLE_NAME}_content",
+)
+# The tables `manage.py build_fts5` builds the new index in, before swapping
+# them with LIVE_TABLES
+SHADOW_TABLES = IndexTables(*(f"{name}_rebuild" for name in LIVE_TABLES))
+# Progress of a rebuild: the last object id indexed in SHADOW_TABLES for each
+# SearchIndexQueueEntry.Kind, and the objects index_queued() indexed in
+# SHADOW_TABLES while the rebuild was running, which the rebuild must not
+# overwrite with the text it read earlier.
+REBUILD_PROGRESS_TABLE = "fts_rebuild_progress"
+REBUILD_TOUCHED_TABLE = "fts_rebuild_touched"
+
+
+def create_tables(connection, tables: IndexTables):
+    connection.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {tables.comments} USING fts5(id UNINDEXED, text);"
+    )
+    connection.execute(
+        f"CREATE TABLE IF NOT EXISTS {tables.stories_content} (id INTEGER PRIMARY KEY, title TEXT, description TEXT, url TEXT, remote_content TEXT);"
+    )
+    # The content option always names the live content table, so that the
+    # shadow table keeps working once it's renamed to replace the live one.
+    connection.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {tables.stories} USING fts5(id UNINDEXED, title, description, url, remote_content, content={LIVE_TABLES.stories_content}, content_rowid=id);"
+    )
 
 
 def escape_fts(query):
@@ -25,38 +68,84 @@ def escape_fts(query):
     return query
 
 
-def run_once(f):
-    def wrapper(*args, **kwargs):
-        if not hasattr(wrapper.has_run, "value") or not wrapper.has_run.value:
+class FTSConnections(threading.local):
+    """Connections to the FTS database, kept per thread because sqlite3
+    connections can't be shared between threads.
+
+    The first connection of the process creates the schema and switches the
+    database to WAL mode, so that searches don't block indexing and vice
+    versa. All connections wait up to FTS_BUSY_TIMEOUT seconds for a lock
+    instead of failing with "database is locked". Queries use fixed SQL with
+    bound parameters, so that sqlite3's per-connection statement cache
+    reuses the prepared statements.
+    """
+
+    setup_lock = threading.Lock()
+    setup_done = False
+
+    def __init__(self):
+        self.index = None
+        self.search = None
+
+    @staticmethod
+    def connect():
+        connection = sqlite3.connect(
+            (settings.BASE_DIR / config.FTS_DATABASE_FILENAME).as_uri(),
+            uri=True,
+            timeout=config.FTS_BUSY_TIMEOUT,
+            cached_statements=256,
+        )
+        connection.execute("PRAGMA synchronous = NORMAL")
+        return connection
+
+    @classmethod
+    def setup(cls):
+        with cls.setup_lock:
+            if cls.setup_done:
+                return
+            connection = cls.connect()
             try:
-                wrapper.has_run.value = f(*args, **kwargs)
-            except Exception as exc:
-                wrapper.previous_exception = exc
-                raise exc from None
-        return wrapper.has_run.value
+                connection.execute("PRAGMA journal_mode = WAL")
+                with connection:
+                    create_tables(connection, LIVE_TABLES)
+            finally:
+                connection.close()
+            cls.setup_done = True
 
-    wrapper.has_run = threading.local()
-    wrapper.has_run.__setattr__("value", False)
-    wrapper.previous_exception = None
-    return wrapper
+    def index_connection(self):
+        if self.index is None:
+            self.setup()
+            self.index = self.connect()
+        return self.index
+
+    def search_connection(self):
+        if self.search is None:
+            self.setup()
+            connection = self.connect()
+            connection.execute(
+                "ATTACH DATABASE ? AS sic",
+                (
+                    Path(settings.DATABASES["default"]["NAME"]).resolve().as_uri()
+                    + "?mode=ro",
+                ),
+            )
+            self.search = connection
+        return self.search
+
+
+fts_connections = FTSConnections()
 
 
-@run_once
 def fts5_setup():
-    dbfname = str(settings.BASE_DIR / config.FTS_DATABASE_FILENAME)
-    exists = os.path.exists(dbfname)
-    connection = sqlite3.connect(dbfname)
-    with connection:
-        connection.execute(
-            f"CREATE VIRTUAL TABLE IF NOT EXISTS {config.FTS_COMMENTS_TABLE_NAME} USING fts5(id UNINDEXED, text);"
-        )
-        connection.execute(
-            f"CREATE TABLE IF NOT EXISTS {config.FTS_STORIES_TABLE_NAME}_content (id INTEGER PRIMARY KEY, title TEXT, description TEXT, url TEXT, remote_content TEXT);"
-        )
-        connection.execute(
-            f"CREATE VIRTUAL TABLE IF NOT EXISTS {config.FTS_STORIES_TABLE_NAME} USING fts5(id UNINDEXED, title, description, url, remote_content, content={config.FTS_STORIES_TABLE_NAME}_content, content_rowid=id);"
-        )
-    return connection
+    """This thread's connection to the FTS database, for writing."""
+    return fts_connections.index_connection()
+
+
+def search_connection():
+    """This thread's connection to the FTS database with the main database
+    attached read-only as `sic`, so that matches can be filtered and ordered
+    by columns of sic_comment and sic_story in the same query."""
+    return fts_connections.search_connection()
 
 
 #        cursor.execute(
@@ -107,115 +196,374 @@ def fts5_setup():
 #        )
 
 
-def index_comment(obj: Comment):
-    connection = fts5_setup()
-    text = html.escape(obj.text_to_plain_text)
-    with connection:
-        connection.execute(
-            f"INSERT OR REPLACE INTO {config.FTS_COMMENTS_TABLE_NAME}(rowid, text) VALUES (:id, :text)",
-            {"id": obj.pk, "text": text},
-        )
+class SearchIndexQueueEntry(models.Model):
+    """A comment or story whose full-text search entry is out of date.
+
+    Entries are added in the same transaction as the change to the object,
+    and removed by index_queued() only after the FTS database has been
+    updated, so indexing can always be resumed after a crash.
+    """
+
+    class Kind(models.TextChoices):
+        COMMENT = "C", "Comment"
+        STORY = "S", "Story"
+
+    id = models.AutoField(primary_key=True)
+    kind = models.CharField(max_length=1, choices=Kind.choices, null=False)
+    object_id = models.IntegerField(null=False)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = "search index queue entries"
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.object_id}"
+
+    @staticmethod
+    def enqueue(kind, object_id):
+        SearchIndexQueueEntry.objects.create(kind=kind, object_id=object_id)
+        transaction.on_commit(Indexer.wake)
+
+
+# Runs index_queued() whenever a transaction that queued something commits
+Indexer = workers.BackgroundWorker(
+    "search_indexer_thread", lambda: index_queued(), "Could not index queued objects"
+)
 
 
-def index_story(obj: Story):
-    connection = fts5_setup()
+def index_queued(job=None, batch_size=INDEX_BATCH_SIZE):
+    """Index queued comments and stories in batches. Can also run as a
+    periodic job, to pick up entries left over by a crashed process."""
+    while True:
+        connection = fts5_setup()
+        # Take the FTS write lock before reading anything, so that concurrent
+        # indexers in other processes can't overwrite newer text with older.
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            entries = list(SearchIndexQueueEntry.objects.order_by("pk")[:batch_size])
+            comment_pks = {
+                e.object_id
+                for e in entries
+                if e.kind == SearchIndexQueueEntry.Kind.COMMENT
+            }
+            story_pks = {
+                e.object_id
+                for e in entries
+                if e.kind == SearchIndexQueueEntry.Kind.STORY
+            }
+            comments = list(Comment.objects.filter(pk__in=comment_pks, deleted=False))
+            stories = list(
+                Story.objects.filter(pk__in=story_pks).select_related("remote_content")
+            )
+            comment_rows = [comment_index_row(obj) for obj in comments]
+            story_rows = [story_index_row(obj) for obj in stories]
+            removed_comment_pks = comment_pks - {c.pk for c in comments}
+            removed_story_pks = story_pks - {s.pk for s in stories}
+            for tables in [LIVE_TABLES] + (
+                [SHADOW_TABLES] if rebuild_in_progress(connection) else []
+            ):
+                insert_comment_rows(connection, tables, comment_rows)
+                unindex_comments(connection, tables, removed_comment_pks)
+                insert_story_rows(connection, tables, story_rows)
+                unindex_stories(connection, tables, removed_story_pks)
+                if tables is SHADOW_TABLES:
+                    connection.executemany(
+                        f"INSERT OR IGNORE INTO {REBUILD_TOUCHED_TABLE}(kind, id) VALUES (?, ?)",
+                        [(e.kind, e.object_id) for e in entries],
+                    )
+            connection.commit()
+        except:
+            connection.rollback()
+            raise
+        if not entries:
+            return True
+        SearchIndexQueueEntry.objects.filter(pk__in=[e.pk for e in entries]).delete()
+
+
+def comment_index_row(obj: Comment):
+    return {"id": obj.pk, "text": html.escape(obj.text_to_plain_text)}
+
+
+def story_index_row(obj: Story):
     try:
         remote_content = obj.remote_content.content
-    except:
+    except StoryRemoteContent.DoesNotExist:
         remote_content = None
+    return {
+        "id": obj.pk,
+        "title": obj.title,
+        "description": obj.description_to_plain_text.strip(),
+        "url": obj.url,
+        "remote_content": remote_content,
+    }
+
+
+def insert_comment_rows(connection, tables: IndexTables, rows):
+    connection.executemany(
+        f"INSERT OR REPLACE INTO {tables.comments}(rowid, id, text) VALUES (:id, :id, :text)",
+        rows,
+    )
+
+
+def unindex_comments(connection, tables: IndexTables, pks):
+    connection.executemany(
+        f"DELETE FROM {tables.comments} WHERE rowid = :id",
+        [{"id": pk} for pk in pks],
+    )
+
+
+def insert_story_rows(connection, tables: IndexTables, rows):
+    # The stories table has external content: remove the old entry with the
+    # values it was indexed with before replacing them.
+    unindex_stories(connection, tables, [row["id"] for row in rows], keep_content=True)
+    connection.executemany(
+        f"INSERT OR REPLACE INTO {tables.stories_content}(id, title, description, url, remote_content) VALUES (:id, :title, :description, :url, :remote_content)",
+        rows,
+    )
+    connection.executemany(
+        f"INSERT INTO {tables.stories}(rowid, title, description, url, remote_content) VALUES (:id, :title, :description, :url, :remote_content)",
+        rows,
+    )
+
+
+def unindex_stories(connection, tables: IndexTables, pks, keep_content=False):
+    connection.executemany(
+        f"INSERT INTO {tables.stories}({tables.stories}, rowid, title, description, url, remote_content) SELECT 'delete', id, title, description, url, remote_content FROM {tables.stories_content} WHERE id = :id",
+        [{"id": pk} for pk in pks],
+    )
+    if not keep_content:
+        connection.executemany(
+            f"DELETE FROM {tables.stories_content} WHERE id = :id",
+            [{"id": pk} for pk in pks],
+        )
+
+
+def rebuild_in_progress(connection) -> bool:
+    return (
+        connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (REBUILD_PROGRESS_TABLE,),
+        ).fetchone()
+        is not None
+    )
+
+
+def start_rebuild(connection):
+    """Create empty SHADOW_TABLES, unless an interrupted rebuild left them
+    behind, and return the progress of the rebuild."""
     with connection:
         connection.execute(
-            f"INSERT OR REPLACE INTO {config.FTS_STORIES_TABLE_NAME}_content(id, title, description, remote_content) VALUES (:id, :title, :description, :remote_content)",
-            {
-                "id": obj.pk,
-                "title": obj.title,
-                "description": obj.description_to_plain_text.strip(),
-                "remote_content": remote_content,
-            },
+            f"CREATE TABLE IF NOT EXISTS {REBUILD_PROGRESS_TABLE} (kind TEXT PRIMARY KEY, last_id INTEGER NOT NULL)"
         )
         connection.execute(
-            f"INSERT OR REPLACE INTO {config.FTS_STORIES_TABLE_NAME}(rowid, title, description, url, remote_content) VALUES (:id, :title, :description, :url, :remote_content)",
-            {
-                "id": obj.pk,
-                "title": obj.title,
-                "description": obj.description_to_plain_text.strip(),
-                "url": obj.url,
-                "remote_content": remote_content,
-            },
+            f"CREATE TABLE IF NOT EXISTS {REBUILD_TOUCHED_TABLE} (kind TEXT, id INTEGER, PRIMARY KEY (kind, id))"
         )
+        create_tables(connection, SHADOW_TABLES)
+    return dict(
+        connection.execute(f"SELECT kind, last_id FROM {REBUILD_PROGRESS_TABLE}")
+    )
 
 
-def query_comments(query_string: str):
-    connection = fts5_setup()
+def cancel_rebuild(connection):
     with connection:
-        comments = (
-            Comment.objects.all()
-            .filter(
-                id__in=[
-                    r[0]
-                    for r in connection.execute(
-                        f"select id from {config.FTS_COMMENTS_TABLE_NAME}('\"{escape_fts(query_string)}\"')",
-                    )
-                ],
-                deleted=False,
-            )
-            .order_by("-created")
-        )
+        for name in [*SHADOW_TABLES, REBUILD_PROGRESS_TABLE, REBUILD_TOUCHED_TABLE]:
+            connection.execute(f"DROP TABLE IF EXISTS {name}")
 
-        snippets = {
-            i[0]: i[1]
-            for i in connection.execute(
-                f"select id, snippet({config.FTS_COMMENTS_TABLE_NAME},-1,'<mark>','</mark>','\u200a[…]\u200a',36) as snippet from {config.FTS_COMMENTS_TABLE_NAME}('\"{escape_fts(query_string)}\"')"
+
+def add_rebuild_rows(connection, kind, rows, last_id):
+    """Insert a chunk of rows of `kind` into SHADOW_TABLES and record that
+    everything up to `last_id` has been indexed."""
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        touched = {
+            pk
+            for (pk,) in connection.execute(
+                f"SELECT id FROM {REBUILD_TOUCHED_TABLE} WHERE kind = ? AND id <= ?",
+                (kind, last_id),
             )
         }
-        for obj in comments:
-            obj.snippet = mark_safe(snippets[obj.pk])
-    return comments
+        rows = [row for row in rows if row["id"] not in touched]
+        if kind == SearchIndexQueueEntry.Kind.COMMENT:
+            insert_comment_rows(connection, SHADOW_TABLES, rows)
+        else:
+            insert_story_rows(connection, SHADOW_TABLES, rows)
+        connection.execute(
+            f"INSERT OR REPLACE INTO {REBUILD_PROGRESS_TABLE}(kind, last_id) VALUES (?, ?)",
+            (kind, last_id),
+        )
+        connection.commit()
+    except:
+        connection.rollback()
+        raise
 
 
-def query_stories(query_string: str):
-    connection = fts5_setup()
-    with connection:
-        stories = (
-            Story.objects.all()
-            .filter(
-                id__in=[
-                    r[0]
-                    for r in connection.execute(
-                        f"select id from {config.FTS_STORIES_TABLE_NAME}('\"{escape_fts(query_string)}\"')",
-                    )
-                ],
-                active=True,
-            )
-            .order_by("-created")
+def finish_rebuild(connection):
+    """Replace LIVE_TABLES with SHADOW_TABLES in one transaction."""
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        for live, shadow in zip(LIVE_TABLES, SHADOW_TABLES):
+            connection.execute(f"DROP TABLE {live}")
+            connection.execute(f"ALTER TABLE {shadow} RENAME TO {live}")
+        connection.execute(f"DROP TABLE {REBUILD_PROGRESS_TABLE}")
+        connection.execute(f"DROP TABLE {REBUILD_TOUCHED_TABLE}")
+        connection.commit()
+    except:
+        connection.rollback()
+        raise
+
+
+class SearchResults(typing.NamedTuple):
+    # One page of matching objects, each with `snippet` and `rank` attributes
+    objects: list
+    # Total number of matches
+    count: int
+
+
+# bm25() weights of the columns of fts5_stories: id, title, description, url,
+# remote_content
+STORY_COLUMN_WEIGHTS = (0.0, 10.0, 5.0, 2.0, 1.0)
+
+ORDER_BY_COLUMNS = {
+    # bm25() scores are negative; lower is more relevant.
+    "relevance": ("rank", True),
+    "newest": ("created", False),
+    "karma": ("karma", False),
+}
+
+
+def _search(table, join, bm25, query_string, order_by, ascending, page_num, per_page):
+    """Run one FTS query that returns the `page_num`th page of matches along
+    with their rank, snippet and the total number of matches.
+
+    Snippets are only computed for the rows of the page: `page` ranks and
+    paginates, then `snippets` looks its rows up again by rowid. bm25() can't
+    be used in the same SELECT as other clauses that need the whole result,
+    hence `matches`. The total comes from the single row of `total`, so it is
+    returned, in a row with a NULL id, even when the page is past the end.
+    """
+    rank = bm25
+    params = {
+        "query": f'"{escape_fts(query_string)}"',
+        "limit": per_page,
+        "offset": (page_num - 1) * per_page,
+    }
+    if config.SEARCH_RECENCY_DAYS:
+        rank = f"{bm25} / (1.0 + (julianday('now') - julianday(t.created)) / :recency_days)"
+        params["recency_days"] = config.SEARCH_RECENCY_DAYS
+    column, inverted = ORDER_BY_COLUMNS.get(order_by, ORDER_BY_COLUMNS["relevance"])
+    direction = "ASC" if ascending != inverted else "DESC"
+
+    def order(prefix):
+        return f"{prefix}{column} {direction}, {prefix}id {direction}"
+
+    return (
+        search_connection()
+        .execute(
+            f"""WITH matches AS MATERIALIZED (
+    SELECT {table}.rowid AS id, {rank} AS rank, t.created AS created, t.karma AS karma
+    FROM {table} CROSS JOIN {join}
+    WHERE {table} MATCH :query
+), total AS (
+    SELECT COUNT(*) AS total FROM matches
+), page AS (
+    SELECT * FROM matches
+    ORDER BY {order("")} LIMIT :limit OFFSET :offset
+), snippets AS (
+    SELECT page.*, snippet({table},-1,'<mark>','</mark>','\u200a[…]\u200a',36) AS snippet
+    FROM page CROSS JOIN {table} ON {table}.rowid = page.id
+    WHERE {table} MATCH :query
+)
+SELECT snippets.id, snippets.rank, total.total, snippets.snippet
+FROM total LEFT JOIN snippets
+ORDER BY {order("snippets.")}""",
+            params,
         )
+        .fetchall()
+    )
+
+
+def _search_results(model, rows):
+    objects = model.objects.in_bulk([row[0] for row in rows if row[0] is not None])
+    ret = []
+    for pk, rank, _total, snippet in rows:
+        obj = objects.get(pk)
+        if obj is None:
+            continue
+        obj.rank = rank
+        obj.snippet = mark_safe(snippet)
+        ret.append(obj)
+    return SearchResults(objects=ret, count=rows[0][2] if rows else 0)
 
-        snippets = {
-            i[0]: i[1]
-            for i in connection.execute(
-                f"select id, snippet({config.FTS_STORIES_TABLE_NAME},-1,'<mark>','</mark>','\u200a[…]\u200a',36) as snippet from {config.FTS_STORIES_TABLE_NAME}('\"{escape_fts(query_string)}\"')"
-            )
-        }
-        for obj in stories:
-            obj.snippet = mark_safe(snippets[obj.pk])
-    return stories
+
+def query_comments(
+    query_string: str,
+    order_by="relevance",
+    ascending=False,
+    page_num=1,
+    per_page=None,
+) -> SearchResults:
+    rows = _search(
+        config.FTS_COMMENTS_TABLE_NAME,
+        f"sic.sic_comment AS t ON t.id = {config.FTS_COMMENTS_TABLE_NAME}.rowid AND NOT t.deleted",
+        f"bm25({config.FTS_COMMENTS_TABLE_NAME})",
+        query_string,
+        order_by,
+        ascending,
+        page_num,
+        per_page or config.SEARCH_RESULTS_PER_PAGE,
+    )
+    return _search_results(Comment, rows)
+
+
+def query_stories(
+    query_string: str,
+    order_by="relevance",
+    ascending=False,
+    page_num=1,
+    per_page=None,
+) -> SearchResults:
+    weights = ", ".join(map(str, STORY_COLUMN_WEIGHTS))
+    rows = _search(
+        config.FTS_STORIES_TABLE_NAME,
+        f"sic.sic_story AS t ON t.id = {config.FTS_STORIES_TABLE_NAME}.rowid AND t.active",
+        f"bm25({config.FTS_STORIES_TABLE_NAME}, {weights})",
+        query_string,
+        order_by,
+        ascending,
+        page_num,
+        per_page or config.SEARCH_RESULTS_PER_PAGE,
+    )
+    return _search_results(Story, rows)
 
 
 @receiver(post_save, sender=Comment)
 def comment_save_receiver(
     sender, instance, created, raw, using, update_fields, **kwargs
 ):
-    if instance.deleted:
-        comment_delete_receiver(sender, instance, using, **kwargs)
-    else:
-        index_comment(instance)
+    if update_fields is not None and not {"text", "deleted"} & set(update_fields):
+        return
+    SearchIndexQueueEntry.enqueue(SearchIndexQueueEntry.Kind.COMMENT, instance.pk)
 
 
-@receiver(pre_delete, sender=Comment)
+@receiver(post_delete, sender=Comment)
 def comment_delete_receiver(sender, instance, using, **kwargs):
-    connection = fts5_setup()
-    with connection:
-        connection.execute(
-            f"DELETE FROM {config.FTS_COMMENTS_TABLE_NAME} WHERE id=:id",
-            {"id": instance.pk},
-        )
+    SearchIndexQueueEntry.enqueue(SearchIndexQueueEntry.Kind.COMMENT, instance.pk)
+
+
+@receiver(post_save, sender=Story)
+def story_save_receiver(sender, instance, created, raw, using, update_fields, **kwargs):
+    if update_fields is not None and not {"title", "description", "url"} & set(
+        update_fields
+    ):
+        return
+    SearchIndexQueueEntry.enqueue(SearchIndexQueueEntry.Kind.STORY, instance.pk)
+
+
+@receiver(post_delete, sender=Story)
+def story_delete_receiver(sender, instance, using, **kwargs):
+    SearchIndexQueueEntry.enqueue(SearchIndexQueueEntry.Kind.STORY, instance.pk)
+
+
+@receiver(post_save, sender=StoryRemoteContent)
+def remote_content_save_receiver(sender, instance, **kwargs):
+    SearchIndexQueueEntry.enqueue(SearchIndexQueueEntry.Kind.STORY, instance.story_id)
@@ -7,8 +7,8 @@ from django.utils.safestring import mark_safe
 from django.template.defaulttags import URLNode, url
 from django.template.exceptions import TemplateSyntaxError
 from django.template.base import Token, Node, kwarg_re
-from django.template import Context, Template
-from django.template.loader import render_to_string
+from django.template import Context, RequestContext, Template
+from django.template.loader import get_template
 from sic.models import Comment
 
 register = template.Library()
@@ -39,7 +39,6 @@ def render_comments(
     edit_comment_pk=None,
     edit_comment_form=None,
 ):
-
     if isinstance(comments, Comment):
         comments = {comments.id: CommentNode(comments)}
     else:
@@ -63,23 +62,30 @@ def render_comments(
             for c in comments[root].children:
                 q.append((level + 1, c))
 
-    while len(order_q) != 0:
-        (lvl, leaf) = order_q.pop()
-        children = comments[leaf].children
-        replies = [rendered[c] for c in children]
-        rendered[leaf] = render_to_string(
-            "posts/comment.html",
-            context={
-                "comment": comments[leaf].obj,
-                "replies": replies,
-                "reply_form": reply_form,
-                "level": lvl,
-                "show_story": show_story,
-                "edit_comment_pk": edit_comment_pk,
-                "edit_comment_form": edit_comment_form,
-            },
-            request=request,
-        )
+    Comment.preload_thread_context(
+        (node.obj for node in comments.values()), request.user
+    )
+    # Render every node with the same compiled template and context, so that
+    # context processors run once per tree instead of once per comment.
+    template = get_template("posts/comment.html").template
+    render_context = RequestContext(
+        request,
+        {
+            "reply_form": reply_form,
+            "show_story": show_story,
+            "edit_comment_pk": edit_comment_pk,
+            "edit_comment_form": edit_comment_form,
+        },
+    )
+    with render_context.bind_template(template):
+        while len(order_q) != 0:
+            (lvl, leaf) = order_q.pop()
+            children = comments[leaf].children
+            replies = [rendered[c] for c in children]
+            with render_context.push(
+                comment=comments[leaf].obj, replies=replies, level=lvl
+            ):
+                rendered[leaf] = template.render(render_context)
 
     if only_roots:
         ret = "".join(rendered[c] for c in comments if comments[c].parent is None)
@@ -7,9 +7,9 @@ from django.template.defaulttags import URLNode, url
 from django.template.exceptions import TemplateSyntaxError
 from django.template.base import Token, Node, kwarg_re
 from django.core.cache import cache
-import subprocess, os
 
 from sic.flatpages import DocumentationFlatPage, ExternalLinkFlatPage, CommunityFlatPage
+from sic.build_info import build_info
 from django.apps import apps
 
 config = apps.get_app_config("sic")
@@ -68,6 +68,9 @@ def url_with_next(parser, token):
 def story_is_bookmarked(user, story):
     if not user.is_authenticated:
         return False
+    listing_context = getattr(story, "listing_context", None)
+    if listing_context and listing_context["user_pk"] == user.pk:
+        return listing_context["bookmarked"]
     return user.saved_stories.filter(pk=story.pk).exists()
 
 
@@ -80,27 +83,16 @@ def comment_is_bookmarked(user, comment):
 
 @register.simple_tag
 def build_sha():
-    try:
-        git_dir = settings.BASE_DIR
-        head = subprocess.Popen(
-            'git -C {dir} log -1 --pretty=format:"%h\n%s\n%cd" --date=short'.format(
-                dir=git_dir
-            ),
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-        )
-        git_string = head.stdout.read().strip().decode("utf-8")
-        [commit_sha, subject, date] = git_string.split("\n")
-        return format_html(
-            '<span class="build"><a href="https://github.com/epilys/sic/commit/{}"><code>[{}]</code> {}</a> {}</span>',
-            commit_sha,
-            commit_sha,
-            subject,
-            date,
-        )
-    except:
+    info = build_info()
+    if info is None:
         return None
+    return format_html(
+        '<span class="build"><a href="https://github.com/epilys/sic/commit/{}"><code>[{}]</code> {}</a> {}</span>',
+        info.commit,
+        info.commit,
+        info.subject,
+        info.date,
+    )
 
 
 @register.simple_tag
@@ -135,6 +127,9 @@ def comment_is_upvoted(context):
     user = context["request"].user
     if not user.is_authenticated:
         return False
+    thread_context = getattr(context["comment"], "thread_context", None)
+    if thread_context and thread_context["user_pk"] == user.pk:
+        return thread_context["upvoted"]
     return user.votes.filter(comment=context["comment"].pk).exists()
 
 
@@ -143,6 +138,9 @@ def story_is_upvoted(context):
     user = context["request"].user
     if not user.is_authenticated:
         return False
+    listing_context = getattr(context["story"], "listing_context", None)
+    if listing_context and listing_context["user_pk"] == user.pk:
+        return listing_context["upvoted"]
     return user.votes.filter(story=context["story"].pk, comment=None).exists()
 
 
@@ -375,6 +375,7 @@ urlpatterns = [
     ),
     path("accounts/profile/edit/", account.edit_profile, name="edit_profile"),
     path("accounts/profile/avatar/", account.edit_avatar, name="edit_avatar"),
+    path("avatars/<str:digest>/", account.avatar, name="avatar"),
     path("accounts/settings/", account.edit_settings, name="edit_settings"),
     path("accounts/filters/", account.edit_filters, name="edit_filters"),
     path("accounts/filters/add/tag/", account.add_tag_filter, name="add_tag_filter"),
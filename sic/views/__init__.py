@@ -31,12 +31,14 @@ from sic.forms import (
 )
 from sic.views.utils import (
     form_errors_as_string,
+    KeysetPaginator,
     Paginator,
     InvalidPage,
     check_next_url,
 )
 from sic.markdown import comment_to_html
 from sic.search import query_comments, query_stories
+from sic.frontpage import frontpage_story_pks
 from sic import mail
 
 
@@ -106,7 +108,7 @@ def reply(request, comment_pk):
 
 
 def agg_index(request, taggregation_pk, slug, page_num=1):
-    if page_num == 1 and request.get_full_path() != reverse(
+    if page_num == 1 and request.path != reverse(
         "agg_index", kwargs={"taggregation_pk": taggregation_pk, "slug": slug}
     ):
         return redirect(
@@ -139,40 +141,21 @@ def agg_index(request, taggregation_pk, slug, page_num=1):
                 }
             )
         )
-    stories = agg.get_stories()
-    # https://docs.python.org/3/howto/sorting.html#sort-stability-and-complex-sorts
-    all_stories = sorted(
-        stories,
-        key=lambda s: s.title,
-        reverse=True,
-    )
-    all_stories = sorted(
-        all_stories,
-        key=lambda s: s.created,
-    )
-    all_stories = sorted(
+    all_stories = Story.order_by_hotness(agg.get_stories())
+    paginator = KeysetPaginator(
         all_stories,
-        key=lambda s: s.hotness,
-        reverse=True,
+        config.STORIES_PER_PAGE,
+        first_page_url=reverse(
+            "agg_index", kwargs={"taggregation_pk": taggregation_pk, "slug": slug}
+        ),
+        url_fn=lambda n: reverse(
+            "agg_index_page",
+            kwargs={"taggregation_pk": taggregation_pk, "slug": slug, "page_num": n},
+        ),
+        max_offset_pages=config.MAX_OFFSET_PAGES,
     )
-    now = make_aware(datetime.now())
-    unix_epoch = make_aware(datetime.fromtimestamp(0))
-    pinned = list(
-        filter(
-            lambda s: s.pinned and (s.pinned >= now or s.pinned == unix_epoch),
-            all_stories,
-        )
-    )
-    if pinned:
-        for p in pinned:
-            all_stories.remove(p)
-        pinned.reverse()
-        for p in pinned:
-            p.pinned_status = True
-            all_stories.insert(0, p)
-    paginator = Paginator(all_stories, config.STORIES_PER_PAGE)
     try:
-        page = paginator.page(page_num)
+        page = paginator.page_from_request(request, page_num)
     except InvalidPage:
         # page_num is bigger than the actual number of pages
         return redirect(
@@ -185,6 +168,7 @@ def agg_index(request, taggregation_pk, slug, page_num=1):
                 },
             )
         )
+    Story.preload_listing_context(page, request.user)
     return render(
         request,
         "index.html",
@@ -192,63 +176,52 @@ def agg_index(request, taggregation_pk, slug, page_num=1):
             "stories": page,
             "has_subscriptions": True,
             "aggregation": agg,
-            "pages": paginator.get_elided_page_range(number=page_num),
+            "pages": paginator.get_elided_page_links(page),
         },
     )
 
 
 def index(request, page_num=1):
-    if page_num == 1 and request.get_full_path() != reverse("index"):
+    if page_num == 1 and request.path != reverse("index"):
         # Redirect to '/' to avoid having both '/' and '/page/1' as valid urls.
         return redirect(reverse("index"))
-    stories = None
-    has_subscriptions = False
     # Figure out what to show in the index
     # If user is authenticated AND has subscribed aggregations, show the set union of them
     # otherwise show every story.
+    cached = frontpage_story_pks(
+        request.user, config.STORIES_PER_PAGE * config.MAX_OFFSET_PAGES + 1
+    )
+    has_subscriptions = cached["has_subscriptions"]
     if request.user.is_authenticated:
-        frontpage = request.user.frontpage()
-        has_subscriptions = frontpage["taggregations"] is not None
+        taggregations = (
+            request.user.taggregation_subscriptions.all() if has_subscriptions else None
+        )
     else:
-        frontpage = Taggregation.default_frontpage()
-    stories = frontpage["stories"]
-    taggregations = frontpage["taggregations"]
-    # https://docs.python.org/3/howto/sorting.html#sort-stability-and-complex-sorts
-    all_stories = sorted(
-        stories,
-        key=lambda s: s.title,
-        reverse=True,
-    )
-    all_stories = sorted(
-        all_stories,
-        key=lambda s: s.created,
-    )
-    all_stories = sorted(
-        all_stories,
-        key=lambda s: s.hotness,
-        reverse=True,
-    )
-    now = make_aware(datetime.now())
-    unix_epoch = make_aware(datetime.fromtimestamp(0))
-    pinned = list(
-        filter(
-            lambda s: s.pinned and (s.pinned >= now or s.pinned == unix_epoch),
-            all_stories,
+        taggregations = Taggregation.objects.filter(default=True)
+    if "after" in request.GET or "before" in request.GET:
+        if request.user.is_authenticated:
+            stories = request.user.frontpage()["stories"]
+        else:
+            stories = Taggregation.default_frontpage()["stories"]
+    else:
+        # Numbered pages are fetched by primary key from the cached front page
+        stories = Story.objects.filter(active=True).prefetch_related(
+            "tags", "user", "comments"
         )
+    paginator = KeysetPaginator(
+        Story.order_by_hotness(stories),
+        config.STORIES_PER_PAGE,
+        first_page_url=reverse("index"),
+        url_fn=lambda n: reverse("index_page", kwargs={"page_num": n}),
+        max_offset_pages=config.MAX_OFFSET_PAGES,
+        head_pks=cached["pks"],
     )
-    if pinned:
-        for p in pinned:
-            all_stories.remove(p)
-        pinned.reverse()
-        for p in pinned:
-            p.pinned_status = True
-            all_stories.insert(0, p)
-    paginator = Paginator(all_stories, config.STORIES_PER_PAGE)
     try:
-        page = paginator.page(page_num)
+        page = paginator.page_from_request(request, page_num)
     except InvalidPage:
         # page_num is bigger than the actual number of pages
         return redirect(reverse("index_page", kwargs={"page_num": paginator.num_pages}))
+    Story.preload_listing_context(page, request.user)
     return render(
         request,
         "index.html",
@@ -256,7 +229,7 @@ def index(request, page_num=1):
             "stories": page,
             "has_subscriptions": has_subscriptions,
             "aggregations": taggregations,
-            "pages": paginator.get_elided_page_range(number=page_num),
+            "pages": paginator.get_elided_page_links(page),
         },
     )
 
@@ -416,17 +389,23 @@ def upvote_comment(request, story_pk, slug, comment_pk):
 
 
 def recent_comments(request, page_num=1):
-    if page_num == 1 and request.get_full_path() != reverse("recent_comments"):
+    if page_num == 1 and request.path != reverse("recent_comments"):
         # Redirect to '/' to avoid having both '/' and '/page/1' as valid urls.
         return redirect(reverse("recent_comments"))
     comments = (
         Comment.objects.filter(deleted=False)
         .prefetch_related("user")
-        .order_by("-created")
+        .order_by("-created", "-id")
+    )
+    paginator = KeysetPaginator(
+        comments,
+        config.STORIES_PER_PAGE,
+        first_page_url=reverse("recent_comments"),
+        url_fn=lambda n: reverse("recent_comments_page", kwargs={"page_num": n}),
+        max_offset_pages=config.MAX_OFFSET_PAGES,
     )
-    paginator = Paginator(comments[:40], config.STORIES_PER_PAGE)
     try:
-        page = paginator.page(page_num)
+        page = paginator.page_from_request(request, page_num)
     except InvalidPage:
         # page_num is bigger than the actual number of pages
         return redirect(
@@ -437,7 +416,7 @@ def recent_comments(request, page_num=1):
         "posts/recent_comments.html",
         {
             "comments": page,
-            "pages": paginator.get_elided_page_range(number=page_num),
+            "pages": paginator.get_elided_page_links(page),
         },
     )
 
@@ -478,23 +457,62 @@ def search(request):
     count = None
     comments = None
     stories = None
+    page = None
+    pages = None
+    try:
+        page_num = max(int(request.GET.get("page", 1)), 1)
+    except ValueError:
+        page_num = 1
     if "text" in request.GET:
         form = SearchCommentsForm(request.GET)
         if form.is_valid():
+            query = (
+                form.cleaned_data["text"],
+                form.cleaned_data["order_by"],
+                form.cleaned_data["ordering"],
+                page_num,
+            )
+            count = 0
+            # "both" shows the page_num-th page of each kind of result
+            most = 0
             if form.cleaned_data["search_in"] in ["comments", "both"]:
-                comments = query_comments(form.cleaned_data["text"])
-                count = len(comments)
+                comments = query_comments(*query)
+                count += comments.count
+                most = max(most, comments.count)
             if form.cleaned_data["search_in"] in ["stories", "both"]:
-                stories = query_stories(form.cleaned_data["text"])
-                if count is None:
-                    count = 0
-                count += len(stories)
+                stories = query_stories(*query)
+                count += stories.count
+                most = max(most, stories.count)
+
+            def page_url(n):
+                return request.path + "?" + urlencode({**request.GET.dict(), "page": n})
+
+            paginator = Paginator(range(most), config.SEARCH_RESULTS_PER_PAGE)
+            page = paginator.get_page(page_num)
+            if page.number != page_num:
+                # page_num is bigger than the actual number of pages
+                return redirect(page_url(page.number))
+            page.previous_page_url = page_url(page_num - 1)
+            page.next_page_url = page_url(page_num + 1)
+            pages = [
+                (n, page_url(n) if n is not None else None)
+                for n in paginator.get_elided_page_range(page.number)
+            ]
     else:
         form = SearchCommentsForm()
+    if stories is not None:
+        Story.preload_listing_context(stories.objects, request.user)
     return render(
         request,
         "posts/search.html",
-        {"form": form, "comments": comments, "stories": stories, "count": count},
+        {
+            "form": form,
+            "comments": comments,
+            "stories": stories,
+            "count": count,
+            "page": page,
+            "pages": pages,
+        },
     )
 
 
@@ -507,7 +525,7 @@ def domain(request, slug, page_num=1):
         request.session["domain_order_by"] = request.GET["order_by"]
     if "ordering" in request.GET:
         request.session["domain_ordering"] = request.GET["ordering"]
-    if page_num == 1 and request.get_full_path() != reverse("domain", args=[slug]):
+    if page_num == 1 and request.path != reverse("domain", args=[slug]):
         return redirect(reverse("domain", args=[slug]))
     order_by = request.session.get("domain_order_by", "created")
     if order_by not in domain.ORDER_BY_FIELDS:
@@ -517,22 +535,29 @@ def domain(request, slug, page_num=1):
     stories = (
         Story.objects.filter(active=True, domain=domain_obj)
         .prefetch_related("tags", "user", "comments")
-        .order_by(order_by_field)
+        .order_by(order_by_field, "-id" if ordering == "desc" else "id")
+    )
+    paginator = KeysetPaginator(
+        stories,
+        config.STORIES_PER_PAGE,
+        first_page_url=reverse("domain", args=[slug]),
+        url_fn=lambda n: reverse("domain_page", kwargs={"slug": slug, "page_num": n}),
+        max_offset_pages=config.MAX_OFFSET_PAGES,
     )
-    paginator = Paginator(stories, config.STORIES_PER_PAGE)
     try:
-        page = paginator.page(page_num)
+        page = paginator.page_from_request(request, page_num)
     except InvalidPage:
         # page_num is bigger than the actual number of pages
         return redirect(
             reverse(
                 "domain_page",
-                args=[slug],
                 kwargs={
+                    "slug": slug,
                     "page_num": paginator.num_pages,
                 },
             )
         )
+    Story.preload_listing_context(page, request.user)
 
     order_by_form = OrderByForm(
         fields=domain.ORDER_BY_FIELDS,
@@ -545,7 +570,7 @@ def domain(request, slug, page_num=1):
             "stories": page,
             "order_by_form": order_by_form,
             "domain": domain_obj,
-            "pages": paginator.get_elided_page_range(number=page_num),
+            "pages": paginator.get_elided_page_links(page),
         },
     )
 
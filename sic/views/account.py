@@ -16,7 +16,8 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.sites.models import Site
 from django.utils.timezone import make_aware
 from django.utils.safestring import mark_safe
-from django.views.decorators.http import require_http_methods, require_safe
+from django.views.decorators.http import require_http_methods, require_safe, etag
+from django.views.decorators.cache import cache_control
 from django.core.mail import EmailMessage
 from django.apps import apps
 
@@ -25,6 +26,7 @@ from wand.image import Image
 from sic.auth import AuthToken, SSHAuthenticationForm
 from sic.models import (
     User,
+    Avatar,
     Invitation,
     Story,
     StoryBookmark,
@@ -58,13 +60,15 @@ from sic.views.utils import (
     form_errors_as_string,
     HttpResponseNotImplemented,
     Paginator,
+    KeysetPaginator,
     InvalidPage,
     check_next_url,
 )
 
 
-# Convert image to data:image/... in order to save avatars as strings in database
-def generate_image_thumbnail(blob):
+# Convert image to a WebP thumbnail stored as an Avatar, which is served by
+# its own URL instead of being inlined as a data: URL in every page.
+def generate_image_thumbnail(blob) -> Avatar:
     with Image(blob=blob) as i:
         with i.convert("webp") as page:
             page.alpha_channel = False
@@ -73,7 +77,7 @@ def generate_image_thumbnail(blob):
             ratio = 100.0 / (width * 1.0)
             new_height = int(ratio * height)
             page.thumbnail(width=100, height=new_height)
-            return page.data_url()
+            return Avatar.store(page.make_blob(), "image/webp")
 
 
 def login(request):
@@ -205,9 +209,11 @@ def edit_profile(request):
 @transaction.atomic
 def edit_avatar(request):
     if request.method == "POST":
+        old_avatar = request.user.avatar_id
         if "delete-image" in request.POST:
             request.user.avatar = None
             request.user.save()
+            Avatar.delete_unused(old_avatar)
             messages.add_message(request, messages.SUCCESS, "Avatar deleted.")
             return redirect(reverse("account"))
         form = EditAvatarForm(request.POST, request.FILES)
@@ -215,10 +221,11 @@ def edit_avatar(request):
             img = form.cleaned_data["new_avatar"]
             avatar_title = form.cleaned_data["avatar_title"]
             if img:
-                data_url = generate_image_thumbnail(img)
-                request.user.avatar = data_url
+                request.user.avatar = generate_image_thumbnail(img)
             request.user.avatar_title = avatar_title if len(avatar_title) > 0 else None
             request.user.save()
+            if request.user.avatar_id != old_avatar:
+                Avatar.delete_unused(old_avatar)
             messages.add_message(request, messages.SUCCESS, "Avatar updated.")
             return redirect(reverse("account"))
         error = form_errors_as_string(form.errors)
@@ -230,6 +237,17 @@ def edit_avatar(request):
     )
 
 
+@require_safe
+@etag(lambda request, digest: f'"{digest}"')
+@cache_control(public=True, max_age=config.AVATAR_MAX_AGE, immutable=True)
+def avatar(request, digest):
+    try:
+        avatar_obj = Avatar.objects.get(digest=digest)
+    except Avatar.DoesNotExist:
+        raise Http404("Avatar does not exist") from Avatar.DoesNotExist
+    return HttpResponse(bytes(avatar_obj.data), content_type=avatar_obj.content_type)
+
+
 def profile(request, name):
     try:
         user = User.get_by_display_name(name)
@@ -442,44 +460,47 @@ def generate_invite(request, invite_pk=None):
 
 
 def profile_posts(request, name, page_num=1):
-    print("profile_posts", name, page_num)
-    if page_num == 1 and request.get_full_path() != reverse(
-        "profile_posts", args=[name]
-    ):
+    if page_num == 1 and request.path != reverse("profile_posts", args=[name]):
         return redirect(reverse("profile_posts", args=[name]))
     try:
         user = User.get_by_display_name(name)
     except User.DoesNotExist:
         raise Http404("User does not exist") from User.DoesNotExist
-    story_obj = list(
+    posts = [
         user.stories.filter(active=True)
         .annotate(is_story=Value("True", output_field=BooleanField()))
-        .order_by("-created", "title")
-    ) + list(
+        .order_by("-created", "-id"),
         user.comments.filter(deleted=False)
         .annotate(is_story=Value("False", output_field=BooleanField()))
-        .order_by("-created")
+        .order_by("-created", "-id"),
+    ]
+    paginator = KeysetPaginator(
+        posts,
+        config.STORIES_PER_PAGE,
+        first_page_url=reverse("profile_posts", args=[name]),
+        url_fn=lambda n: reverse(
+            "profile_posts_page", kwargs={"name": name, "page_num": n}
+        ),
+        max_offset_pages=config.MAX_OFFSET_PAGES,
     )
-    story_obj = sorted(story_obj, key=lambda x: x.created, reverse=True)
-    paginator = Paginator(story_obj, config.STORIES_PER_PAGE)
     try:
-        page = paginator.page(page_num)
+        page = paginator.page_from_request(request, page_num)
     except InvalidPage:
-        # page_num BooleanFieldis bigger than the actual number of pages
+        # page_num is bigger than the actual number of pages
         return redirect(
             reverse(
                 "profile_posts_page",
-                args=[name],
-                kwargs={"page_num": paginator.num_pages},
+                kwargs={"name": name, "page_num": paginator.num_pages},
             )
         )
+    Story.preload_listing_context(page, request.user)
     return render(
         request,
         "account/profile_posts.html",
         {
             "posts": page,
             "user": user,
-            "pages": paginator.get_elided_page_range(number=page_num),
+            "pages": paginator.get_elided_page_links(page),
         },
     )
 
@@ -695,6 +716,7 @@ def bookmarks(request, page_num=1):
                 kwargs={"page_num": paginator.num_pages},
             )
         )
+    Story.preload_listing_context([b.story for b in page if b.is_story], request.user)
     return render(
         request,
         "account/bookmarks.html",
@@ -1062,9 +1084,9 @@ def welcome(request):
         ):
             img = avatar_form.cleaned_data["new_avatar"]
             avatar_title = avatar_form.cleaned_data["avatar_title"]
+            old_avatar = user.avatar_id
             if img:
-                data_url = generate_image_thumbnail(img)
-                user.avatar = data_url
+                user.avatar = generate_image_thumbnail(img)
             user.avatar_title = avatar_title if len(avatar_title) > 0 else None
             user.homepage = edit_profile_form.cleaned_data["homepage"]
             user.git_repository = edit_profile_form.cleaned_data["git_repository"]
@@ -1075,6 +1097,8 @@ def welcome(request):
                 user._wrapped.__dict__[field] = edit_profile_form.cleaned_data[field]
                 user._wrapped.__dict__[label] = edit_profile_form.cleaned_data[label]
             user.save()
+            if user.avatar_id != old_avatar:
+                Avatar.delete_unused(old_avatar)
             digest, _ = Digest.objects.get_or_create(user=user)
             digest.on_days = digest_form.calculate_on_days()
             digest.active = digest_form.cleaned_data["active"]
@@ -109,6 +109,7 @@ def overview(request):
                     return redirect(reverse("moderation"))
                 user.banned_by_user = request.user if ban else None
                 user.save()
+                user.invalidate_permissions()
                 log_entry = ModerationLogEntry.changed_user_status(
                     user,
                     request.user,
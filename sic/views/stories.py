@@ -3,6 +3,8 @@ from datetime import datetime
 import hashlib
 import urllib.request
 from django.db import transaction
+from django.db.models import Max, Q
+from django.db.models.functions import Coalesce
 from django.shortcuts import render, redirect
 from django.urls import reverse
 from django.contrib import messages
@@ -24,7 +26,7 @@ from sic.forms import (
 from sic.markdown import comment_to_html
 from sic.views.utils import (
     form_errors_as_string,
-    Paginator,
+    KeysetPaginator,
     InvalidPage,
     check_safe_url,
     check_next_url,
@@ -150,50 +152,43 @@ def all_stories_tmpl(request, view_name, json_response, page_num=1):
     if "ordering" in request.GET:
         request.session["all_stories_ordering"] = request.GET["ordering"]
 
-    if page_num == 1 and request.get_full_path() != reverse(view_name):
+    if page_num == 1 and request.path != reverse(view_name):
         return redirect(reverse(view_name))
 
     order_by = request.session.get("all_stories_order_by", "hotness")
     ordering = request.session.get("all_stories_ordering", "desc")
-    order_by_field = ("-" if ordering == "desc" else "") + order_by
+    direction = "-" if ordering == "desc" else ""
 
     story_obj = Story.objects.filter(active=True).prefetch_related(
         "tags", "user", "comments"
     )
     if order_by == "hotness":
-        stories = sorted(
-            story_obj.order_by("created", "title"),
-            key=lambda s: s.hotness,
-            reverse=ordering == "desc",
-        )
+        stories = Story.order_by_hotness(story_obj, reverse=ordering == "desc")
     elif order_by == "last commented":
-        stories = sorted(
-            story_obj.order_by("created", "title"),
-            key=lambda s: s.active_comments.latest("created").created
-            if s.active_comments.exists()
-            else s.created,
-            reverse=ordering == "desc",
+        stories = (
+            Story.annotate_pinned(story_obj)
+            .annotate(
+                last_commented=Coalesce(
+                    Max("comments__created", filter=Q(comments__deleted=False)),
+                    "created",
+                )
+            )
+            .order_by("-pinned_status", direction + "last_commented", direction + "id")
         )
     else:
-        stories = list(story_obj.order_by(order_by_field, "title"))
-    now = make_aware(datetime.now())
-    unix_epoch = make_aware(datetime.fromtimestamp(0))
-    pinned = list(
-        filter(
-            lambda s: s.pinned and (s.pinned >= now or s.pinned == unix_epoch), stories
+        stories = Story.annotate_pinned(story_obj).order_by(
+            "-pinned_status", direction + order_by, direction + "id"
         )
+
+    paginator = KeysetPaginator(
+        stories,
+        config.STORIES_PER_PAGE,
+        first_page_url=reverse(view_name),
+        url_fn=lambda n: reverse(f"{view_name}_page", kwargs={"page_num": n}),
+        max_offset_pages=config.MAX_OFFSET_PAGES,
     )
-    if pinned:
-        for p in pinned:
-            stories.remove(p)
-        pinned.reverse()
-        for p in pinned:
-            p.pinned_status = True
-            stories.insert(0, p)
-
-    paginator = Paginator(stories, config.STORIES_PER_PAGE)
     try:
-        page = paginator.page(page_num)
+        page = paginator.page_from_request(request, page_num)
     except InvalidPage:
         # page_num is bigger than the actual number of pages
         return redirect(
@@ -207,21 +202,20 @@ def all_stories_tmpl(request, view_name, json_response, page_num=1):
         return JsonResponse(
             {
                 "stories": [s.to_json_dict() for s in page],
-                "page_num": page_num,
+                "page_num": page.number,
                 "pages": paginator.num_pages,
-                "next_page": None
-                if page_num == paginator.num_pages
-                else reverse(f"{view_name}_page", kwargs={"page_num": page_num + 1}),
+                "next_page": page.next_page_url,
             }
         )
 
+    Story.preload_listing_context(page, request.user)
     return render(
         request,
         "posts/all_stories.html",
         {
             "stories": page,
             "order_by_form": order_by_form,
-            "pages": paginator.get_elided_page_range(number=page_num),
+            "pages": paginator.get_elided_page_links(page),
         },
     )
 
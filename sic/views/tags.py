@@ -2,7 +2,8 @@ from datetime import datetime
 import random
 import re
 from django.db import transaction, connection, IntegrityError
-from django.db.models.functions import Lower
+from django.db.models import Count, DateTimeField, Max, Q, Value
+from django.db.models.functions import Coalesce, Lower
 from django.http import HttpResponse, Http404
 from django.core.exceptions import PermissionDenied
 from django.views.decorators.http import require_http_methods
@@ -19,7 +20,7 @@ from django.apps import apps
 
 config = apps.get_app_config("sic")
 
-from sic.models import Tag, Taggregation, TaggregationHasTag
+from sic.models import Story, Tag, Taggregation, TaggregationHasTag
 from sic.forms import (
     NewTagForm,
     EditTagForm,
@@ -31,6 +32,7 @@ from sic.forms import (
 from sic.views.utils import (
     form_errors_as_string,
     Paginator,
+    KeysetPaginator,
     InvalidPage,
     check_next_url,
 )
@@ -776,7 +778,7 @@ def view_tag(request, tag_pk, slug=None, page_num=1):
         request.session["tag_order_by"] = request.GET["order_by"]
     if "ordering" in request.GET:
         request.session["tag_ordering"] = request.GET["ordering"]
-    if page_num == 1 and request.get_full_path() != reverse(
+    if page_num == 1 and request.path != reverse(
         "view_tag", kwargs={"tag_pk": tag_pk, "slug": slug}
     ):
         return redirect(reverse("view_tag", kwargs={"tag_pk": tag_pk, "slug": slug}))
@@ -789,37 +791,35 @@ def view_tag(request, tag_pk, slug=None, page_num=1):
         )
     order_by = request.session.get("tag_order_by", "created")
     ordering = request.session.get("tag_ordering", "desc")
-
-    if order_by == "created":
-        stories = list(obj.get_stories())
-        stories = sorted(
-            stories,
-            key=lambda s: s.created,
-            reverse=ordering == "desc",
-        )
-    elif order_by == "active":
-        stories = list(obj.get_stories())
-        stories = sorted(
-            stories,
-            key=lambda s: s.active_comments.latest("created").created
-            if s.active_comments.exists()
-            else make_aware(datetime.fromtimestamp(0)),
-            reverse=ordering == "desc",
-        )
-
+    direction = "-" if ordering == "desc" else ""
+
+    stories = obj.get_stories()
+    if order_by == "active":
+        stories = stories.annotate(
+            last_commented=Coalesce(
+                Max("comments__created", filter=Q(comments__deleted=False)),
+                Value(make_aware(datetime.fromtimestamp(0))),
+                output_field=DateTimeField(),
+            )
+        ).order_by(direction + "last_commented", direction + "id")
     elif order_by == "number of comments":
-        stories = list(obj.get_stories())
-        stories = sorted(
-            stories,
-            key=lambda s: s.active_comments.count(),
-            reverse=ordering == "desc",
-        )
+        stories = stories.annotate(
+            active_comment_count=Count("comments", filter=Q(comments__deleted=False))
+        ).order_by(direction + "active_comment_count", direction + "id")
     else:
-        stories = list(obj.get_stories())
-
-    paginator = Paginator(stories, config.STORIES_PER_PAGE)
+        stories = stories.order_by(direction + "created", direction + "id")
+
+    paginator = KeysetPaginator(
+        stories,
+        config.STORIES_PER_PAGE,
+        first_page_url=reverse("view_tag", kwargs={"tag_pk": tag_pk, "slug": slug}),
+        url_fn=lambda n: reverse(
+            "view_tag_page", kwargs={"tag_pk": tag_pk, "slug": slug, "page_num": n}
+        ),
+        max_offset_pages=config.MAX_OFFSET_PAGES,
+    )
     try:
-        page = paginator.page(page_num)
+        page = paginator.page_from_request(request, page_num)
     except InvalidPage:
         # page_num is bigger than the actual number of pages
         return redirect(
@@ -832,6 +832,7 @@ def view_tag(request, tag_pk, slug=None, page_num=1):
                 },
             )
         )
+    Story.preload_listing_context(page, request.user)
     order_by_form = OrderByForm(
         fields=view_tag.ORDER_BY_FIELDS,
         initial={"order_by": order_by, "ordering": ordering},
@@ -843,7 +844,7 @@ def view_tag(request, tag_pk, slug=None, page_num=1):
             "stories": page,
             "order_by_form": order_by_form,
             "tag": obj,
-            "pages": paginator.get_elided_page_range(number=page_num),
+            "pages": paginator.get_elided_page_links(page),
         },
     )
 
@@ -1,12 +1,23 @@
 import ipaddress
 import socket
 import re
+import json
+import datetime
 import urllib.parse
 from http import HTTPStatus
 from django.http import (
     HttpResponse,
 )
-from django.core.paginator import Paginator as PaginatorDjango, InvalidPage
+from django.core import signing
+from django.core.paginator import (
+    Paginator as PaginatorDjango,
+    Page,
+    InvalidPage,
+    EmptyPage,
+)
+from django.db.models.query import QuerySet
+from django.db.models import Q
+from django.utils.functional import cached_property
 
 
 def form_errors_as_string(errors):
@@ -50,6 +61,249 @@ class Paginator(PaginatorDjango):
             yield from range(number + 1, self.num_pages + 1)
 
 
+class KeysetTokenSerializer(signing.JSONSerializer):
+    """Like signing.JSONSerializer but keeps full datetime precision, since
+    DjangoJSONEncoder truncates microseconds and a truncated key would skip
+    rows on page boundaries."""
+
+    def dumps(self, obj):
+        def default(o):
+            if isinstance(o, (datetime.datetime, datetime.date)):
+                return o.isoformat()
+            raise TypeError(f"{type(o)} is not a keyset value")
+
+        return json.dumps(obj, separators=(",", ":"), default=default).encode("latin-1")
+
+
+class KeysetPage(Page):
+    def __init__(self, object_list, number, paginator, has_next, has_previous):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+    def start_index(self):
+        if len(self.object_list) == 0:
+            return 0
+        return (self.paginator.per_page * (self.number - 1)) + 1
+
+    def end_index(self):
+        return self.start_index() + len(self.object_list) - 1
+
+    @cached_property
+    def next_page_url(self):
+        if not self.has_next() or len(self.object_list) == 0:
+            return None
+        return self.paginator.cursor_url("after", self.number + 1, self.object_list[-1])
+
+    @cached_property
+    def previous_page_url(self):
+        if not self.has_previous():
+            return None
+        if len(self.object_list) == 0 or self.number <= 2:
+            return self.paginator.url_fn(max(self.number - 1, 1))
+        return self.paginator.cursor_url("before", self.number - 1, self.object_list[0])
+
+
+class KeysetPaginator(Paginator):
+    """
+    Paginate ordered querysets by seeking past the ordering key values of the
+    last row of the previous page (keyset/cursor pagination) instead of using
+    OFFSET, so that every page costs the same regardless of its depth.
+
+    `object_list` is a queryset or a list of querysets of different models
+    with the same ordering, whose pages are merged. Ordering keys must be
+    model attributes or annotations and not NULL. The primary key is added as
+    a final tie-breaker if the ordering doesn't already end with it.
+
+    Numbered pages, i.e. /page/<n>/ urls, are still served with OFFSET up to
+    `max_offset_pages`. Pages after that are only reachable through the
+    "after"/"before" tokens of the previous/next page links.
+
+    If `head_pks` is given, it's the (possibly cached) primary keys of the
+    first `per_page * max_offset_pages + 1` objects in order, and numbered
+    pages are fetched by primary key from it.
+    """
+
+    CURSOR_SALT = "sic.views.utils.KeysetPaginator"
+
+    def __init__(
+        self,
+        object_list,
+        per_page,
+        *,
+        first_page_url,
+        url_fn,
+        max_offset_pages=10,
+        head_pks=None,
+    ):
+        if isinstance(object_list, QuerySet):
+            object_list = [object_list]
+        ordering = list(object_list[0].query.order_by)
+        if not ordering or not all(isinstance(key, str) for key in ordering):
+            raise ValueError("KeysetPaginator requires a queryset ordered by fields")
+        if ordering[-1].lstrip("-") not in ["pk", "id"]:
+            ordering.append("-pk" if ordering[-1].startswith("-") else "pk")
+        self.ordering = ordering
+        self.querysets = [qs.order_by(*ordering) for qs in object_list]
+        self.first_page_url = first_page_url
+        self.url_fn = url_fn
+        self.max_offset_pages = max_offset_pages
+        if head_pks is not None and len(self.querysets) != 1:
+            raise ValueError("head_pks requires a single queryset")
+        self.head_pks = head_pks
+        super().__init__(self.querysets, per_page)
+
+    @cached_property
+    def _bounded_count(self):
+        limit = self.per_page * self.max_offset_pages
+        if self.head_pks is not None:
+            return min(len(self.head_pks), limit + 1)
+        return min(sum(qs[: limit + 1].count() for qs in self.querysets), limit + 1)
+
+    @cached_property
+    def count(self):
+        """Number of objects up to `max_offset_pages` pages."""
+        return min(self._bounded_count, self.per_page * self.max_offset_pages)
+
+    @property
+    def has_more_pages(self):
+        """Are there more pages after the last numbered page?"""
+        return self._bounded_count > self.count
+
+    def _key(self, obj):
+        return [getattr(obj, key.lstrip("-")) for key in self.ordering]
+
+    def _sort(self, objs, forward=True):
+        # https://docs.python.org/3/howto/sorting.html#sort-stability-and-complex-sorts
+        for key in reversed(self.ordering):
+            objs.sort(
+                key=lambda o: getattr(o, key.lstrip("-")),
+                reverse=key.startswith("-") == forward,
+            )
+        return objs
+
+    def _seek(self, values, forward=True):
+        ret = None
+        for i, key in enumerate(self.ordering):
+            name = key.lstrip("-")
+            lookup = "lt" if key.startswith("-") == forward else "gt"
+            cond = Q(**{f"{name}__{lookup}": values[i]})
+            for prev_key, prev_value in zip(self.ordering[:i], values[:i]):
+                cond &= Q(**{prev_key.lstrip("-"): prev_value})
+            ret = cond if ret is None else ret | cond
+        return ret
+
+    def _fetch(self, querysets, limit, forward=True):
+        if not forward:
+            querysets = [
+                qs.order_by(
+                    *(k[1:] if k.startswith("-") else f"-{k}" for k in self.ordering)
+                )
+                for qs in querysets
+            ]
+        if len(querysets) == 1:
+            return list(querysets[0][:limit])
+        objs = []
+        for qs in querysets:
+            objs.extend(qs[:limit])
+        return self._sort(objs, forward)[:limit]
+
+    def cursor_url(self, direction, number, obj):
+        token = signing.dumps(
+            [number, self._key(obj)],
+            salt=self.CURSOR_SALT,
+            serializer=KeysetTokenSerializer,
+        )
+        return f"{self.first_page_url}?{urllib.parse.urlencode({direction: token})}"
+
+    def page(self, number):
+        """Return a numbered page with OFFSET, or from `head_pks`."""
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        if self.head_pks is not None:
+            pks = self.head_pks[bottom:top]
+            objs = self.querysets[0].in_bulk(pks)
+            return KeysetPage(
+                [objs[pk] for pk in pks if pk in objs],
+                number,
+                self,
+                has_next=len(self.head_pks) > top,
+                has_previous=number > 1,
+            )
+        if len(self.querysets) == 1:
+            objs = list(self.querysets[0][bottom : top + 1])
+        else:
+            objs = self._fetch(self.querysets, top + 1)[bottom:]
+        return KeysetPage(
+            objs[: self.per_page],
+            number,
+            self,
+            has_next=len(objs) > self.per_page,
+            has_previous=number > 1,
+        )
+
+    def page_from_token(self, token, forward=True):
+        try:
+            number, values = signing.loads(
+                token, salt=self.CURSOR_SALT, serializer=KeysetTokenSerializer
+            )
+            number = int(number)
+            if len(values) != len(self.ordering) or number < 1:
+                raise ValueError
+        except (signing.BadSignature, ValueError, TypeError) as exc:
+            raise InvalidPage("Invalid page token.") from exc
+        querysets = [qs.filter(self._seek(values, forward)) for qs in self.querysets]
+        objs = self._fetch(querysets, self.per_page + 1, forward)
+        more = len(objs) > self.per_page
+        objs = objs[: self.per_page]
+        if forward:
+            return KeysetPage(objs, number, self, has_next=more, has_previous=True)
+        objs.reverse()
+        if not more:
+            number = 1
+        return KeysetPage(objs, number, self, has_next=True, has_previous=more)
+
+    def page_from_request(self, request, number):
+        """Return the page requested by either an "after"/"before" token in the
+        request's GET parameters or by its page number."""
+        if "after" in request.GET:
+            return self.page_from_token(request.GET["after"], forward=True)
+        if "before" in request.GET:
+            return self.page_from_token(request.GET["before"], forward=False)
+        return self.page(number)
+
+    def get_elided_page_links(self, page, **kwargs):
+        """Return (page number, url) pairs of the numbered page links to show
+        for `page`, with (None, None) in place of elided pages."""
+        ret = [
+            (num, self.url_fn(num) if num else None)
+            for num in self.get_elided_page_range(
+                number=min(page.number, self.num_pages), **kwargs
+            )
+        ]
+        if self.has_more_pages:
+            if page.number > self.num_pages + 1:
+                ret.append((None, None))
+            if page.number > self.num_pages:
+                ret.append((page.number, None))
+            if page.has_next():
+                ret.append((None, None))
+        return ret
+
+
 def check_safe_url(url):
     if url is not None:
         url = url.strip()
@@ -2,7 +2,14 @@ import collections
 import typing
 from abc import ABC, abstractmethod
 from datetime import datetime, timedelta
+from django.db import connection
+from django.db.models.signals import post_save, m2m_changed
+from django.dispatch import receiver
 from django.utils.timezone import make_aware
+from django.apps import apps
+
+config = apps.get_app_config("sic")
+from sic.models import Story
 
 
 class PostRanking(ABC):
@@ -15,6 +22,23 @@ class PostRanking(ABC):
     ) -> typing.Optional[typing.Dict[typing.Any, typing.Any]]:
         None
 
+    def update_story_hotness(self, story: "sic.models.Story"):
+        """Recompute and persist the hotness_score column of a single story"""
+        Story.objects.filter(pk=story.pk).update(
+            hotness_score=self.story_hotness(story)
+        )
+
+    def decay_hotness(self):
+        """Recompute the persisted hotness_score of every active story. Called
+        periodically by the decay_hotness job so that time-dependent rankings
+        stay current."""
+        for story in (
+            Story.objects.filter(active=True)
+            .prefetch_related("tags", "comments")
+            .iterator(chunk_size=500)
+        ):
+            self.update_story_hotness(story)
+
 
 class KarmaRanking(PostRanking):
     HOTNESS_WINDOW = 60 * 60 * 22
@@ -53,7 +77,52 @@ class KarmaRanking(PostRanking):
             "domain_penalty": domain_penalty,
         }
 
+    def decay_hotness(self):
+        # Same formula as story_hotness_dict() in a single statement. Votes are
+        # applied incrementally by the sic_vote_*_hotness triggers in between
+        # runs, this only needs to refresh the time window penalty.
+        # Tag.hotness_modifier() is always zero so it's left out.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """UPDATE sic_story SET hotness_score = karma
+    + (CASE WHEN user_is_author AND url IS NOT NULL THEN 0.25 ELSE 0.0 END)
+    + 0.25 * COALESCE((SELECT SUM(c.karma) FROM sic_comment AS c WHERE c.story_id = sic_story.id AND c.user_id != sic_story.user_id), 0)
+    - ROUND(CAST((julianday('now') - julianday(created)) * 86400 AS INTEGER) / %s, 3)
+WHERE active;""",
+                [float(self.HOTNESS_WINDOW)],
+            )
+
 
 class TemporalRanking(PostRanking):
     def story_hotness(self, story: "sic.models.Story") -> int:
         return story.created.timestamp()
+
+    def decay_hotness(self):
+        # Score doesn't depend on time of evaluation
+        pass
+
+
+@receiver(post_save, sender=Story)
+def story_save_hotness_receiver(
+    sender, instance, created, raw, using, update_fields, **kwargs
+):
+    if raw:
+        return
+    if update_fields is not None and not (
+        {"karma", "url", "user_is_author", "active"} & set(update_fields)
+    ):
+        return
+    config.post_ranking.update_story_hotness(instance)
+
+
+@receiver(m2m_changed, sender=Story.tags.through)
+def story_tags_hotness_receiver(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ["post_add", "post_remove", "post_clear"]:
+        return
+    if reverse:
+        # instance is a Tag
+        stories = Story.objects.filter(pk__in=pk_set) if pk_set else instance.stories
+        for story in stories.all():
+            config.post_ranking.update_story_hotness(story)
+    else:
+        config.post_ranking.update_story_hotness(instance)
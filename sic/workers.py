@@ -0,0 +1,71 @@
+import logging
+import threading
+from datetime import datetime
+from django.db.models import Q
+from django.utils.timezone import make_aware
+
+logger = logging.getLogger("sic")
+
+
+class BackgroundWorker:
+    """Background thread of the current process that runs `target` whenever
+    wake() is called, usually when a transaction that queued work for it
+    commits. Wakes that arrive while `target` runs make it run once more."""
+
+    def __init__(self, name: str, target, error_message: str):
+        self.name = name
+        self.target = target
+        self.error_message = error_message
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.thread = None
+
+    def wake(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.name = self.name
+                self.thread.start()
+        self.event.set()
+
+    def run(self):
+        while True:
+            self.event.wait()
+            self.event.clear()
+            try:
+                self.target()
+            except Exception as exc:
+                logger.exception(f"{self.error_message}: {exc}")
+
+
+def unleased() -> Q:
+    """Rows whose `locked_until` lease is unset or has run out."""
+    now = make_aware(datetime.now())
+    return Q(locked_until__isnull=True) | Q(locked_until__lt=now)
+
+
+def due(field: str) -> Q:
+    """Rows whose `field` time is unset or has passed."""
+    now = make_aware(datetime.now())
+    return Q(**{f"{field}__isnull": True}) | Q(**{f"{field}__lte": now})
+
+
+def claim(queryset, limit, order_by, lease, **fields):
+    """Lease up to `limit` rows of `queryset` for `lease`, also setting
+    `fields` on them, and return their primary keys. Each row is taken with a
+    conditional UPDATE, so concurrent workers never claim the same row while
+    its lease lasts."""
+    locked_until = make_aware(datetime.now()) + lease
+    claimed = []
+    for pk in queryset.order_by(*order_by).values_list("pk", flat=True)[:limit]:
+        if queryset.filter(pk=pk).update(locked_until=locked_until, **fields):
+            claimed.append(pk)
+    return claimed
+
+
+def retry_after(attempts: int, retry_delay, max_retry_delay) -> datetime:
+    """When to retry after `attempts` consecutive failures: retry_delay,
+    doubled on each further failure, up to max_retry_delay."""
+    return make_aware(datetime.now()) + min(
+        retry_delay * 2 ** (attempts - 1), max_retry_delay
+    )
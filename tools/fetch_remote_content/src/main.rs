@@ -1,15 +1,23 @@
 use std::{
-    env, str,
+    env,
+    io::{self, Read},
+    str,
     sync::{Arc, Mutex},
 };
 extern crate readability;
 use poptea::{GeminiClient, NoTrustStore};
 use readability::extractor;
+use url::Url;
 
 fn get_http(url: &str) -> Result<String, Box<dyn std::error::Error>> {
     Ok(extractor::scrape(url)?.text)
 }
 
+/// Extract from a document that was already downloaded from `url`.
+fn read_http<R: Read>(input: &mut R, url: &str) -> Result<String, Box<dyn std::error::Error>> {
+    Ok(extractor::extract(input, &Url::parse(url)?)?.text)
+}
+
 fn get_gemini(url: &str) -> Result<String, Box<dyn std::error::Error>> {
     let gemini_response = poptea::TlsClient::new(Arc::new(Mutex::new(NoTrustStore::default())))
         .get(url)
@@ -22,11 +30,15 @@ fn get_gemini(url: &str) -> Result<String, Box<dyn std::error::Error>> {
 }
 
 fn main() -> Result<(), Box<dyn std::error::Error>> {
-    let url = env::args()
-        .nth(1)
-        .ok_or_else(|| "a single argument is required")?;
+    // Usage: fetch_remote_content [--stdin] URL
+    // With --stdin the HTML document of URL is read from standard input
+    // instead of being downloaded.
+    let mut args = env::args().skip(1).peekable();
+    let stdin = args.next_if(|arg| arg == "--stdin").is_some();
+    let url = args.next().ok_or_else(|| "a single argument is required")?;
 
     let archive_text = match url.split_once("://").ok_or_else(|| "scheme not provided")? {
+        ("https" | "http", _) if stdin => read_http(&mut io::stdin().lock(), &url)?,
         ("https" | "http", _) => get_http(&url)?,
         ("gemini", _) => get_gemini(&url)?,
         _ => return Err("unsuported protocol".into()),